@@ -0,0 +1,246 @@
+import functools
+import warnings
+
+import numpy as np
+from scipy.stats import rankdata
+
+from trend_batch import compact
+
+# Gaussian noise series simulated per series length for the null
+# distribution of binary segmentation
+NULL_SIMULATIONS = 10000
+
+
+def _segment_means(Xc, cp, n):
+    """Means of the values up to and after index cp (inclusive / exclusive) per row."""
+    k = np.arange(Xc.shape[1])
+    valid = k < n[:, None]
+    before = valid & (k <= cp[:, None])
+    after = valid & (k > cp[:, None])
+    X0 = np.where(valid, Xc, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_before = np.sum(np.where(before, X0, 0), axis=1) / before.sum(axis=1)
+        mean_after = np.sum(np.where(after, X0, 0), axis=1) / after.sum(axis=1)
+    return mean_before, mean_after
+
+
+def _labels(h, shift):
+    change = np.where(h & (shift > 0), 'increase', np.where(h & (shift < 0), 'decrease', 'no change'))
+    return change.astype(object)
+
+
+def pettitt_test_batch(X, alpha=0.05):
+    """
+    Pettitt change-point test for many series at once.
+
+    Uses the rank form U_t = 2 * sum(r_1..r_t) - t (n + 1) of the statistic,
+    so every row costs one ranking and one cumulative sum. Gives the same
+    values as ``pyhomogeneity.pettitt_test(x, sim=None)`` per row (cp there
+    counts from 1 and p is not capped at 1), with NaN values skipped.
+
+    Parameters
+    ----------
+    X : array-like
+        (series x time) array; rows may contain NaN.
+    alpha : float, optional
+        Significance level (default is 0.05).
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        'cp': 0-based index of the last value before the shift (among the valid
+        values of the row), 'K': max |U_t|, 'p': asymptotic p-value (capped at 1),
+        'h': significant, 'mean_before', 'mean_after', 'shift'
+        (after - before), 'change' ('increase', 'decrease', 'no change'),
+        'n' and 'valid' (at least 3 values).
+    """
+    Xc, n = compact(np.atleast_2d(np.asarray(X, dtype=float)))
+    r = rankdata(Xc, axis=1, nan_policy='omit')
+    t = np.arange(1, Xc.shape[1] + 1)
+    U = 2 * np.nancumsum(r, axis=1) - t * (n[:, None] + 1)
+    absU = np.where(t <= n[:, None], np.abs(U), -1)
+    cp = np.argmax(absU, axis=1)
+    K = absU[np.arange(len(Xc)), cp]
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        p = np.minimum(2 * np.exp(-6 * K ** 2 / (n ** 3 + n ** 2)), 1.0)
+    valid = n >= 3
+    p = np.where(valid, p, np.nan)
+    h = valid & (p < alpha)
+    mean_before, mean_after = _segment_means(Xc, cp, n)
+    shift = mean_after - mean_before
+    return {'cp': cp, 'K': K.astype(float), 'p': p, 'h': h, 'mean_before': mean_before,
+            'mean_after': mean_after, 'shift': shift, 'change': _labels(h, shift), 'n': n,
+            'valid': valid}
+
+
+def noise_sigma(Xc, n):
+    """
+    Robust noise level of each compacted row from the MAD of its first
+    differences, which a few mean shifts barely affect.
+    """
+    d = np.abs(np.diff(Xc, axis=1))
+    d[np.arange(d.shape[1]) >= (n - 1)[:, None]] = np.nan
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return 1.4826 * np.nanmedian(d, axis=1) / np.sqrt(2)
+
+
+def _first_split_gain(Xc, n, min_size):
+    """
+    Largest reduction of the squared error from splitting each whole
+    compacted row once (segments of at least min_size values).
+    """
+    n_series, n_time = Xc.shape
+    S = np.concatenate([np.zeros((n_series, 1)), np.cumsum(np.where(np.isnan(Xc), 0, Xc), axis=1)],
+                       axis=1)
+    j = np.arange(1, n_time)
+    left, right = j, n[:, None] - j
+    ok = (left >= min_size) & (right >= min_size)
+    total = S[np.arange(n_series), n][:, None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        diff = S[:, 1:-1] / left - (total - S[:, 1:-1]) / right
+        gain = np.where(ok, left * right / n[:, None] * diff ** 2, -np.inf)
+    return gain.max(axis=1, initial=-np.inf)
+
+
+@functools.lru_cache(maxsize=None)
+def null_gains(n, min_size, n_sim=NULL_SIMULATIONS, seed=0):
+    """
+    Sorted null distribution of the largest single-split gain, in units of
+    sigma^2 from `noise_sigma`, over n_sim Gaussian noise series of length n.
+
+    The maximum over all split positions is part of the statistic, so
+    quantiles and p-values taken from it account for the search.
+    """
+    Z = np.random.default_rng(seed).standard_normal((n_sim, n))
+    lengths = np.full(n_sim, n)
+    return np.sort(_first_split_gain(Z, lengths, min_size) / noise_sigma(Z, lengths) ** 2)
+
+
+def binary_segmentation_batch(X, max_changes=3, min_size=3, penalty=None, alpha=0.05):
+    """
+    Binary segmentation for shifts in the mean, over many series at once.
+
+    Each round splits, in every series, the segment whose best split reduces
+    the squared error the most; the split is kept while the reduction
+    exceeds penalty * sigma^2 (sigma from `noise_sigma`). All candidate
+    splits of all segments of all series are scored with prefix sums in
+    one array operation per round.
+
+    The default penalty is the 1 - alpha quantile of `null_gains`, the best
+    single split of Gaussian noise of the same length, so pure noise gets a
+    change in about alpha of the series; later rounds, which search more
+    segments, use the 1 - alpha / (round + 1) quantile. The p-value compares the best split
+    of the whole series with that null distribution, which corrects it for
+    the search over split positions; its resolution is 1 / NULL_SIMULATIONS.
+
+    Parameters
+    ----------
+    X : array-like
+        (series x time) array; rows may contain NaN.
+    max_changes : int, optional
+        Maximum change points per series (default is 3).
+    min_size : int, optional
+        Minimum segment length (default is 3).
+    penalty : float, optional
+        Required error reduction in units of sigma^2 (default is the null
+        quantile above).
+    alpha : float, optional
+        Significance level (default is 0.05).
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        'change_points': (series x max_changes) indices of the last value
+        before each shift in time order, -1 where unused; 'n_changes';
+        'cp': the main (largest) change, -1 when there is none; 'p':
+        Monte Carlo p-value of the best split; 'h': p < alpha and a change
+        was kept; 'mean_before' and 'mean_after' of the segments on either
+        side of the main change, 'shift', 'change', 'n' and 'valid'.
+    """
+    Xc, n = compact(np.atleast_2d(np.asarray(X, dtype=float)))
+    n_series, n_time = Xc.shape
+    rows = np.arange(n_series)
+    k = np.arange(n_time + 1)
+    X0 = np.where(np.isnan(Xc), 0, Xc)
+    S = np.concatenate([np.zeros((n_series, 1)), np.cumsum(X0, axis=1)], axis=1)
+    sigma = noise_sigma(Xc, n)
+    valid = n >= 2 * min_size
+
+    # Null quantile and p-value per distinct series length
+    with np.errstate(invalid='ignore', divide='ignore'):
+        score = _first_split_gain(Xc, n, min_size) / sigma ** 2
+    p = np.full(n_series, np.nan)
+    # Round r tests r + 1 segments, so its quantile is Bonferroni-corrected
+    levels = 1 - alpha / np.arange(1, max_changes + 1)
+    quantile = np.full((n_series, max_changes), np.inf)
+    for length in np.unique(n[valid]):
+        group = valid & (n == length)
+        null = null_gains(int(length), min_size)
+        exceed = len(null) - np.searchsorted(null, score[group], side='left')
+        p[group] = (exceed + 1) / (len(null) + 1)
+        quantile[group] = np.quantile(null, levels)
+    with np.errstate(invalid='ignore'):
+        threshold = (quantile if penalty is None else np.full_like(quantile, penalty)) * sigma[:, None] ** 2
+
+    # starts[i, j]: a segment of row i starts at j; the row end n closes the last one
+    starts = np.zeros((n_series, n_time + 1), dtype=bool)
+    starts[:, 0] = True
+    starts[rows, n] = True
+
+    def bounds():
+        # Nearest segment start at or before / at or after every index
+        before = np.maximum.accumulate(np.where(starts, k, 0), axis=1)
+        after = np.minimum.accumulate(np.where(starts, k, n_time)[:, ::-1], axis=1)[:, ::-1]
+        return before, after
+
+    gains = np.full((n_series, max_changes), -np.inf)
+    found = np.full((n_series, max_changes), -1)
+    j = k[:-1]
+    for step in range(max_changes):
+        # Candidate split at j: the right part starts at j, inside segment [a, b)
+        before, after = bounds()
+        a, b = before[:, :-1], after[:, :-1]
+        left, right = j - a, b - j
+        ok = ~starts[:, :-1] & (left >= min_size) & (right >= min_size) & (j < n[:, None])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            diff = ((S[:, :-1] - np.take_along_axis(S, a, axis=1)) / left
+                    - (np.take_along_axis(S, b, axis=1) - S[:, :-1]) / right)
+            gain = np.where(ok, left * right / (left + right) * diff ** 2, -np.inf)
+        best = np.argmax(gain, axis=1)
+        best_gain = gain[rows, best]
+        accept = valid & np.isfinite(best_gain) & (best_gain > threshold[:, step])
+        if not accept.any():
+            break
+        starts[rows[accept], best[accept]] = True
+        gains[accept, step] = best_gain[accept]
+        found[accept, step] = best[accept] - 1
+
+    n_changes = np.sum(found >= 0, axis=1)
+    change_points = np.sort(np.where(found >= 0, found, n_time), axis=1)
+    change_points[change_points == n_time] = -1
+    main = np.where(n_changes > 0, found[rows, np.argmax(gains, axis=1)], -1)
+
+    # Means of the segments [lo, j) and [j, hi) around the main change
+    before, after = bounds()
+    j = np.clip(main + 1, 1, n_time - 1)
+    lo = before[rows, j - 1]
+    hi = after[rows, j + 1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        m1 = (S[rows, j] - S[rows, lo]) / (j - lo)
+        m2 = (S[rows, hi] - S[rows, j]) / (hi - j)
+    has = n_changes > 0
+    h = has & valid & (p < alpha)
+    mean_before = np.where(has, m1, np.nan)
+    mean_after = np.where(has, m2, np.nan)
+    shift = mean_after - mean_before
+    return {'change_points': change_points, 'n_changes': n_changes, 'cp': main, 'p': p, 'h': h,
+            'mean_before': mean_before, 'mean_after': mean_after, 'shift': shift,
+            'change': _labels(h, shift), 'n': n, 'valid': valid}
+
+
+# analyze_change_points(method=...) -> batch detector
+METHODS = {
+    'pettitt': pettitt_test_batch,
+    'binseg': binary_segmentation_batch,
+}
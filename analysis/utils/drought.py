@@ -0,0 +1,483 @@
+import numpy as np
+import pandas as pd
+from scipy.special import gammainc
+from scipy.stats import norm
+
+
+# Standardized indices are clipped to this range (probabilities of ~1e-3)
+INDEX_BOUND = 3.09
+
+# Minimum non-zero values per calendar month for a distribution fit
+MIN_FIT_VALUES = 10
+
+SCALES = [1, 3, 6, 12]
+
+
+def monthly_matrix(df, value_col, id_col='huc12', date_col='Date'):
+    """
+    Reshapes a long monthly table into a (HUC12 x month) array on a gap-free
+    month axis.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Table in the 'Date,huc12,<values>' layout of the monthly stats CSVs.
+    value_col : str
+        Column to reshape.
+    id_col : str, optional
+        Polygon id column (default is 'huc12').
+    date_col : str, optional
+        Date column (default is 'Date').
+
+    Returns
+    -------
+    tuple
+        (ids, months, X): sorted ids, datetime64[M] months and the values,
+        NaN where a HUC12 has no row for a month.
+    """
+    dates = pd.to_datetime(df[date_col]).to_numpy().astype('datetime64[M]')
+    ids, rows = np.unique(df[id_col].to_numpy(), return_inverse=True)
+    months = np.arange(dates.min(), dates.max() + 1)
+    X = np.full((len(ids), len(months)), np.nan)
+    X[rows, (dates - months[0]).astype('int64')] = df[value_col].to_numpy(dtype=float)
+    return ids, months, X
+
+
+def _calendar_month(months):
+    """0-based calendar month of datetime64[M] values."""
+    return np.asarray(months, dtype='datetime64[M]').astype('int64') % 12
+
+
+def _period_mask(months, period):
+    """Columns of months inside an inclusive (start, end) period; all when None."""
+    months = np.asarray(months, dtype='datetime64[M]')
+    if period is None:
+        return np.ones(len(months), dtype=bool)
+    start, end = period
+    mask = np.ones(len(months), dtype=bool)
+    if start is not None:
+        mask &= months >= np.datetime64(str(start)[:7], 'M')
+    if end is not None:
+        mask &= months <= np.datetime64(str(end)[:7], 'M')
+    return mask
+
+
+def rolling_sum(X, scale, start=0):
+    """
+    Sum over the last `scale` months for every row, NaN unless all months
+    of the window are present.
+
+    Parameters
+    ----------
+    X : numpy.ndarray
+        (series x month) array.
+    scale : int
+        Window length in months.
+    start : int, optional
+        First output column; only the columns from `start` on are computed
+        (and returned), reading the scale - 1 months before it.
+
+    Returns
+    -------
+    numpy.ndarray
+        (series x (n_month - start)) accumulations.
+    """
+    first = max(start - scale + 1, 0)
+    X = np.asarray(X, dtype=float)[:, first:]
+    missing = np.isnan(X)
+    total = np.concatenate([np.zeros((len(X), 1)), np.cumsum(np.where(missing, 0, X), axis=1)], axis=1)
+    gaps = np.concatenate([np.zeros((len(X), 1)), np.cumsum(missing, axis=1)], axis=1)
+    out = np.full(X.shape, np.nan)
+    if X.shape[1] >= scale:
+        out[:, scale - 1:] = total[:, scale:] - total[:, :-scale]
+        out[:, scale - 1:][gaps[:, scale:] - gaps[:, :-scale] > 0] = np.nan
+    return out[:, start - first:]
+
+
+def _fit_gamma(values):
+    """Gamma (shape, scale) and zero probability per row, Thom's MLE approximation."""
+    valid = ~np.isnan(values)
+    n = valid.sum(axis=1)
+    positive = valid & (values > 0)
+    n_pos = positive.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        q = np.where(n > 0, (n - n_pos) / n, np.nan)
+        x = np.where(positive, values, np.nan)
+        mean = np.nanmean(x, axis=1)
+        A = np.log(mean) - np.nanmean(np.log(x), axis=1)
+        shape = (1 + np.sqrt(1 + 4 * A / 3)) / (4 * A)
+        scale = mean / shape
+    bad = (n_pos < MIN_FIT_VALUES) | ~(A > 0)
+    shape[bad] = np.nan
+    scale[bad] = np.nan
+    return shape, scale, q
+
+
+def _fit_glo(values):
+    """
+    Generalized logistic (xi, alpha, kappa) per row from unbiased L-moments
+    (Hosking, 1997), the SPEI distribution of the reference SPEI package.
+
+    The three-parameter log-logistic of Vicente-Serrano et al. (2010) is the
+    case kappa < 0 (positive skew, lower bound); kappa > 0 covers negatively
+    skewed water balances (upper bound), which the log-logistic cannot fit.
+    """
+    x = np.sort(values, axis=1)    # NaN sorts last
+    n = (~np.isnan(x)).sum(axis=1)[:, None]
+    i = np.arange(x.shape[1])[None, :]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x0 = np.where(np.isnan(x), 0, x)
+        b0 = np.sum(x0, axis=1) / n[:, 0]
+        b1 = np.sum(i / (n - 1) * x0, axis=1) / n[:, 0]
+        b2 = np.sum(i * (i - 1) / ((n - 1) * (n - 2)) * x0, axis=1) / n[:, 0]
+        l2 = 2 * b1 - b0
+        t3 = (6 * b2 - 6 * b1 + b0) / l2
+        kappa = -t3
+        # sin(k pi) / (k pi) -> 1 as k -> 0
+        small = np.abs(kappa) < 1e-6
+        k = np.where(small, 1.0, kappa)
+        ratio = np.where(small, 1.0, np.sin(k * np.pi) / (k * np.pi))
+        alpha = l2 * ratio
+        xi = b0 - np.where(small, 0.0, alpha * (1 / k - 1 / ratio / k))
+    bad = (n[:, 0] < MIN_FIT_VALUES) | ~(l2 > 0) | ~(np.abs(kappa) < 1)
+    for p in (xi, alpha, kappa):
+        p[bad] = np.nan
+    return xi, alpha, kappa
+
+
+def _glo_cdf(x, xi, alpha, kappa):
+    """Generalized logistic CDF; 0 / 1 beyond the lower / upper bound."""
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        small = np.abs(kappa) < 1e-6
+        k = np.where(small, 1.0, kappa)
+        arg = 1 - k * (x - xi) / alpha
+        y = np.where(arg > 0, -np.log(np.where(arg > 0, arg, 1)) / k, np.where(k > 0, np.inf, -np.inf))
+        y = np.where(small, (x - xi) / alpha, y)
+        return 1 / (1 + np.exp(-y))
+
+
+def _by_calendar_month(acc, months, calibration, fit):
+    """Runs a row-wise fit once per calendar month; returns params of shape (series x 12)."""
+    cal = _period_mask(months, calibration)
+    calendar = _calendar_month(months)
+    params = None
+    has_data = np.zeros((len(acc), 12), dtype=bool)
+    for m in range(12):
+        values = acc[:, cal & (calendar == m)]
+        has_data[:, m] = ~np.isnan(values).all(axis=1)
+        result = fit(values)
+        if params is None:
+            params = [np.full((len(acc), 12), np.nan) for _ in result]
+        for out, fitted in zip(params, result):
+            out[:, m] = fitted
+    failed = has_data & np.isnan(params[0])
+    if failed.any():
+        months_failed = ', '.join(f"{m + 1}: {c}" for m, c in enumerate(failed.sum(axis=0)) if c)
+        print(f"Warning: {failed.sum()} of {has_data.sum()} fits (series x calendar month) failed "
+              f"and give NaN; failures per calendar month {{{months_failed}}}")
+    return params
+
+
+def fit_spi(P, months, scale=3, calibration=None):
+    """
+    Fits the gamma distributions of the SPI for every series and calendar
+    month in one batch.
+
+    Parameters
+    ----------
+    P : numpy.ndarray
+        (HUC12 x month) precipitation.
+    months : numpy.ndarray
+        datetime64[M] labels of the columns (consecutive months).
+    scale : int, optional
+        Accumulation period in months (default is 3).
+    calibration : tuple, optional
+        Inclusive (start, end) months of the reference period, e.g.
+        ('1999-10', '2020-09'); all months when None.
+
+    Returns
+    -------
+    dict
+        'shape', 'scale' and 'q' (probability of zero), each (HUC12 x 12),
+        plus 'kind' and 'accumulation'.
+    """
+    acc = rolling_sum(P, scale)
+    shape, scale_, q = _by_calendar_month(acc, months, calibration, _fit_gamma)
+    return {'kind': 'spi', 'accumulation': scale, 'shape': shape, 'scale': scale_, 'q': q}
+
+
+def fit_spei(P, PET, months, scale=3, calibration=None):
+    """
+    Fits the generalized logistic distributions of the SPEI (climatic water
+    balance P - PET) for every series and calendar month in one batch.
+
+    Parameters
+    ----------
+    P, PET : numpy.ndarray
+        (HUC12 x month) precipitation and potential / reference ET in mm.
+    months : numpy.ndarray
+        datetime64[M] labels of the columns.
+    scale : int, optional
+        Accumulation period in months (default is 3).
+    calibration : tuple, optional
+        Inclusive (start, end) months of the reference period.
+
+    Returns
+    -------
+    dict
+        'xi' (location), 'alpha' (scale) and 'kappa' (shape), each
+        (HUC12 x 12), plus 'kind' and 'accumulation'.
+    """
+    acc = rolling_sum(np.asarray(P, dtype=float) - PET, scale)
+    xi, alpha, kappa = _by_calendar_month(acc, months, calibration, _fit_glo)
+    return {'kind': 'spei', 'accumulation': scale, 'xi': xi, 'alpha': alpha, 'kappa': kappa}
+
+
+def _standardize(probability):
+    with np.errstate(invalid='ignore'):
+        return np.clip(norm.ppf(probability), -INDEX_BOUND, INDEX_BOUND)
+
+
+def spi(P, months, scale=3, params=None, calibration=None, start=0):
+    """
+    Standardized Precipitation Index for every HUC12 and month.
+
+    Parameters
+    ----------
+    P : numpy.ndarray
+        (HUC12 x month) precipitation.
+    months : numpy.ndarray
+        datetime64[M] labels of the columns.
+    scale : int, optional
+        Accumulation period in months (default is 3).
+    params : dict, optional
+        Fit from `fit_spi`; fitted on P when None.
+    calibration : tuple, optional
+        Reference period used when fitting here.
+    start : int, optional
+        First column to compute; earlier columns are not returned.
+
+    Returns
+    -------
+    numpy.ndarray
+        (HUC12 x month) index, NaN for the first scale - 1 months and where
+        data or a fit is missing.
+    """
+    if params is None:
+        params = fit_spi(P, months, scale, calibration)
+    acc = rolling_sum(P, params['accumulation'], start)
+    m = _calendar_month(months[start:])
+    shape, scale_, q = params['shape'][:, m], params['scale'][:, m], params['q'][:, m]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        H = q + (1 - q) * gammainc(shape, np.maximum(acc, 0) / scale_)
+    H[np.isnan(acc)] = np.nan
+    return _standardize(H)
+
+
+def spei(P, PET, months, scale=3, params=None, calibration=None, start=0):
+    """
+    Standardized Precipitation-Evapotranspiration Index for every HUC12 and
+    month (see `spi` for the parameters; PET is potential or reference ET,
+    e.g. gridMET 'etr').
+
+    Returns
+    -------
+    numpy.ndarray
+        (HUC12 x month) index.
+    """
+    D = np.asarray(P, dtype=float) - PET
+    if params is None:
+        params = fit_spei(P, PET, months, scale, calibration)
+    acc = rolling_sum(D, params['accumulation'], start)
+    m = _calendar_month(months[start:])
+    F = _glo_cdf(acc, params['xi'][:, m], params['alpha'][:, m], params['kappa'][:, m])
+    F[np.isnan(acc)] = np.nan
+    return _standardize(F)
+
+
+def extend_index(index, params, P, months, PET=None):
+    """
+    Appends the months that are new since `index` was computed, keeping the
+    fitted distributions and without recomputing earlier months.
+
+    Parameters
+    ----------
+    index : numpy.ndarray
+        (HUC12 x month) SPI or SPEI computed earlier.
+    params : dict
+        The fit `index` was computed with.
+    P : numpy.ndarray
+        Precipitation over the full, extended month axis.
+    months : numpy.ndarray
+        datetime64[M] labels of the extended axis.
+    PET : numpy.ndarray, optional
+        Potential ET over the extended axis (SPEI only).
+
+    Returns
+    -------
+    numpy.ndarray
+        (HUC12 x len(months)) index.
+
+    Example
+    -------
+    >>> params = fit_spi(P, months, scale=3, calibration=('1999-10', '2020-09'))
+    >>> index = spi(P, months, params=params)
+    >>> index = extend_index(index, params, P_new, months_new)   # next month lands
+    """
+    start = index.shape[1]
+    if params['kind'] == 'spei':
+        new = spei(P, PET, months, params=params, start=start)
+    else:
+        new = spi(P, months, params=params, start=start)
+    return np.concatenate([index, new], axis=1)
+
+
+def save_params(path, params):
+    """Saves a fit from `fit_spi` / `fit_spei` as .npz."""
+    np.savez(path, **params)
+
+
+def load_params(path):
+    """Loads a fit saved by `save_params`."""
+    with np.load(path) as data:
+        params = {key: data[key] for key in data.files}
+    params['kind'] = str(params['kind'])
+    params['accumulation'] = int(params['accumulation'])
+    return params
+
+
+def climatology(X, months, calibration=None):
+    """
+    Mean of every calendar month per series over the reference period.
+
+    Returns
+    -------
+    numpy.ndarray
+        (series x 12) monthly normals, January first.
+    """
+    cal = _period_mask(months, calibration)
+    calendar = _calendar_month(months)
+    normals = np.full((len(X), 12), np.nan)
+    with np.errstate(invalid='ignore'):
+        for m in range(12):
+            columns = cal & (calendar == m)
+            if columns.any():
+                normals[:, m] = np.nanmean(X[:, columns], axis=1)
+    return normals
+
+
+def monthly_anomalies(X, months, calibration=None, relative=False):
+    """
+    Departures from the monthly climatology for every series and month.
+
+    Parameters
+    ----------
+    X : numpy.ndarray
+        (series x month) values.
+    months : numpy.ndarray
+        datetime64[M] labels of the columns.
+    calibration : tuple, optional
+        Inclusive (start, end) reference period.
+    relative : bool, optional
+        Percent of normal instead of the difference.
+
+    Returns
+    -------
+    numpy.ndarray
+        (series x month) anomalies.
+    """
+    normals = climatology(X, months, calibration)[:, _calendar_month(months)]
+    if relative:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return 100 * X / normals
+    return X - normals
+
+
+def water_year_cumulative(X, months, start_month=10):
+    """
+    Running total within each water year (restarting every October), e.g.
+    of P - ET. A missing month leaves the rest of its water year NaN.
+
+    Parameters
+    ----------
+    X : numpy.ndarray
+        (series x month) values, e.g. prism_ppt - openet_ensb_mean.
+    months : numpy.ndarray
+        datetime64[M] labels of the columns.
+    start_month : int, optional
+        First month of the year (default is 10, the water year).
+
+    Returns
+    -------
+    numpy.ndarray
+        (series x month) cumulative totals.
+    """
+    X = np.asarray(X, dtype=float)
+    missing = np.isnan(X)
+    total = np.cumsum(np.where(missing, 0, X), axis=1)
+    gaps = np.cumsum(missing, axis=1)
+    # Column where each column's water year starts
+    first = np.flatnonzero(_calendar_month(months) == start_month - 1)
+    year_start = np.zeros(X.shape[1], dtype='int64')
+    year_start[first] = first
+    year_start = np.maximum.accumulate(year_start)
+    before = year_start - 1
+    offset = np.where(before >= 0, total[:, np.maximum(before, 0)], 0)
+    gap_offset = np.where(before >= 0, gaps[:, np.maximum(before, 0)], 0)
+    out = total - offset
+    out[gaps - gap_offset > 0] = np.nan
+    return out
+
+
+def index_table(ids, months, columns, id_col='huc12'):
+    """
+    Long monthly table ('Date', id, 'month', 'year', 'irr_year',
+    'water_year', indices) of (series x month) arrays.
+
+    Parameters
+    ----------
+    ids : array-like
+        Series ids (rows of the arrays).
+    months : numpy.ndarray
+        datetime64[M] labels of the columns.
+    columns : dict
+        Output column -> (series x month) array, e.g. {'spi_3': ..., 'spei_12': ...}.
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    import trend_sen
+
+    ids = np.asarray(ids)
+    table = {'Date': np.tile(np.asarray(months, dtype='datetime64[M]').astype('datetime64[ns]'), len(ids)),
+             id_col: np.repeat(ids, len(months))}
+    for name, values in columns.items():
+        table[name] = np.asarray(values).ravel()
+    return trend_sen.add_calendar_columns(pd.DataFrame(table))
+
+
+def water_year_values(ids, months, columns, id_col='huc12', month=9):
+    """
+    One value per series and water year, taken at `month` (default
+    September), in the layout `trend_sen.analyze_trends` expects.
+
+    SPI-12 / SPEI-12 and the cumulative P - ET in September summarize the
+    whole water year; the result can go straight to
+    ``analyze_trends(df, var_list, sort_yr='water_year')`` and the trend
+    table to ``plot_trend_map``.
+
+    Returns
+    -------
+    pandas.DataFrame
+        id, 'water_year' and one column per entry of columns.
+    """
+    calendar = _calendar_month(months)
+    keep = calendar == month - 1
+    labels = np.asarray(months, dtype='datetime64[M]')[keep]
+    years = labels.astype('datetime64[Y]').astype('int64') + 1970 + (month >= 10)
+    ids = np.asarray(ids)
+    table = {id_col: np.repeat(ids, len(years)), 'water_year': np.tile(years, len(ids))}
+    for name, values in columns.items():
+        table[name] = np.asarray(values)[:, keep].ravel()
+    return pd.DataFrame(table)
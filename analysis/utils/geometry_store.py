@@ -0,0 +1,263 @@
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+
+# Equal-area CRS for areas and centroids (CONUS Albers, metres)
+AREA_CRS = 'EPSG:5070'
+
+# Raw zipped layers exported from Google Drive, relative to the repository root
+HUC12_ZIP = 'shapefiles/portneuf_huc12-20250606T184812Z-1-001.zip'
+AOI_ZIP = 'shapefiles/portneuf_aoi-20250606T184810Z-1-001.zip'
+
+# Sub-watershed partition of shapefile_clean.ipynb / combined_shp.ipynb:
+# UID -> (Name, source) and the UID of the AOI remainder
+PARTITION = {
+    101: ('Above Topaz', 'analysis2/shp/Above_Topaz/Above_Topaz.shp'),
+    102: ('Below Topaz', 'analysis2/shp/Below_Topaz/Below_Topaz.shp'),
+}
+REMAINDER = (103, 'Remaining Area')
+# The raw AOI; `repair` gives the same polygon as analysis2/shp/cleaned_aoi.zip
+PARTITION_AOI = AOI_ZIP
+
+
+def read_layer(path):
+    """
+    Reads a polygon layer from a shapefile, GeoParquet or a zip holding a
+    shapefile (in any subfolder).
+
+    Parameters
+    ----------
+    path : str
+        .shp, .parquet or .zip path.
+
+    Returns
+    -------
+    geopandas.GeoDataFrame
+    """
+    if path.endswith('.parquet'):
+        return gpd.read_parquet(path)
+    if path.endswith('.zip'):
+        with zipfile.ZipFile(path) as zf:
+            members = [m for m in zf.namelist() if m.lower().endswith('.shp')]
+        if not members:
+            raise FileNotFoundError(f"No shapefile in {path}")
+        return gpd.read_file(f"zip://{os.path.abspath(path)}!{members[0]}")
+    return gpd.read_file(path)
+
+
+def repair(gdf):
+    """
+    Makes geometries valid and keeps only their polygon parts.
+
+    Same effect as the ``buffer(0)`` cleaning of the notebooks, but
+    `shapely.make_valid` keeps every part of self-intersecting rings
+    instead of possibly dropping some.
+    """
+    gdf = gdf.copy()
+    geometry = shapely.make_valid(gdf.geometry.values)
+    # make_valid can return collections with stray lines or points
+    collections = shapely.get_type_id(geometry) == 7
+    if collections.any():
+        parts = [shapely.union_all([g for g in shapely.get_parts(c) if shapely.get_type_id(g) in (3, 6)])
+                 for c in geometry[collections]]
+        geometry[collections] = parts
+    gdf['geometry'] = geometry
+    return gdf[~gdf.geometry.is_empty]
+
+
+def normalize_huc12(values):
+    """
+    HUC12 ids as 12-character, zero-padded strings, whether they come in
+    as int64 (stats tables), floats (CSV with NaN) or strings (shapefiles).
+    """
+    values = pd.Series(values)
+    if pd.api.types.is_float_dtype(values):
+        values = values.astype('Int64')
+    return values.astype('string').str.strip().str.replace(r'\.0$', '', regex=True).str.zfill(12)
+
+
+def dissolve_partition(root='.', aoi=PARTITION_AOI, parts=PARTITION, remainder=REMAINDER):
+    """
+    Builds the sub-watershed partition of combined_shp.ipynb: each part
+    dissolved to one polygon and the rest of the AOI as the remainder.
+
+    Parameters
+    ----------
+    root : str, optional
+        Repository root the paths are relative to.
+    aoi : str, optional
+        AOI layer (shapefile or zip, default is the raw AOI_ZIP).
+    parts : dict, optional
+        UID -> (Name, layer path).
+    remainder : tuple, optional
+        (UID, Name) of the AOI minus all parts.
+
+    Returns
+    -------
+    geopandas.GeoDataFrame
+        'UID', 'Name' and geometry in the CRS of the AOI, sorted by UID.
+    """
+    aoi_gdf = repair(read_layer(os.path.join(root, aoi)))
+    crs = aoi_gdf.crs
+    rows = []
+    for uid, (name, path) in parts.items():
+        part = repair(read_layer(os.path.join(root, path))).to_crs(crs)
+        rows.append((uid, name, shapely.union_all(part.geometry.values)))
+    covered = shapely.union_all([geom for _, _, geom in rows])
+    rest = shapely.make_valid(shapely.union_all(aoi_gdf.geometry.values).difference(covered))
+    rows.append((remainder[0], remainder[1], rest))
+    gdf = gpd.GeoDataFrame({'UID': [r[0] for r in rows], 'Name': [r[1] for r in rows]},
+                           geometry=[r[2] for r in rows], crs=crs)
+    return repair(gdf).sort_values('UID').reset_index(drop=True)
+
+
+def build_layer(source, out_path, id_col='huc12', keep=None, overwrite=False):
+    """
+    Ingests a polygon layer once into GeoParquet.
+
+    Geometries are repaired, the key column is normalized (HUC12s become
+    12-character strings), and the area in km^2 and the centroid in both
+    the equal-area AREA_CRS and lon/lat are precomputed. The file is only
+    rebuilt when the source is newer or overwrite is True.
+
+    Parameters
+    ----------
+    source : str or geopandas.GeoDataFrame
+        Layer path (.shp, .zip such as HUC12_ZIP or AOI_ZIP, .parquet) or an
+        already built layer such as the output of `dissolve_partition`.
+    out_path : str
+        GeoParquet file to write.
+    id_col : str, optional
+        Key column (default is 'huc12').
+    keep : list of str, optional
+        Attribute columns to keep besides the key (default is all).
+    overwrite : bool, optional
+        Rebuild even if out_path is up to date.
+
+    Returns
+    -------
+    GeometryLayer
+        The stored layer with its spatial index.
+    """
+    if (isinstance(source, str) and not overwrite and os.path.exists(out_path)
+            and os.path.getmtime(out_path) >= os.path.getmtime(source)):
+        return GeometryLayer(out_path, id_col=id_col)
+
+    gdf = read_layer(source) if isinstance(source, str) else source
+    gdf = repair(gdf)
+    if keep is not None:
+        gdf = gdf[[id_col] + [c for c in keep if c != id_col] + ['geometry']]
+    if id_col == 'huc12':
+        gdf[id_col] = normalize_huc12(gdf[id_col]).to_numpy()
+    gdf = gdf.sort_values(id_col).reset_index(drop=True)
+
+    projected = gdf.geometry.to_crs(AREA_CRS)
+    centroids = projected.centroid
+    lonlat = centroids.to_crs('EPSG:4326')
+    gdf['area_km2'] = projected.area.to_numpy() / 1e6
+    gdf['centroid_x'] = centroids.x.to_numpy()
+    gdf['centroid_y'] = centroids.y.to_numpy()
+    gdf['centroid_lon'] = lonlat.x.to_numpy()
+    gdf['centroid_lat'] = lonlat.y.to_numpy()
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    gdf.to_parquet(out_path)
+    print(f"Saved: {out_path} ({len(gdf)} polygons)")
+    return GeometryLayer(out_path, id_col=id_col)
+
+
+class GeometryLayer:
+    """
+    Polygons from a GeoParquet written by `build_layer`, with an STRtree
+    for point-in-polygon and bounding-box queries and a key index for
+    lookups and joins.
+
+    Parameters
+    ----------
+    path : str
+        GeoParquet file.
+    id_col : str, optional
+        Key column (default is 'huc12').
+
+    Example
+    -------
+    >>> hucs = build_layer(HUC12_ZIP, 'geometry/huc12.parquet')
+    >>> hucs.locate([-112.3], [42.7])                 # HUC12 of each point
+    >>> merged = hucs.join(trend_df)                  # int or str huc12 keys
+    """
+
+    def __init__(self, path, id_col='huc12'):
+        self.path = path
+        self.id_col = id_col
+        self.gdf = gpd.read_parquet(path)
+        self.tree = shapely.STRtree(self.gdf.geometry.values)
+        self._position = pd.Index(self.gdf[id_col])
+
+    def __len__(self):
+        return len(self.gdf)
+
+    @property
+    def crs(self):
+        return self.gdf.crs
+
+    def lookup(self, ids):
+        """Rows of the given keys, in the order given; unknown keys raise KeyError."""
+        ids = pd.Series(np.atleast_1d(ids))
+        if self.id_col == 'huc12':
+            ids = normalize_huc12(ids)
+        position = self._position.get_indexer(ids)
+        if (position < 0).any():
+            raise KeyError(f"Unknown {self.id_col}: {list(ids[position < 0])}")
+        return self.gdf.iloc[position]
+
+    def locate(self, x, y, crs=None):
+        """
+        Key of the polygon containing each point (None outside all polygons).
+
+        Parameters
+        ----------
+        x, y : array-like
+            Point coordinates.
+        crs : optional
+            CRS of the points (default is the layer CRS).
+
+        Returns
+        -------
+        numpy.ndarray
+            One key per point.
+        """
+        points = shapely.points(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        if crs is not None:
+            points = gpd.GeoSeries(points, crs=crs).to_crs(self.crs).values
+        point_idx, poly_idx = self.tree.query(points, predicate='intersects')
+        keys = np.full(len(points), None, dtype=object)
+        # First polygon wins on shared edges
+        order = np.argsort(point_idx, kind='stable')
+        point_idx, poly_idx = point_idx[order], poly_idx[order]
+        first = np.r_[True, point_idx[1:] != point_idx[:-1]] if len(point_idx) else []
+        keys[point_idx[first]] = self.gdf[self.id_col].to_numpy()[poly_idx[first]]
+        return keys
+
+    def within(self, bounds):
+        """Rows whose geometry intersects (minx, miny, maxx, maxy)."""
+        idx = self.tree.query(shapely.box(*bounds), predicate='intersects')
+        return self.gdf.iloc[np.sort(idx)]
+
+    def join(self, df, on='huc12', how='left'):
+        """
+        Merges a stats or trend table onto the polygons, normalizing its key
+        (int64 or string HUC12s) first.
+
+        Returns
+        -------
+        geopandas.GeoDataFrame
+        """
+        df = df.copy()
+        if on == 'huc12':
+            df[on] = normalize_huc12(df[on]).to_numpy()
+        return self.gdf.merge(df, left_on=self.id_col, right_on=on, how=how)
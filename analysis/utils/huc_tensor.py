@@ -0,0 +1,299 @@
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# Monthly HUC12 tables, relative to the analysis folder: dataset -> CSV glob
+SOURCES = {
+    'prism': 'prism/prism_HUC12_monthly_stats.csv',
+    'gridmet': 'gridmet/gridMET_HUC12_monthly_stats.csv',
+    'openet': 'openet/openet_huc12_*.csv',
+}
+
+# Unit of each source column as stored in the CSVs (OpenET columns are mm)
+UNITS = {
+    'ppt': 'mm', 'tmean': 'degC', 'tmax': 'degC', 'tmin': 'degC',
+    'pr': 'mm', 'etr': 'mm', 'tmmn': 'K', 'tmmx': 'K',
+}
+DEFAULT_UNIT = 'mm'
+
+# (from, to) -> (scale, offset); values are stored as value * scale + offset
+CONVERSIONS = {
+    ('K', 'degC'): (1.0, -273.15),
+    ('degF', 'degC'): (5 / 9, -160 / 9),
+    ('in', 'mm'): (25.4, 0.0),
+    ('m', 'mm'): (1000.0, 0.0),
+}
+
+# Units every variable is normalized to
+TARGET_UNITS = {'K': 'degC', 'degF': 'degC', 'in': 'mm', 'm': 'mm'}
+
+VALUES_FILE = 'values.npy'
+INDEX_FILE = 'index.json'
+
+
+def _source_files(sources, base_dir):
+    files = []
+    for dataset, pattern in sources.items():
+        for path in sorted(glob.glob(os.path.join(base_dir, pattern))):
+            files.append((dataset, path))
+    return files
+
+
+def _fingerprint(files):
+    return [[dataset, os.path.abspath(path), os.path.getsize(path), os.stat(path).st_mtime_ns]
+            for dataset, path in files]
+
+
+def _read_source(path):
+    df = pd.read_csv(path)
+    df['huc12'] = df['huc12'].astype('int64')
+    # Months since 1970-01, the integer form of datetime64[M]
+    dates = pd.to_datetime(df['Date'], format='%Y-%m-%d')
+    df['month'] = (dates.dt.year - 1970) * 12 + dates.dt.month - 1
+    return df.drop(columns='Date')
+
+
+def build_tensor(out_dir, sources=None, base_dir='.', units=None, overwrite=False):
+    """
+    Builds the shared HUC12 x month x variable store from the monthly tables.
+
+    Every source CSV is read once; its value columns become variables named
+    '{dataset}_{column}' (e.g. 'prism_ppt', 'gridmet_tmmn', 'openet_ensb_mean'),
+    converted to normalized units (Kelvin -> degC, ...). Months and HUC12s are
+    the union over all sources, with NaN where a source has no value. The
+    values are saved as one float32 .npy array, one contiguous (huc12, month)
+    plane per variable, so `open_tensor` can memory-map it and any number of
+    processes share the same pages. The store is only rebuilt when a source
+    file changed or overwrite is True.
+
+    Parameters
+    ----------
+    out_dir : str
+        Folder of the store (values.npy + index.json).
+    sources : dict, optional
+        Dataset name -> CSV path or glob, relative to base_dir (default
+        is SOURCES).
+    base_dir : str, optional
+        Folder the source paths are relative to, usually the analysis folder.
+    units : dict, optional
+        Column -> unit overrides for columns not in UNITS.
+    overwrite : bool, optional
+        Rebuild even if the store is up to date.
+
+    Returns
+    -------
+    HucTensor
+        The store, opened memory-mapped.
+    """
+    sources = SOURCES if sources is None else sources
+    column_units = {**UNITS, **(units or {})}
+    files = _source_files(sources, base_dir)
+    if not files:
+        raise FileNotFoundError(f"No source tables found under {base_dir}")
+    fingerprint = _fingerprint(files)
+
+    index_path = os.path.join(out_dir, INDEX_FILE)
+    if not overwrite and os.path.exists(index_path):
+        with open(index_path) as f:
+            if json.load(f).get('sources') == fingerprint:
+                return open_tensor(out_dir)
+
+    tables = []
+    variables = []
+    units_out = {}
+    for dataset, path in files:
+        df = _read_source(path)
+        columns = []
+        for column in df.columns.drop(['huc12', 'month']):
+            name = f"{dataset}_{column}"
+            if name in units_out:
+                # e.g. ensb_mean is in both openet_huc12_ensb.csv and openet_huc12_mean.csv
+                continue
+            unit = column_units.get(column, DEFAULT_UNIT)
+            target = TARGET_UNITS.get(unit, unit)
+            if target != unit:
+                scale, offset = CONVERSIONS[unit, target]
+                df[column] = df[column] * scale + offset
+            units_out[name] = target
+            variables.append(name)
+            columns.append((column, name))
+        tables.append((df, columns))
+        print(f"Read {path}: {len(df)} rows, {len(columns)} variables")
+
+    hucs = np.unique(np.concatenate([df['huc12'].to_numpy() for df, _ in tables]))
+    months = np.unique(np.concatenate([df['month'].to_numpy() for df, _ in tables]))
+    months = np.arange(months[0], months[-1] + 1).astype('datetime64[M]')
+
+    os.makedirs(out_dir, exist_ok=True)
+    tmp_path = os.path.join(out_dir, VALUES_FILE + '.tmp')
+    values = np.lib.format.open_memmap(tmp_path, mode='w+', dtype='float32',
+                                       shape=(len(variables), len(hucs), len(months)))
+    values[:] = np.nan
+    position = {name: i for i, name in enumerate(variables)}
+    for df, columns in tables:
+        rows = np.searchsorted(hucs, df['huc12'].to_numpy())
+        cols = df['month'].to_numpy() - months[0].astype('int64')
+        for column, name in columns:
+            values[position[name], rows, cols] = df[column].to_numpy(dtype='float32')
+    values.flush()
+    del values
+    os.replace(tmp_path, os.path.join(out_dir, VALUES_FILE))
+
+    index = {
+        'huc12': hucs.tolist(),
+        'start': str(months[0]),
+        'variables': variables,
+        'units': units_out,
+        'sources': fingerprint,
+    }
+    with open(index_path, 'w') as f:
+        json.dump(index, f, indent=1)
+    print(f"Saved: {out_dir} ({len(variables)} variables x {len(hucs)} HUC12 x {len(months)} months)")
+    return open_tensor(out_dir)
+
+
+def open_tensor(path):
+    """
+    Opens a store written by `build_tensor`, memory-mapped read-only.
+
+    Parameters
+    ----------
+    path : str
+        Folder of the store.
+
+    Returns
+    -------
+    HucTensor
+    """
+    with open(os.path.join(path, INDEX_FILE)) as f:
+        index = json.load(f)
+    values = np.load(os.path.join(path, VALUES_FILE), mmap_mode='r')
+    return HucTensor(values, index)
+
+
+class HucTensor:
+    """
+    Labelled HUC12 x month x variable array backed by a memory-mapped file.
+
+    Indexing by variable name returns a zero-copy (huc12, month) view;
+    `sel` slices several variables, HUC12s and a month range at once.
+    Units are in `units` (temperatures in degC, water depths in mm).
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        (variable, huc12, month) array, usually a read-only memmap.
+    index : dict
+        Labels as stored in index.json.
+
+    Example
+    -------
+    >>> t = build_tensor('huc_tensor', base_dir='..')
+    >>> bias = t['prism_ppt'] - t['gridmet_pr']    # all HUC12s x months
+    >>> et, p = t.sel(['openet_ensb_mean', 'prism_ppt'], start='2000-10', end='2020-09')
+    >>> ratio = np.nansum(et, axis=1) / np.nansum(p, axis=1)
+    """
+
+    def __init__(self, values, index):
+        self.values = values
+        self.huc12 = np.asarray(index['huc12'], dtype='int64')
+        self.variables = list(index['variables'])
+        self.units = dict(index['units'])
+        start = np.datetime64(index['start'], 'M')
+        self.months = start + np.arange(values.shape[2])
+        self._position = {name: i for i, name in enumerate(self.variables)}
+
+    @property
+    def shape(self):
+        """(variable, huc12, month) sizes, the layout of `values`."""
+        return len(self.variables), len(self.huc12), len(self.months)
+
+    def _rows(self, huc12):
+        requested = np.atleast_1d(np.asarray(huc12, dtype='int64'))
+        rows = np.minimum(np.searchsorted(self.huc12, requested), len(self.huc12) - 1)
+        missing = requested[self.huc12[rows] != requested]
+        if len(missing):
+            raise KeyError(f"HUC12 not in store: {missing.tolist()}")
+        return rows
+
+    def __getitem__(self, variable):
+        return self.values[self._position[variable]]
+
+    def _month_slice(self, start, end):
+        first = 0 if start is None else int(np.datetime64(str(start)[:7], 'M') - self.months[0])
+        last = len(self.months) if end is None else int(np.datetime64(str(end)[:7], 'M') - self.months[0]) + 1
+        return slice(max(first, 0), max(last, 0))
+
+    def sel(self, variables=None, huc12=None, start=None, end=None):
+        """
+        Slices variables, HUC12s and an inclusive month range.
+
+        The month range is a view; selecting variables or HUC12s copies only
+        the selected planes / rows.
+
+        Parameters
+        ----------
+        variables : list of str, optional
+            Variable names (default is all).
+        huc12 : int or list of int, optional
+            HUC12 ids (default is all).
+        start, end : str or datetime, optional
+            First and last month, e.g. '2000-10' and '2020-09'.
+
+        Returns
+        -------
+        numpy.ndarray
+            (variable, huc12, month) values.
+
+        Raises
+        ------
+        KeyError
+            For HUC12 ids that are not in the store.
+        """
+        data = self.values[:, :, self._month_slice(start, end)]
+        if variables is not None:
+            data = data[[self._position[v] for v in variables]]
+        if huc12 is not None:
+            data = data[:, self._rows(huc12)]
+        return data
+
+    def months_in(self, start=None, end=None):
+        """Month labels of `sel(start=start, end=end)`."""
+        return self.months[self._month_slice(start, end)]
+
+    def to_xarray(self, variables=None, start=None, end=None):
+        """
+        The selection as an xarray.DataArray with dims ('huc12', 'month',
+        'variable') and the units of each variable in attrs.
+        """
+        import xarray as xr
+
+        variables = self.variables if variables is None else list(variables)
+        data = self.sel(variables, start=start, end=end)
+        return xr.DataArray(
+            np.moveaxis(data, 0, -1),
+            dims=('huc12', 'month', 'variable'),
+            coords={'huc12': self.huc12, 'month': self.months_in(start, end).astype('datetime64[ns]'),
+                    'variable': variables},
+            attrs={'units': json.dumps({v: self.units[v] for v in variables})},
+        )
+
+    def to_frame(self, variables=None, start=None, end=None):
+        """
+        Long 'Date,huc12,<variables>' table, the layout of the monthly stats
+        CSVs, for the existing trend and plotting helpers.
+        """
+        variables = self.variables if variables is None else list(variables)
+        data = self.sel(variables, start=start, end=end)
+        months = self.months_in(start, end)
+        table = {
+            'Date': np.tile(months.astype('datetime64[ns]'), len(self.huc12)),
+            'huc12': np.repeat(self.huc12, len(months)),
+        }
+        for i, name in enumerate(variables):
+            table[name] = data[i].ravel()
+        return pd.DataFrame(table)
@@ -0,0 +1,248 @@
+import json
+import re
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+NLCD_CLASSES = {
+    11: "Open Water",
+    12: "Perennial Ice/Snow",
+    21: "Developed, Open Space",
+    22: "Developed, Low Intensity",
+    23: "Developed, Medium Intensity",
+    24: "Developed, High Intensity",
+    31: "Barren Land",
+    41: "Deciduous Forest",
+    42: "Evergreen Forest",
+    43: "Mixed Forest",
+    52: "Shrub/Scrub",
+    71: "Grassland/Herbaceous",
+    81: "Pasture/Hay",
+    82: "Cultivated Crops",
+    90: "Woody Wetlands",
+    95: "Emergent Herbaceous Wetlands",
+}
+
+# Class groups by CDL code, for `ClassTable.rollup`
+CDL_GROUPS = {
+    'small_grains': [21, 22, 23, 24, 25, 27, 28, 29, 30, 205],
+    'hay_forage': [36, 37, 58, 59, 176],
+    'row_crops': [1, 4, 5, 12, 41, 42, 43],
+    'fallow': [61],
+    'developed': [82, 121, 122, 123, 124],
+    'forest': [63, 141, 142, 143],
+    'shrubland': [64, 152],
+    'wetlands': [87, 190, 195],
+    'water': [83, 111],
+}
+
+HISTOGRAM_ENTRY = re.compile(r'(\d+)=([^,}]+)')
+
+
+def load_code_map(path='../cdl/cdl_code_map.json'):
+    """
+    Reads a class code map such as cdl_code_map.json as {int code: name}.
+    """
+    with open(path, 'r') as f:
+        return {int(code): name for code, name in json.load(f).items()}
+
+
+def column_name(name):
+    """Wide-table column name of a class, e.g. 'Winter Wheat' -> 'Winter_Wheat'."""
+    return name.replace(' ', '_')
+
+
+def parse_histogram(s):
+    """
+    Parses an Earth Engine histogram string '{24=31991.7, 61=8052.5}' into
+    {code: pixel count}. Empty or missing strings give {}.
+    """
+    if pd.isna(s):
+        return {}
+    return {int(code): float(count) for code, count in HISTOGRAM_ENTRY.findall(s)}
+
+
+class ClassTable:
+    """
+    Long-format land-cover table: one row per non-zero (Year, id, class).
+
+    Memory grows with the number of non-zero entries instead of HUC-years x
+    classes like the wide CDL_percent.csv / NLCD_percent.csv tables. Classes
+    are keyed by their integer code; names come from the code map.
+
+    Args:
+        data (pandas.DataFrame): Columns 'Year', id_col, 'code', 'value'.
+        code_map (dict): Class code -> name (CDL map or NLCD_CLASSES).
+        units (str): 'pixels' or 'percent'.
+        keys (pandas.DataFrame): All 'Year', id_col pairs, including those
+            without any non-zero class (defaults to the pairs in data).
+        id_col (str): Polygon identifier column, 'huc12' or 'UID' for the
+            analysis2 sub-watershed tables.
+    """
+
+    def __init__(self, data, code_map, units='pixels', keys=None, id_col='huc12'):
+        keys = data if keys is None else keys
+        self.id_col = id_col
+        self.keys = pd.DataFrame({
+            'Year': keys['Year'].to_numpy(dtype='int16'),
+            id_col: keys[id_col].to_numpy(dtype='int64'),
+        }).drop_duplicates().sort_values(['Year', id_col], ignore_index=True)
+        data = data[data['value'].notna() & (data['value'] != 0)]
+        self.data = pd.DataFrame({
+            'Year': data['Year'].to_numpy(dtype='int16'),
+            id_col: data[id_col].to_numpy(dtype='int64'),
+            'code': data['code'].to_numpy(dtype='int16'),
+            'value': data['value'].to_numpy(dtype='float32'),
+        }).sort_values(['Year', id_col, 'code'], kind='mergesort', ignore_index=True)
+        self.code_map = code_map
+        self.units = units
+
+    @classmethod
+    def from_histograms(cls, csv_files, code_map, id_col='huc12'):
+        """
+        Builds the table directly from the raw 'Year, <id_col>, histogram' CSVs
+        (e.g. Pneuf_CDL/CDL_pixel_counts_HUC12_*.csv) without a wide step.
+        """
+        df = pd.concat([pd.read_csv(f) for f in csv_files], ignore_index=True)
+        entries = [parse_histogram(s) for s in df['histogram']]
+        lengths = np.array([len(e) for e in entries])
+        data = pd.DataFrame({
+            'Year': np.repeat(df['Year'].to_numpy(), lengths),
+            id_col: np.repeat(df[id_col].to_numpy(), lengths),
+            'code': [code for e in entries for code in e],
+            'value': [count for e in entries for count in e.values()],
+        })
+        return cls(data, code_map, units='pixels', keys=df, id_col=id_col)
+
+    @classmethod
+    def from_wide(cls, df, code_map, units='percent', id_col='huc12'):
+        """
+        Converts a wide table (CDL_percent.csv, NLCD_pixel_count.csv, ...) whose
+        class columns are names from the code map (or raw codes).
+        """
+        codes = {}
+        for code, name in sorted(code_map.items()):
+            codes[column_name(name)] = code      # repeated names keep the newer code
+        class_cols = [c for c in df.columns if c not in ('Year', id_col)]
+        col_codes = [codes[c] if c in codes else int(c) for c in class_cols]
+        values = df[class_cols].to_numpy(dtype='float32')
+        rows, cols = np.nonzero(np.nan_to_num(values))
+        data = pd.DataFrame({
+            'Year': df['Year'].to_numpy()[rows],
+            id_col: df[id_col].to_numpy()[rows],
+            'code': np.asarray(col_codes)[cols],
+            'value': values[rows, cols],
+        })
+        return cls(data, code_map, units=units, keys=df, id_col=id_col)
+
+    @classmethod
+    def read_csv(cls, path, code_map, units='percent', id_col='huc12'):
+        """Reads a wide CSV such as 'CDL_percent.csv' into a ClassTable."""
+        return cls.from_wide(pd.read_csv(path), code_map, units=units, id_col=id_col)
+
+    @property
+    def nbytes(self):
+        return int(self.data.memory_usage(index=False).sum()
+                   + self.keys.memory_usage(index=False).sum())
+
+    def _code(self, cls_):
+        if isinstance(cls_, str):
+            names = {column_name(n): c for c, n in sorted(self.code_map.items())}
+            return names[column_name(cls_)]
+        return int(cls_)
+
+    def percent(self):
+        """
+        Converts pixel counts to percent of each HUC-year's total pixels.
+        """
+        if self.units == 'percent':
+            return self
+        total = self.data.groupby(['Year', self.id_col])['value'].transform('sum')
+        data = self.data.assign(value=self.data['value'] / total * 100)
+        return ClassTable(data, self.code_map, units='percent', keys=self.keys, id_col=self.id_col)
+
+    def series(self, cls_):
+        """
+        Time series of one class (code or name) for every HUC-year, 0 where absent.
+
+        Returns
+        -------
+        pandas.DataFrame
+            'Year', id_col and the class column.
+        """
+        code = self._code(cls_)
+        name = column_name(self.code_map.get(code, str(code)))
+        hits = self.data.loc[self.data['code'] == code, ['Year', self.id_col, 'value']]
+        out = self.keys.merge(hits, on=['Year', self.id_col], how='left')
+        return out.rename(columns={'value': name}).fillna({name: 0})
+
+    def top_n(self, n=5):
+        """
+        The n largest classes of every HUC-year.
+
+        Returns
+        -------
+        pandas.DataFrame
+            'Year', id_col, 'rank' (1 = largest), 'code', 'class', 'value'.
+        """
+        data = self.data.sort_values(['Year', self.id_col, 'value'], ascending=[True, True, False],
+                                     kind='mergesort')
+        data['rank'] = data.groupby(['Year', self.id_col]).cumcount() + 1
+        top = data[data['rank'] <= n].reset_index(drop=True)
+        top.insert(4, 'class', top['code'].map(lambda c: column_name(self.code_map.get(c, str(c)))))
+        return top[['Year', self.id_col, 'rank', 'code', 'class', 'value']]
+
+    def rollup(self, groups=CDL_GROUPS):
+        """
+        Sums classes into groups, e.g. all small grains.
+
+        Parameters
+        ----------
+        groups : dict
+            Group name -> list of class codes (default is CDL_GROUPS).
+
+        Returns
+        -------
+        pandas.DataFrame
+            'Year', id_col and one column per group (0 where absent).
+        """
+        lookup = {code: name for name, codes in groups.items() for code in codes}
+        grouped = self.data.assign(group=self.data['code'].map(lookup)).dropna(subset=['group'])
+        wide = grouped.pivot_table(index=['Year', self.id_col], columns='group', values='value',
+                                   aggfunc='sum', fill_value=0)
+        out = self.keys.merge(wide.reset_index(), on=['Year', self.id_col], how='left')
+        cols = list(groups)
+        for col in cols:
+            if col not in out:
+                out[col] = 0.0
+        out[cols] = out[cols].fillna(0)
+        return out[['Year', self.id_col] + cols]
+
+    def to_sparse(self):
+        """
+        HUC-year x class sparse matrix.
+
+        Returns
+        -------
+        tuple
+            (scipy.sparse.csr_matrix, keys DataFrame of 'Year'/id_col per row,
+            class codes per column).
+        """
+        keys = self.keys
+        row = pd.MultiIndex.from_frame(keys).get_indexer(
+            pd.MultiIndex.from_frame(self.data[['Year', self.id_col]]))
+        codes, col = np.unique(self.data['code'].to_numpy(), return_inverse=True)
+        matrix = sparse.csr_matrix((self.data['value'].to_numpy(), (row, col)),
+                                   shape=(len(keys), len(codes)))
+        return matrix, keys, codes
+
+    def to_wide(self):
+        """
+        Dense wide table with class-name columns, like CDL_percent.csv.
+        """
+        matrix, keys, codes = self.to_sparse()
+        names = [column_name(self.code_map.get(c, str(c))) for c in codes]
+        wide = pd.DataFrame(matrix.toarray(), columns=names).replace(0, np.nan)
+        return pd.concat([keys, wide], axis=1)
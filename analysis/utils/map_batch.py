@@ -0,0 +1,347 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import geopandas as gpd
+import shapely
+from matplotlib.figure import Figure
+from matplotlib.collections import PatchCollection
+from matplotlib.colors import Normalize, TwoSlopeNorm
+from matplotlib.patches import PathPatch
+from matplotlib.path import Path
+
+
+# Simplification tolerance in metres (EPSG:3857); well below a pixel at 300 dpi
+SIMPLIFY_TOLERANCE = 30
+
+
+def _digest(*parts):
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+    return digest.hexdigest()
+
+
+def prepare_geometry(gdf, epsg=3857, tolerance=SIMPLIFY_TOLERANCE, cache_dir=None):
+    """
+    Reprojects polygons (Web Mercator by default) and simplifies them once.
+
+    The result is cached as GeoParquet keyed on the input geometry, CRS,
+    target CRS and tolerance, so repeated map batches skip the reprojection
+    entirely.
+
+    Parameters
+    ----------
+    gdf : geopandas.GeoDataFrame
+        Polygons (e.g. the HUC12s merged with their trend columns).
+    epsg : int or None, optional
+        Target CRS; None keeps the CRS of gdf.
+    tolerance : float, optional
+        Simplification tolerance in metres (topology preserving), converted
+        to degrees for a geographic CRS.
+    cache_dir : str or None, optional
+        Folder for cached geometry.
+
+    Returns
+    -------
+    geopandas.GeoDataFrame
+        Copy of gdf with reprojected, simplified geometry.
+    """
+    cache_path = None
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        key = _digest(b''.join(shapely.to_wkb(gdf.geometry.values)), gdf.crs, epsg, tolerance)
+        cache_path = os.path.join(cache_dir, f'geometry_{key}.parquet')
+        if os.path.exists(cache_path):
+            geometry = gpd.read_parquet(cache_path).geometry
+            return gdf.set_geometry(geometry.set_axis(gdf.index)).set_crs(geometry.crs,
+                                                                            allow_override=True)
+
+    geometry = gdf.geometry.to_crs(epsg=epsg) if epsg else gdf.geometry
+    if geometry.crs is not None and geometry.crs.is_geographic:
+        tolerance = tolerance / 111320
+    geometry = geometry.simplify(tolerance, preserve_topology=True)
+    if cache_path:
+        gpd.GeoDataFrame(geometry=geometry.reset_index(drop=True)).to_parquet(cache_path)
+    return gdf.set_geometry(geometry)
+
+
+def basemap_image(bounds, source=None, zoom='auto', cache_dir=None):
+    """
+    Basemap tiles for a Web Mercator extent, stitched once and kept on disk.
+
+    A cached image is used without any network access, so maps render
+    offline once the cache exists (copy the cache folder to an air-gapped
+    machine). When tiles are neither cached nor reachable, None is returned
+    and render_trend_maps draws the polygons in their own CRS without one.
+
+    Parameters
+    ----------
+    bounds : tuple
+        (minx, miny, maxx, maxy) in EPSG:3857.
+    source : xyzservices.TileProvider or None, optional
+        Tile provider (default is CartoDB Positron, as in plot_trend_map).
+    zoom : int or 'auto', optional
+        Tile zoom level.
+    cache_dir : str or None, optional
+        Folder for cached images (.npz).
+
+    Returns
+    -------
+    tuple or None
+        (RGB(A) image array, extent as (minx, maxx, miny, maxy)).
+    """
+    import contextily as ctx
+
+    source = source or ctx.providers.CartoDB.Positron
+    url = source.build_url() if hasattr(source, 'build_url') else str(source)
+    cache_path = None
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        key = _digest(np.round(bounds, 1).tobytes(), url, zoom)
+        cache_path = os.path.join(cache_dir, f'basemap_{key}.npz')
+        if os.path.exists(cache_path):
+            cached = np.load(cache_path)
+            return cached['image'], tuple(cached['extent'])
+
+    try:
+        image, extent = ctx.bounds2img(*bounds, zoom=zoom, source=source)
+    except Exception as e:
+        print(f"Basemap unavailable ({e.__class__.__name__}); drawing maps without it")
+        return None
+    if cache_path:
+        np.savez_compressed(cache_path, image=image, extent=np.asarray(extent))
+    return image, tuple(extent)
+
+
+def _polygon_paths(geometries):
+    """One compound matplotlib Path (all parts and holes) per geometry."""
+    paths = []
+    for geom in geometries:
+        parts = getattr(geom, 'geoms', [geom])
+        rings = [ring for part in parts if not part.is_empty
+                 for ring in [part.exterior, *part.interiors]]
+        if not rings:
+            paths.append(Path(np.empty((0, 2))))
+            continue
+        vertices = np.concatenate([np.asarray(ring.coords)[:, :2] for ring in rings])
+        codes = np.concatenate([[Path.MOVETO] + [Path.LINETO] * (len(ring.coords) - 2) + [Path.CLOSEPOLY]
+                                for ring in rings])
+        paths.append(Path(vertices, codes))
+    return paths
+
+
+def _norm(values, vmin, vmax, center_zero, cmap):
+    """Color normalization of plot_trend_map, including its non-diverging fallback."""
+    if vmin is None:
+        vmin = np.nanmin(values)
+    if vmax is None:
+        vmax = np.nanmax(values)
+    if center_zero:
+        if vmin < 0 and vmax > 0:
+            return TwoSlopeNorm(vmin=vmin, vcenter=0, vmax=vmax), cmap
+        print(f"Warning: Data range ({vmin:.2f}, {vmax:.2f}) does not cross 0. Using linear Normalize instead.")
+        cmap = 'Blues' if vmax > 0 else 'Reds'
+    return Normalize(vmin=vmin, vmax=vmax), cmap
+
+
+class _MapTemplate:
+    """
+    Figure, axes, basemap, polygon collections and colorbar built once and
+    restyled for every map.
+    """
+
+    def __init__(self, wkbs, basemap, figsize, aspect, show_significance_border,
+                 show_significance_marker, hatch_non_significant):
+        geoms = shapely.from_wkb(wkbs)
+        paths = _polygon_paths(geoms)
+        self.fig = Figure(figsize=figsize)
+        self.ax = self.fig.add_subplot()
+        ax = self.ax
+        if basemap is not None:
+            image, extent = basemap
+            ax.imshow(image, extent=extent, interpolation='bilinear', zorder=0)
+        self.fill = PatchCollection([PathPatch(p) for p in paths], edgecolor='gray', linewidth=0.5,
+                                    zorder=1)
+        ax.add_collection(self.fill)
+        # Significance layers are redrawn from the subset of patches of each map
+        self.patches = [PathPatch(p) for p in paths]
+        self.hatch = None
+        if hatch_non_significant:
+            self.hatch = PatchCollection([], facecolor='none', edgecolor='gray', hatch='...', zorder=2)
+            ax.add_collection(self.hatch)
+        self.border = None
+        if show_significance_border:
+            self.border = PatchCollection([], facecolor='none', edgecolor='black', linewidth=1.2,
+                                          zorder=3)
+            ax.add_collection(self.border)
+        self.markers = None
+        self.centroids = shapely.get_coordinates(shapely.centroid(geoms))
+        if show_significance_marker:
+            self.markers = ax.scatter([], [], marker='*', color='black', s=30, zorder=4)
+
+        minx, miny, maxx, maxy = shapely.total_bounds(geoms)
+        pad_x, pad_y = (maxx - minx) * 0.05, (maxy - miny) * 0.05
+        ax.set_xlim(minx - pad_x, maxx + pad_x)
+        ax.set_ylim(miny - pad_y, maxy + pad_y)
+        ax.set_aspect(aspect)
+        if basemap is not None:
+            ax.set_xticks([])
+            ax.set_yticks([])
+        else:
+            ax.set_xlabel('Longitude')
+            ax.set_ylabel('Latitude')
+        ax.set_axisbelow(True)
+        ax.grid(True, linestyle='--', linewidth=0.5, alpha=0.5)
+        ax.set_facecolor('white')
+        self.fill.set_array(np.zeros(len(paths)))
+        self.cbar = self.fig.colorbar(self.fill, ax=ax)
+        self.fig.tight_layout()
+
+    def render(self, values, pvalues, title, cbar_label, norm, cmap, significance_level, save_path, dpi):
+        self.fill.set_array(np.ma.masked_invalid(values))
+        self.fill.set_cmap(cmap)
+        self.fill.set_norm(norm)
+        if pvalues is not None:
+            sig = pvalues <= significance_level
+            if self.border is not None:
+                self.border.set_paths([self.patches[i] for i in np.flatnonzero(sig)])
+            if self.hatch is not None:
+                self.hatch.set_paths([self.patches[i] for i in np.flatnonzero(~sig)])
+            if self.markers is not None:
+                self.markers.set_offsets(self.centroids[sig].reshape(-1, 2))
+        self.ax.set_title(title, fontsize=15)
+        self.cbar.update_normal(self.fill)
+        self.cbar.ax.set_ylabel(cbar_label, fontsize=12)
+        os.makedirs(os.path.dirname(os.path.abspath(save_path)), exist_ok=True)
+        self.fig.savefig(save_path, dpi=dpi, bbox_inches='tight')
+        print(f"Saved: {save_path}")
+
+
+def _render_chunk(wkbs, basemap, maps, options):
+    template = _MapTemplate(wkbs, basemap, options['figsize'], options['aspect'],
+                            options['show_significance_border'],
+                            options['show_significance_marker'], options['hatch_non_significant'])
+    for spec in maps:
+        template.render(spec['values'], spec['pvalues'], spec['title'], spec['cbar_label'],
+                        spec['norm'], spec['cmap'], options['significance_level'],
+                        spec['save_path'], options['dpi'])
+    return [spec['save_path'] for spec in maps]
+
+
+def render_trend_maps(
+    gdf,
+    maps,
+    vmin=None,
+    vmax=None,
+    center_zero=True,
+    cmap='RdBu',
+    hatch_non_significant=False,
+    show_significance_border=True,
+    show_significance_marker=False,
+    significance_level=0.05,
+    figsize=(12, 8),
+    dpi=300,
+    basemap=True,
+    basemap_source=None,
+    cache_dir=None,
+    n_jobs=None,
+):
+    """
+    Renders many slope / p-value maps of the same polygons to files.
+
+    Batch counterpart of trend_sen.plot_trend_map with the same styling.
+    The geometry is reprojected and simplified once (cached), basemap tiles
+    are fetched once and cached on disk, and each worker process builds a
+    single figure template whose colors, significance borders/markers,
+    title and colorbar are updated per map instead of replotting.
+
+    Parameters
+    ----------
+    gdf : geopandas.GeoDataFrame
+        Polygons with the slope and p-value columns (e.g. merged_gdf_cs).
+    maps : list of dict
+        One dict per map with 'slope_col', 'save_path' and optionally
+        'pval_col', 'title', 'cbar_label', 'vmin', 'vmax', 'cmap'. Without
+        'pval_col' the map has no significance marking (like plot_gdf).
+    vmin, vmax : float or None, optional
+        Shared color limits, e.g. the 1st/99th percentiles of all slopes;
+        per-map values in `maps` take precedence, None uses each map's range.
+    center_zero : bool, optional
+        Diverging color scale centred at 0 (TwoSlopeNorm).
+    cmap : str, optional
+        Colormap name.
+    hatch_non_significant, show_significance_border, show_significance_marker : bool, optional
+        Significance styling, as in plot_trend_map.
+    significance_level : float, optional
+        P-value threshold.
+    figsize : tuple, optional
+        Figure size.
+    dpi : int, optional
+        Output resolution.
+    basemap : bool, optional
+        Draw a CartoDB Positron basemap (or basemap_source) behind the polygons.
+    basemap_source : xyzservices.TileProvider or None, optional
+        Tile provider.
+    cache_dir : str or None, optional
+        Folder for cached geometry and basemap images
+        (e.g. '../utils/map_cache'); needed for offline rendering.
+    n_jobs : int or None, optional
+        Worker processes (None uses all cores, 1 renders in-process).
+
+    Returns
+    -------
+    list of str
+        Paths of the saved maps.
+
+    Example
+    -------
+    >>> maps = [{'slope_col': f'{v}_slope', 'pval_col': f'{v}_p',
+    ...          'title': f"{v} (Irr year) Sen's Slope with * for p < 0.05",
+    ...          'cbar_label': "Sen's Slope (mm/year)",
+    ...          'save_path': f'graphics/{v}_irr_year_trend_map.png'} for v in ['pr', 'etr']]
+    >>> map_batch.render_trend_maps(merged_gdf_cs, maps, vmin=vmin, vmax=vmax,
+    ...                             cache_dir='map_cache')
+    """
+    # Like plot_trend_map, Web Mercator only when drawn over a basemap
+    prepared = prepare_geometry(gdf, epsg=3857 if basemap else None, cache_dir=cache_dir)
+    image = None
+    if basemap:
+        image = basemap_image(tuple(prepared.total_bounds), basemap_source, cache_dir=cache_dir)
+        if image is None:
+            # No tiles: draw in the source CRS so the Longitude/Latitude axes hold
+            prepared = prepare_geometry(gdf, epsg=None, cache_dir=cache_dir)
+
+    specs = []
+    for m in maps:
+        values = prepared[m['slope_col']].to_numpy(dtype=float)
+        pvalues = prepared[m['pval_col']].to_numpy(dtype=float) if m.get('pval_col') else None
+        norm, map_cmap = _norm(values, m.get('vmin', vmin), m.get('vmax', vmax), center_zero,
+                               m.get('cmap', cmap))
+        specs.append({
+            'values': values, 'pvalues': pvalues, 'norm': norm, 'cmap': map_cmap,
+            'title': m.get('title', 'Trend Map'), 'cbar_label': m.get('cbar_label', "Sen's Slope"),
+            'save_path': m['save_path'],
+        })
+    # Geographic coordinates get the latitude-corrected aspect of GeoDataFrame.plot
+    aspect = 'equal'
+    if prepared.crs is not None and prepared.crs.is_geographic:
+        miny, maxy = prepared.total_bounds[[1, 3]]
+        aspect = 1 / np.cos(np.radians((miny + maxy) / 2))
+    options = {
+        'figsize': figsize, 'aspect': aspect, 'dpi': dpi, 'significance_level': significance_level,
+        'show_significance_border': show_significance_border,
+        'show_significance_marker': show_significance_marker,
+        'hatch_non_significant': hatch_non_significant,
+    }
+    wkbs = shapely.to_wkb(prepared.geometry.values)
+
+    n_workers = min(n_jobs or os.cpu_count() or 1, len(specs))
+    if n_workers <= 1:
+        return _render_chunk(wkbs, image, specs, options)
+    chunks = [specs[i::n_workers] for i in range(n_workers)]
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        list(pool.map(_render_chunk, [wkbs] * n_workers, [image] * n_workers, chunks,
+                      [options] * n_workers))
+    return [spec['save_path'] for spec in specs]
@@ -0,0 +1,236 @@
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import rasterio
+import shapely
+from rasterio import features, windows
+from rasterio.enums import Resampling
+
+from landcover import ClassTable, NLCD_CLASSES
+
+
+# NLCD values that are not land cover (unclassified / fill)
+NODATA_VALUES = (0, 255)
+CULTIVATED = (81, 82)
+# Pixel block size for the exact coverage of polygon-edge pixels
+EDGE_BLOCK = 32
+
+
+def tile_windows(src, tiles_per_side=4):
+    """
+    Groups the raster's native blocks into square windows of
+    tiles_per_side x tiles_per_side blocks (1024 x 1024 pixels for 256-pixel
+    NLCD tiles), so each read is aligned with the GeoTIFF's own tiling.
+    """
+    block_h, block_w = src.block_shapes[0]
+    step_h, step_w = block_h * tiles_per_side, block_w * tiles_per_side
+    return [
+        windows.Window(col, row, min(step_w, src.width - col), min(step_h, src.height - row))
+        for row in range(0, src.height, step_h)
+        for col in range(0, src.width, step_w)
+    ]
+
+
+def preview(raster_path, max_size=1024):
+    """
+    Coarse preview of a raster read from its overviews (.ovr) when present.
+
+    The decimated read lets GDAL pick the closest overview level instead of
+    reading the full-resolution raster.
+
+    Parameters
+    ----------
+    raster_path : str
+        GeoTIFF such as 'NLCD_2005.tif'.
+    max_size : int, optional
+        Longest side of the preview in pixels.
+
+    Returns
+    -------
+    tuple
+        (masked array with NLCD nodata masked, affine transform of the preview).
+    """
+    with rasterio.open(raster_path) as src:
+        factor = max(1, int(np.ceil(max(src.width, src.height) / max_size)))
+        shape = (int(np.ceil(src.height / factor)), int(np.ceil(src.width / factor)))
+        data = src.read(1, out_shape=shape, resampling=Resampling.nearest)
+        transform = src.transform * src.transform.scale(src.width / shape[1], src.height / shape[0])
+    return np.ma.masked_where(np.isin(data, NODATA_VALUES), data), transform
+
+
+def _coverage(geom, window_transform, shape):
+    """
+    Fraction of each pixel of a window covered by geom.
+
+    Interior pixels get 1; only pixels crossed by the boundary are intersected
+    exactly, which matches the fractional weights of Earth Engine histograms.
+    """
+    touched = features.geometry_mask([geom], shape, window_transform, invert=True, all_touched=True)
+    edge = features.geometry_mask([geom.boundary], shape, window_transform, invert=True,
+                                  all_touched=True)
+    cover = touched.astype('float64')
+    edge &= touched
+    # Intersect edge pixels per small block against the geometry clipped to
+    # that block, so each intersection only sees a few nearby vertices
+    for r0 in range(0, shape[0], EDGE_BLOCK):
+        for c0 in range(0, shape[1], EDGE_BLOCK):
+            rows, cols = np.nonzero(edge[r0:r0 + EDGE_BLOCK, c0:c0 + EDGE_BLOCK])
+            if not len(rows):
+                continue
+            rows, cols = rows + r0, cols + c0
+            xs, ys = rasterio.transform.xy(window_transform, rows, cols, offset='ul')
+            xe, ye = rasterio.transform.xy(window_transform, rows + 1, cols + 1, offset='ul')
+            x0, x1 = np.minimum(xs, xe), np.maximum(xs, xe)
+            y0, y1 = np.minimum(ys, ye), np.maximum(ys, ye)
+            part = shapely.clip_by_rect(geom, x0.min(), y0.min(), x1.max(), y1.max())
+            boxes = shapely.box(x0, y0, x1, y1)
+            cover[rows, cols] = shapely.area(shapely.intersection(boxes, part)) / shapely.area(boxes)
+    return cover
+
+
+def _window_counts(raster_path, window, geoms, poly_idx, write_mask, cultivated):
+    """Weighted class counts of one window for the polygons that overlap it."""
+    with rasterio.open(raster_path) as src:
+        data = src.read(1, window=window)
+        window_transform = src.window_transform(window)
+    valid = ~np.isin(data, NODATA_VALUES)
+    counts = {}
+    mask = np.full(data.shape, 255, dtype='uint8') if write_mask else None
+    for i, wkb in zip(poly_idx, geoms):
+        cover = _coverage(shapely.from_wkb(wkb), window_transform, data.shape)
+        cover[~valid] = 0
+        if cover.any():
+            counts[i] = np.bincount(data.ravel(), weights=cover.ravel(), minlength=256)
+        if write_mask:
+            inside = cover > 0
+            mask[inside] = np.isin(data[inside], cultivated).astype('uint8')
+    return window, counts, mask
+
+
+def _run(raster_path, polygons, id_col, tiles_per_side, n_jobs, mask_path=None, cultivated=CULTIVATED):
+    gdf = gpd.read_file(polygons) if isinstance(polygons, (str, os.PathLike)) else polygons
+    with rasterio.open(raster_path) as src:
+        gdf = gdf.to_crs(src.crs)
+        tiles = tile_windows(src, tiles_per_side)
+        bounds = [src.window_bounds(w) for w in tiles]
+        profile = src.profile
+
+    tree = shapely.STRtree(gdf.geometry.values)
+    wkbs = shapely.to_wkb(gdf.geometry.values)
+    jobs = []
+    for window, (left, bottom, right, top) in zip(tiles, bounds):
+        hits = tree.query(shapely.box(left, bottom, right, top), predicate='intersects')
+        if len(hits):
+            jobs.append((raster_path, window, list(wkbs[hits]), list(hits), mask_path is not None,
+                         cultivated))
+
+    totals = np.zeros((len(gdf), 256))
+    dst = None
+    if mask_path:
+        profile.update(dtype='uint8', nodata=255, count=1)
+        dst = rasterio.open(mask_path, 'w', **profile)
+    try:
+        with ProcessPoolExecutor(max_workers=n_jobs) if n_jobs != 1 else nullcontext() as pool:
+            if pool is None:
+                outputs = (_window_counts(*job) for job in jobs)
+            else:
+                outputs = pool.map(_window_counts, *zip(*jobs)) if jobs else []
+            for window, counts, mask in outputs:
+                for i, hist in counts.items():
+                    totals[i] += hist
+                if dst is not None:
+                    dst.write(mask, 1, window=window)
+    finally:
+        if dst is not None:
+            dst.close()
+    return gdf[id_col].to_numpy(), totals
+
+
+def class_counts(raster_path, polygons, id_col='UID', year=None, tiles_per_side=4, n_jobs=None):
+    """
+    Per-polygon NLCD class pixel counts, computed tile by tile.
+
+    The raster is read in windows aligned with its native tiles, so memory
+    is bounded by one window per worker regardless of raster size; windows
+    are processed in a process pool. Boundary pixels are weighted by the
+    fraction inside the polygon, like the Earth Engine histograms behind
+    NLCD_pixel_count.csv.
+
+    Parameters
+    ----------
+    raster_path : str
+        NLCD GeoTIFF (e.g. 'NLCD_2005.tif').
+    polygons : str or geopandas.GeoDataFrame
+        Polygons, e.g. '../shp/portneuf3_clean/portneuf3_clean.shp'.
+    id_col : str, optional
+        Polygon identifier ('UID' for the sub-watersheds, 'huc12').
+    year : int or None, optional
+        NLCD year; taken from the file name when None.
+    tiles_per_side : int, optional
+        Native blocks per window side.
+    n_jobs : int or None, optional
+        Worker processes (None uses all cores, 1 runs in-process).
+
+    Returns
+    -------
+    landcover.ClassTable
+        Pixel counts keyed by 'Year' and id_col; use `.to_wide()` for the
+        NLCD_pixel_count.csv / NLCD_3P_pixel_count.csv layout and
+        `.percent().to_wide()` for NLCD_percent.csv.
+    """
+    if year is None:
+        match = re.search(r'(\d{4})', os.path.basename(raster_path))
+        year = int(match.group(1)) if match else 0
+    ids, totals = _run(raster_path, polygons, id_col, tiles_per_side, n_jobs)
+    rows, codes = np.nonzero(totals)
+    data = pd.DataFrame({'Year': year, id_col: ids[rows], 'code': codes, 'value': totals[rows, codes]})
+    keys = pd.DataFrame({'Year': np.full(len(ids), year), id_col: ids})
+    return ClassTable(data, NLCD_CLASSES, units='pixels', keys=keys, id_col=id_col)
+
+
+def cultivated_mask(raster_path, polygons, output_path, id_col='UID', cultivated=CULTIVATED,
+                    tiles_per_side=4, n_jobs=None):
+    """
+    Writes a cultivated / non-cultivated mask and returns cultivated shares.
+
+    The mask GeoTIFF has the source grid and tiling: 1 for cultivated
+    classes (Pasture/Hay and Cultivated Crops by default), 0 for other land
+    cover inside the polygons and 255 outside or on nodata.
+
+    Parameters
+    ----------
+    raster_path : str
+        NLCD GeoTIFF.
+    polygons : str or geopandas.GeoDataFrame
+        Polygons such as the three Portneuf sub-watersheds.
+    output_path : str
+        Mask GeoTIFF to write.
+    id_col : str, optional
+        Polygon identifier.
+    cultivated : tuple of int, optional
+        NLCD codes counted as cultivated.
+    tiles_per_side, n_jobs : int, optional
+        As in `class_counts`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        id_col, 'cultivated' and 'non_cultivated' pixel counts and
+        'cultivated_percent' per polygon.
+    """
+    ids, totals = _run(raster_path, polygons, id_col, tiles_per_side, n_jobs,
+                       mask_path=output_path, cultivated=cultivated)
+    crop = totals[:, list(cultivated)].sum(axis=1)
+    total = totals.sum(axis=1)
+    print(f"Saved: {output_path}")
+    return pd.DataFrame({
+        id_col: ids,
+        'cultivated': crop,
+        'non_cultivated': total - crop,
+        'cultivated_percent': np.where(total > 0, crop / np.where(total > 0, total, 1) * 100, np.nan),
+    })
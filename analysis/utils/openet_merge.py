@@ -0,0 +1,98 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+MODELS = ['ensb', 'sebal', 'sims', 'ptjpl', 'alexi', 'sseb', 'metric']
+STATS = ['mean', '25th', '50th', '75th']
+KEYS = ['Date', 'huc12']
+
+
+def model_files(folder, models=MODELS, years=range(1999, 2024)):
+    """
+    Lists the yearly OpenET_{model}_monthly_stat_{year}.csv files per model.
+
+    Years without a file (e.g. alexi before 2001) are skipped.
+
+    Returns
+    -------
+    dict
+        Model -> list of existing CSV paths in year order.
+    """
+    files = {}
+    for model in models:
+        paths = [os.path.join(folder, f'OpenET_{model}_monthly_stat_{year}.csv') for year in years]
+        files[model] = [path for path in paths if os.path.exists(path)]
+    return files
+
+
+def merge_models(folder, models=MODELS, years=range(1999, 2024), stats=STATS):
+    """
+    Merges the yearly OpenET model tables into one wide (Date, huc12) table.
+
+    Replaces the per-model ``pd.concat`` plus chain of outer ``pd.merge``
+    calls: a first pass reads only the key columns to build the shared
+    (Date, huc12) index, and a second pass reads one file at a time into its
+    model's columns of a preallocated array, so at most one yearly table is
+    in memory besides the result and the cost grows linearly with models and
+    statistics. Rows a model does not cover (alexi's missing early years)
+    simply stay NaN.
+
+    Parameters
+    ----------
+    folder : str
+        Folder with the yearly CSVs (e.g. 'Pneuf_Open_ET_HUC12').
+    models : list of str, optional
+        Model names; columns are ordered by model, then statistic.
+    years : iterable of int, optional
+        Years to read (default is 1999-2023).
+    stats : list of str, optional
+        Statistic columns of the yearly files (default is mean and the
+        25th/50th/75th percentiles).
+
+    Returns
+    -------
+    tuple of pandas.DataFrame
+        (merged, mean): the full table with '{model}_{stat}' columns and its
+        'Date', 'huc12', '{model}_mean' projection.
+
+    Example
+    -------
+    >>> merged, df_mean = merge_models('Pneuf_Open_ET_HUC12')
+    >>> df_mean.to_csv('openet_huc12_mean.csv', index=False)
+    """
+    files = model_files(folder, models, years)
+    sources = [(m, path) for m, model in enumerate(models) for path in files[model]]
+
+    # First pass: the shared (Date, huc12) index in first-seen order, built
+    # from the key columns only, with an integer key (days since epoch, huc12)
+    key_frames = [pd.read_csv(path, usecols=KEYS) for _, path in sources]
+    lengths = [len(df) for df in key_frames]
+    dates = pd.concat([df['Date'] for df in key_frames], ignore_index=True)
+    huc12 = np.concatenate([df['huc12'].to_numpy(dtype='int64') for df in key_frames])
+    del key_frames
+    days = pd.to_datetime(dates, format='%Y-%m-%d').to_numpy().astype('datetime64[D]').astype('int64')
+    codes, uniques = pd.factorize(days * 10**12 + huc12)
+    first = np.unique(codes, return_index=True)[1]
+    keys = pd.DataFrame({'Date': dates.to_numpy()[first], 'huc12': huc12[first]})
+    del dates, huc12, days
+
+    # Second pass: one file at a time fills its rows of the model's block of
+    # a preallocated array
+    columns = [f'{model}_{stat}' for model in models for stat in stats]
+    values = np.full((len(uniques), len(columns)), np.nan)
+    offset = 0
+    for (m, path), length in zip(sources, lengths):
+        rows = codes[offset:offset + length]
+        offset += length
+        df = pd.read_csv(path, usecols=stats)
+        for k, stat in enumerate(stats):
+            values[rows, m * len(stats) + k] = df[stat].to_numpy(dtype=float)
+    for model in models:
+        print(f'Merged {model}: {len(files[model])} files')
+
+    merged = pd.concat([keys, pd.DataFrame(values, columns=columns)], axis=1)
+    mean_cols = [f'{model}_mean' for model in models]
+    mean = merged[KEYS + mean_cols] if 'mean' in stats else None
+    return merged, mean
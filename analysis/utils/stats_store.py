@@ -0,0 +1,173 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+# Columns kept at full width; every other float column is stored as float32
+KEY_COLUMNS = ['Date', 'Year', 'year', 'huc12', 'UID']
+
+
+def normalize_table(df, huc12_dtype='int64', float_dtype='float32'):
+    """
+    Applies the typed schema used by the Parquet store.
+
+    'huc12' becomes int64 (or categorical), 'Date' datetime64, 'Year' int16
+    and all other float columns float32.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Table as read from one of the *_HUC12_*.csv files.
+    huc12_dtype : str, optional
+        'int64' (default, matches comparisons like df['huc12'] == 170402080608)
+        or 'category'.
+    float_dtype : str, optional
+        Storage type of the value columns (default is 'float32').
+
+    Returns
+    -------
+    pandas.DataFrame
+        The converted table.
+    """
+    df = df.copy()
+    if 'huc12' in df:
+        df['huc12'] = df['huc12'].astype('int64').astype(huc12_dtype)
+    if 'Date' in df:
+        df['Date'] = pd.to_datetime(df['Date'], format='%Y-%m-%d')
+    if 'Year' in df:
+        df['Year'] = df['Year'].astype('int16')
+    floats = [c for c in df.select_dtypes('float').columns if c not in KEY_COLUMNS]
+    df[floats] = df[floats].astype(float_dtype)
+    return df
+
+
+def csv_to_parquet(csv_path, store_path=None, float_dtype='float32', overwrite=False):
+    """
+    Converts a HUC12 stats CSV once into a Parquet dataset partitioned by year.
+
+    Tables are partitioned into 'year=YYYY' folders by the calendar year of
+    their 'Date' column, or by their 'Year' column for yearly tables; huc12 is
+    stored as int64 so it can be filtered on. The store is only rebuilt when the CSV is newer than it or overwrite is True.
+
+    Parameters
+    ----------
+    csv_path : str
+        Source CSV, e.g. 'gridmet/gridMET_HUC12_monthly_stats.csv'.
+    store_path : str or None, optional
+        Target folder (default is the CSV path with a '.parquet' suffix).
+    float_dtype : str, optional
+        Passed to `normalize_table`.
+    overwrite : bool, optional
+        Rebuild even if the store is up to date.
+
+    Returns
+    -------
+    str
+        Path of the Parquet dataset.
+    """
+    store_path = store_path or os.path.splitext(csv_path)[0] + '.parquet'
+    if (not overwrite and os.path.exists(store_path)
+            and os.path.getmtime(store_path) >= os.path.getmtime(csv_path)):
+        return store_path
+
+    df = normalize_table(pd.read_csv(csv_path), 'int64', float_dtype)
+    partition_cols = None
+    if 'Date' in df:
+        df['year'] = df['Date'].dt.year.astype('int16')
+        partition_cols = ['year']
+    elif 'Year' in df:
+        df['year'] = df['Year']
+        partition_cols = ['year']
+
+    if os.path.exists(store_path):
+        shutil.rmtree(store_path)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_to_dataset(table, store_path, partition_cols=partition_cols)
+    print(f"Saved: {store_path} ({len(df)} rows)")
+    return store_path
+
+
+def build_store(csv_paths, **kwargs):
+    """
+    Converts several CSVs with `csv_to_parquet`, skipping up-to-date stores.
+
+    Parameters
+    ----------
+    csv_paths : list of str
+        CSV files, e.g. glob.glob('openet/openet_huc12_*.csv').
+    **kwargs
+        Passed to `csv_to_parquet`.
+
+    Returns
+    -------
+    dict
+        CSV path -> Parquet dataset path.
+    """
+    return {path: csv_to_parquet(path, **kwargs) for path in csv_paths}
+
+
+def read_stats(store_path, columns=None, huc12=None, start=None, end=None, huc12_dtype='int64'):
+    """
+    Reads a Parquet stats table with column projection and filter pushdown.
+
+    Only the requested columns are read, and year partitions and row groups
+    outside the huc12 / date filters are skipped.
+
+    Parameters
+    ----------
+    store_path : str
+        Parquet dataset written by `csv_to_parquet` (or a CSV path, whose
+        '.parquet' sibling is used).
+    columns : list of str or None, optional
+        Columns to read (default is all columns).
+    huc12 : int or list of int, optional
+        HUC12 ids to keep.
+    start, end : str or datetime, optional
+        Inclusive date range on 'Date' (or year range on 'Year').
+    huc12_dtype : str, optional
+        'int64' (default) or 'category'.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The filtered table, without the 'year' partition column unless it
+        was requested.
+
+    Example
+    -------
+    >>> read_stats('gridmet/gridMET_HUC12_monthly_stats.parquet',
+    ...            columns=['Date', 'huc12', 'pr'], start='2000-01-01')
+    """
+    if store_path.endswith('.csv'):
+        store_path = os.path.splitext(store_path)[0] + '.parquet'
+    dataset = ds.dataset(store_path, format='parquet', partitioning='hive')
+    names = dataset.schema.names
+
+    conditions = []
+    if huc12 is not None:
+        conditions.append(ds.field('huc12').isin([int(h) for h in np.atleast_1d(huc12)]))
+    if start is not None:
+        start = pd.Timestamp(str(start))
+        conditions.append(ds.field('year') >= start.year)
+        if 'Date' in names:
+            conditions.append(ds.field('Date') >= start)
+    if end is not None:
+        end = pd.Timestamp(str(end))
+        conditions.append(ds.field('year') <= end.year)
+        if 'Date' in names:
+            conditions.append(ds.field('Date') <= end)
+    expr = None
+    for cond in conditions:
+        expr = cond if expr is None else expr & cond
+
+    if columns is None:
+        columns = [c for c in names if c != 'year']
+    df = dataset.to_table(columns=columns, filter=expr).to_pandas()
+    if 'huc12' in df:
+        df['huc12'] = df['huc12'].astype(huc12_dtype)
+    return df
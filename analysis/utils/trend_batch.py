@@ -0,0 +1,668 @@
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.stats import norm, rankdata
+
+
+# Upper bound on (series x pairs) elements held in memory at once
+MAX_PAIR_ELEMENTS = 20_000_000
+
+
+def _pair_index(n_time):
+    """Index arrays (i, j) of all pairs i < j for a series of length n_time."""
+    return np.triu_indices(n_time, k=1)
+
+
+def _series_blocks(n_series, n_pairs, multiple=1, max_elements=MAX_PAIR_ELEMENTS):
+    """Yields slices over series so each block holds at most max_elements pairs."""
+    step = max(1, max_elements // max(n_pairs, 1))
+    step = max(multiple, step - step % multiple)
+    for start in range(0, n_series, step):
+        yield slice(start, min(start + step, n_series))
+
+
+def tie_sum(X):
+    """
+    Sum of t(t-1)(2t+5) over groups of tied values for every row of X.
+
+    NaN values never tie (each forms its own group) and therefore add nothing.
+
+    Parameters
+    ----------
+    X : numpy.ndarray
+        (series x time) array.
+
+    Returns
+    -------
+    numpy.ndarray
+        Tie correction term per series.
+    """
+    n_series, n_time = X.shape
+    if n_time == 0:
+        return np.zeros(n_series)
+    Xs = np.sort(X, axis=1)
+    new_group = np.ones(Xs.shape, dtype=bool)
+    new_group[:, 1:] = Xs[:, 1:] != Xs[:, :-1]
+    group_id = np.cumsum(new_group, axis=1) - 1
+    flat = (np.arange(n_series)[:, None] * n_time + group_id).ravel()
+    t = np.bincount(flat, minlength=n_series * n_time).reshape(n_series, n_time).astype(float)
+    return np.sum(t * (t - 1) * (2 * t + 5), axis=1)
+
+
+def mk_score(X):
+    """
+    Mann-Kendall S for every row of X, skipping NaN values.
+
+    Parameters
+    ----------
+    X : numpy.ndarray
+        (series x time) array.
+
+    Returns
+    -------
+    numpy.ndarray
+        S statistic per series.
+    """
+    i, j = _pair_index(X.shape[1])
+    s = np.zeros(X.shape[0])
+    for rows in _series_blocks(X.shape[0], len(i)):
+        s[rows] = np.nansum(np.sign(X[rows][:, j] - X[rows][:, i]), axis=1)
+    return s
+
+
+def sens_slope(X):
+    """
+    Theil-Sen slope and Conover intercept for every row of X.
+
+    Pairwise slopes use the original time positions, so NaN values inside a
+    series (and NaN padding at the end) are simply left out of the median,
+    exactly as ``pymannkendall.sens_slope`` does.
+
+    Parameters
+    ----------
+    X : numpy.ndarray
+        (series x time) array.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        (slope, intercept) per series.
+    """
+    n_series, n_time = X.shape
+    i, j = _pair_index(n_time)
+    slope = np.full(n_series, np.nan)
+    # All-NaN rows legitimately give NaN medians
+    with np.errstate(all='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for rows in _series_blocks(n_series, len(i)):
+            d = (X[rows][:, j] - X[rows][:, i]) / (j - i)
+            slope[rows] = np.nanmedian(d, axis=1)
+        idx = np.where(np.isnan(X), np.nan, np.arange(n_time))
+        intercept = np.nanmedian(X, axis=1) - np.nanmedian(idx, axis=1) * slope
+    return slope, intercept
+
+
+def pair_terms(X, pooled=1):
+    """
+    Mann-Kendall S, Theil-Sen slope and intercept from one pass over the
+    pairwise differences of every row of X.
+
+    The sign and slope of each pair come from the same difference block, so
+    the terms can be computed once and shared by all test variants (see the
+    ``terms`` argument of the ``*_test_batch`` functions).
+
+    Parameters
+    ----------
+    X : numpy.ndarray
+        (series x time) array.
+    pooled : int, optional
+        Number of consecutive rows whose pairwise slopes share one median,
+        e.g. the 12 monthly rows of a series in the seasonal test.
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        's' per row, 'slope' per group of `pooled` rows and the Conover
+        'intercept' per row (meaningful only when pooled is 1).
+    """
+    X = np.asarray(X, dtype=float)
+    n_series, n_time = X.shape
+    i, j = _pair_index(n_time)
+    s = np.zeros(n_series)
+    slope = np.full(n_series // pooled, np.nan)
+    with np.errstate(all='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for rows in _series_blocks(n_series, len(i), pooled):
+            d = X[rows][:, j] - X[rows][:, i]
+            s[rows] = np.nansum(np.sign(d), axis=1)
+            d /= (j - i)
+            slope[rows.start // pooled:rows.stop // pooled] = np.nanmedian(
+                d.reshape(-1, pooled * len(i)), axis=1)
+        idx = np.where(np.isnan(X), np.nan, np.arange(n_time))
+        intercept = np.nanmedian(X, axis=1) - np.nanmedian(idx, axis=1) * np.repeat(slope, pooled)
+    return {'s': s, 'slope': slope, 'intercept': intercept}
+
+
+def compact(X):
+    """
+    Moves the valid values of each row to the front, keeping their order.
+
+    Returns
+    -------
+    tuple
+        (compacted array NaN-padded at the end, number of valid values per row).
+    """
+    X = np.asarray(X, dtype=float)
+    order = np.argsort(np.isnan(X), axis=1, kind='stable')
+    return np.take_along_axis(X, order, axis=1), np.sum(~np.isnan(X), axis=1)
+
+
+def acf(X, n, nlags):
+    """
+    Autocorrelation of the first n values of every row, as in pymannkendall.
+
+    Parameters
+    ----------
+    X : numpy.ndarray
+        Compacted (series x time) array (see `compact`).
+    n : numpy.ndarray
+        Valid values per row.
+    nlags : int
+        Highest lag returned.
+
+    Returns
+    -------
+    numpy.ndarray
+        (series x nlags + 1) autocorrelations; lags >= n are 0.
+    """
+    n_time = X.shape[1]
+    valid = np.arange(n_time) < n[:, None]
+    with np.errstate(all='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        y = np.where(valid, X - np.nanmean(np.where(valid, X, np.nan), axis=1, keepdims=True), 0)
+        size = 1 << int(2 * n_time - 1).bit_length()
+        f = np.fft.rfft(y, size, axis=1)
+        acov = np.fft.irfft(f * np.conj(f), size, axis=1)[:, :nlags + 1] / n[:, None]
+        acov[:, 1:][np.arange(1, nlags + 1) >= n[:, None]] = 0
+        return acov / acov[:, :1]
+
+
+def lag1_acf(X, n):
+    """
+    Lag-1 autocorrelation of the first n values of every row, with the
+    arithmetic of pymannkendall's np.correlate-based acf.
+
+    Pre-whitened values feed tie detection, so r1 has to round exactly like
+    the per-series reference: rows are grouped by length, the mean is taken
+    over the valid values only and the lag products are summed with np.dot
+    as np.correlate does.
+
+    Returns
+    -------
+    numpy.ndarray
+        r1 per row (NaN for a constant row).
+    """
+    r1 = np.zeros(len(X))
+    with np.errstate(all='ignore'):
+        for length in np.unique(n):
+            if length < 2:
+                continue
+            rows = np.flatnonzero(n == length)
+            Y = X[rows, :length]
+            Y = Y - Y.mean(axis=1, keepdims=True)
+            for i, y in zip(rows, Y):
+                r1[i] = (np.dot(y[1:], y[:-1]) / length) / (np.dot(y, y) / length)
+    return r1
+
+
+def _variance(X, n):
+    """Tie-corrected variance of S for every row."""
+    return (n * (n - 1) * (2 * n + 5) - tie_sum(X)) / 18
+
+
+def _result(s, var_s, denom, slope, intercept, n, valid, alpha):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tau = s / denom
+    z = z_score(s, var_s)
+    p, h, trend = p_value(z, alpha)
+    return {'trend': trend, 'h': h, 'p': p, 'z': z, 'Tau': tau, 's': s, 'var_s': var_s,
+            'slope': slope, 'intercept': intercept, 'n': n, 'valid': valid}
+
+
+def z_score(s, var_s):
+    """Continuity-corrected standard normal statistic of S."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(s > 0, (s - 1) / np.sqrt(var_s), np.where(s < 0, (s + 1) / np.sqrt(var_s), 0.0))
+    return z
+
+
+def p_value(z, alpha=0.05):
+    """
+    Two-sided p-value, significance flag and trend label for each z.
+
+    Returns
+    -------
+    tuple
+        (p, h, trend) arrays; trend holds 'increasing', 'decreasing' or 'no trend'.
+    """
+    p = 2 * (1 - norm.cdf(np.abs(z)))
+    h = np.abs(z) > norm.ppf(1 - alpha / 2)
+    trend = np.where((z < 0) & h, 'decreasing', np.where((z > 0) & h, 'increasing', 'no trend'))
+    return p, h, trend.astype(object)
+
+
+def original_test_batch(X, alpha=0.05, terms=None):
+    """
+    Mann-Kendall test and Sen's slope for many series at once.
+
+    Gives the same values as calling ``pymannkendall.original_test`` on each
+    row, with NaN values skipped. Rows with fewer than two valid values,
+    where ``original_test`` raises, are flagged in the 'valid' mask.
+
+    Parameters
+    ----------
+    X : array-like
+        (series x time) array; rows may be NaN-padded at the end.
+    alpha : float, optional
+        Significance level (default is 0.05).
+    terms : dict, optional
+        Precomputed `pair_terms(X)`, shared with other variants.
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        Keys 'trend', 'h', 'p', 'z', 'Tau', 's', 'var_s', 'slope',
+        'intercept', 'n' and 'valid'.
+    """
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    terms = terms or pair_terms(X)
+    n = np.sum(~np.isnan(X), axis=1).astype(float)
+    return _result(terms['s'], _variance(X, n), .5 * n * (n - 1), terms['slope'],
+                   terms['intercept'], n, n >= 2, alpha)
+
+
+def _lag_window(n, lag, n_time):
+    """Lags 1..lag (all lags up to n - 1 when lag is None) per row."""
+    k = np.arange(n_time)
+    last = n - 1 if lag is None else np.minimum(lag, n - 1)
+    return k, (k >= 1) & (k <= last[:, None])
+
+
+def hamed_rao_test_batch(X, alpha=0.05, lag=None, terms=None):
+    """
+    Modified Mann-Kendall test with the Hamed and Rao (1998) variance
+    correction for autocorrelation, for many series at once.
+
+    Matches ``pymannkendall.hamed_rao_modification_test`` per row: the
+    autocorrelation of the ranks of the Sen-detrended series inflates
+    var(S) through the lags that are significant at `alpha`. Rows with
+    fewer than three valid values are flagged invalid.
+
+    Parameters
+    ----------
+    X : array-like
+        (series x time) array.
+    alpha : float, optional
+        Significance level.
+    lag : int or None, optional
+        Number of lags considered (None uses all).
+    terms : dict, optional
+        Precomputed `pair_terms(X)`.
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        Same keys as `original_test_batch`.
+    """
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    terms = terms or pair_terms(X)
+    Xc, n = compact(X)
+    n_time = X.shape[1]
+    detrended = Xc - np.arange(1, n_time + 1) * terms['slope'][:, None]
+    r = acf(rankdata(detrended, axis=1, nan_policy='omit'), n, n_time - 1)
+    k, window = _lag_window(n, lag, n_time)
+    bound = norm.ppf(1 - alpha / 2) / np.sqrt(n)[:, None]
+    significant = window & ~((r <= bound) & (r >= -bound))
+    nf = n.astype(float)[:, None]
+    with np.errstate(all='ignore'):
+        sni = np.sum(np.where(significant, (nf - k) * (nf - k - 1) * (nf - k - 2) * r, 0), axis=1)
+        n_ns = 1 + 2 / (n * (n - 1.) * (n - 2)) * sni
+    n = n.astype(float)
+    return _result(terms['s'], _variance(X, n) * n_ns, .5 * n * (n - 1), terms['slope'],
+                   terms['intercept'], n, n >= 3, alpha)
+
+
+def yue_wang_test_batch(X, alpha=0.05, lag=None, terms=None):
+    """
+    Modified Mann-Kendall test with the Yue and Wang (2004) effective sample
+    size correction, for many series at once.
+
+    Matches ``pymannkendall.yue_wang_modification_test`` per row: var(S) is
+    scaled by 1 + 2 * sum((1 - k / n) * r_k) over the autocorrelations r_k
+    of the Sen-detrended series.
+
+    Parameters
+    ----------
+    X : array-like
+        (series x time) array.
+    alpha : float, optional
+        Significance level.
+    lag : int or None, optional
+        Number of lags considered (None uses all).
+    terms : dict, optional
+        Precomputed `pair_terms(X)`.
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        Same keys as `original_test_batch`.
+    """
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    terms = terms or pair_terms(X)
+    Xc, n = compact(X)
+    n_time = X.shape[1]
+    detrended = Xc - np.arange(1, n_time + 1) * terms['slope'][:, None]
+    r = acf(detrended, n, n_time - 1)
+    k, window = _lag_window(n, lag, n_time)
+    n = n.astype(float)
+    with np.errstate(all='ignore'):
+        n_ns = 1 + 2 * np.sum(np.where(window, (1 - k / n[:, None]) * r, 0), axis=1)
+    return _result(terms['s'], _variance(X, n) * n_ns, .5 * n * (n - 1), terms['slope'],
+                   terms['intercept'], n, n >= 2, alpha)
+
+
+def pre_whitening_test_batch(X, alpha=0.05, terms=None):
+    """
+    Mann-Kendall test on pre-whitened series (Yue and Wang, 2002), for many
+    series at once.
+
+    Matches ``pymannkendall.pre_whitening_modification_test`` per row: the
+    test runs on x[t] - r1 * x[t-1] with the lag-1 autocorrelation r1, while
+    slope and intercept are those of the original series.
+
+    Parameters
+    ----------
+    X : array-like
+        (series x time) array.
+    alpha : float, optional
+        Significance level.
+    terms : dict, optional
+        Precomputed `pair_terms(X)` of the original series.
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        Same keys as `original_test_batch`; 'n' is the pre-whitened length.
+    """
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    terms = terms or pair_terms(X)
+    Xc, n = compact(X)
+    r1 = lag1_acf(Xc, n)
+    W = Xc[:, 1:] - Xc[:, :-1] * r1[:, None]
+    n = (n - 1).astype(float)
+    return _result(mk_score(W), _variance(W, n), .5 * n * (n - 1), terms['slope'],
+                   terms['intercept'], n, n >= 2, alpha)
+
+
+def seasonal_test_batch(X, period=12, alpha=0.05):
+    """
+    Seasonal Kendall test (Hirsch and Slack, 1984) and seasonal Sen's slope
+    (Hipel, 1994) for many series at once.
+
+    Matches ``pymannkendall.seasonal_test`` per row: every row is cut into
+    cycles of `period` steps, S and var(S) are summed over the seasons and
+    the slope (per cycle, e.g. per year for monthly data) is the median of
+    all within-season pairwise slopes. All seasons of all series share one
+    pairwise pass.
+
+    Parameters
+    ----------
+    X : array-like
+        (series x time) array of regular steps starting at the first season.
+    period : int, optional
+        Steps per cycle (12 for monthly data).
+    alpha : float, optional
+        Significance level.
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        Same keys as `original_test_batch`; 'n' counts valid values.
+    """
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    n_series, n_time = X.shape
+    padded = np.pad(X, ((0, 0), (0, -n_time % period)), constant_values=np.nan)
+    # One row per (series, season) holding that season's values over the cycles
+    seasons = padded.reshape(n_series, -1, period).transpose(0, 2, 1).reshape(n_series * period, -1)
+    terms = pair_terms(seasons, pooled=period)
+    n_season = np.sum(~np.isnan(seasons), axis=1).astype(float)
+    s = terms['s'].reshape(n_series, period).sum(axis=1)
+    var_s = _variance(seasons, n_season).reshape(n_series, period).sum(axis=1)
+    denom = (.5 * n_season * (n_season - 1)).reshape(n_series, period).sum(axis=1)
+    slope = terms['slope']
+    with np.errstate(all='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        idx = np.where(np.isnan(X), np.nan, np.arange(n_time))
+        intercept = np.nanmedian(X, axis=1) - np.nanmedian(idx, axis=1) / period * slope
+    n = np.sum(~np.isnan(X), axis=1).astype(float)
+    return _result(s, var_s, denom, slope, intercept, n, denom > 0, alpha)
+
+
+def gilbert_ci(X, alpha=0.05):
+    """
+    Analytic confidence interval of Sen's slope (Gilbert, 1987) for every row.
+
+    With C = z(1 - alpha/2) * sqrt(var(S)) and N' valid pairwise slopes, the
+    limits are the M1-th and (M2 + 1)-th smallest slopes, M1 = (N' - C) / 2
+    and M2 = (N' + C) / 2, interpolated between neighbouring ranks.
+
+    Parameters
+    ----------
+    X : array-like
+        (series x time) array.
+    alpha : float, optional
+        1 - confidence level (default is 0.05 for a 95 % interval).
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        (lower, upper) per series; NaN for fewer than two valid values.
+    """
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    n_series, n_time = X.shape
+    n = np.sum(~np.isnan(X), axis=1).astype(float)
+    c = norm.ppf(1 - alpha / 2) * np.sqrt(_variance(X, n))
+    i, j = _pair_index(n_time)
+    lower = np.full(n_series, np.nan)
+    upper = np.full(n_series, np.nan)
+    with np.errstate(all='ignore'):
+        for rows in _series_blocks(n_series, len(i)):
+            d = np.sort((X[rows][:, j] - X[rows][:, i]) / (j - i), axis=1)   # NaN sorted last
+            n_pairs = np.sum(~np.isnan(d), axis=1)
+            for out, rank in ((lower, (n_pairs - c[rows]) / 2), (upper, (n_pairs + c[rows]) / 2 + 1)):
+                # 1-based rank -> interpolated order statistic
+                pos = np.clip(rank - 1, 0, np.maximum(n_pairs - 1, 0))
+                lo = np.floor(pos).astype(int)
+                hi = np.minimum(lo + 1, np.maximum(n_pairs - 1, 0))
+                frac = pos - lo
+                at = np.arange(len(pos))
+                out[rows] = np.where(n_pairs > 0, d[at, lo] + frac * (d[at, hi] - d[at, lo]), np.nan)
+    return lower, upper
+
+
+def _bootstrap_chunk(residuals, times, n, block_size, seeds, max_elements):
+    """
+    Sen's slope deviations of circular block-bootstrap replicates, one per
+    seed.
+
+    Returns an (n_boot x series) array; replicate slopes are the fitted slope
+    plus these deviations. Resampling indices are built per block of series
+    and replicates, so no (replicate x series x time) array is held at once;
+    pairwise arrays stay under max_elements.
+    """
+    n_series, n_time = residuals.shape
+    n_blocks = -(-n_time // block_size)
+    n_boot = len(seeds)
+    # Every replicate has its own stream, so results do not depend on chunking
+    starts = np.empty((n_boot, n_series, n_blocks), dtype=np.int32)
+    for b, seq in enumerate(seeds):
+        starts[b] = np.floor(np.random.default_rng(seq).random((n_series, n_blocks)) * n[:, None])
+    within = np.arange(n_time) % block_size
+
+    out = np.full((n_boot, n_series), np.nan)
+    # Rows with the same number of valid values share one pair index, so
+    # the medians need no NaN handling
+    for length in np.unique(n[n >= 2]):
+        group = np.flatnonzero(n == length)
+        i, j = _pair_index(length)
+        dt = times[group][:, j] - times[group][:, i]
+        for rows in _series_blocks(len(group), len(i), max_elements=max_elements):
+            n_rows = rows.stop - rows.start
+            step = max(1, max_elements // max(n_rows * len(i), 1))
+            row_idx = group[rows][None, :, None]
+            for b in range(0, n_boot, step):
+                block_starts = starts[b:b + step, group[rows]]
+                idx = (np.repeat(block_starts, block_size, axis=2)[:, :, :length] + within[:length]) % length
+                r = residuals[row_idx, idx]
+                out[b:b + step, group[rows]] = np.median((r[:, :, j] - r[:, :, i]) / dt[rows], axis=2)
+    return out
+
+
+def bootstrap_ci(X, alpha=0.05, n_boot=10000, block_size=None, seed=0, n_jobs=None, chunk_size=None,
+                 max_memory_mb=512):
+    """
+    Circular block-bootstrap confidence interval of Sen's slope for every row.
+
+    Residuals around the Sen's line are resampled in blocks of consecutive
+    valid values (keeping short-range autocorrelation), added back to the
+    line and the slope is re-estimated, many replicates at once. Chunks of
+    replicates run in a process pool; every replicate has its own stream
+    spawned from ``numpy.random.SeedSequence(seed)``, so results are
+    reproducible and independent of n_jobs and chunking. Chunk sizes and
+    pairwise blocks are derived from max_memory_mb, shared by all workers.
+
+    Parameters
+    ----------
+    X : array-like
+        (series x time) array.
+    alpha : float, optional
+        1 - confidence level.
+    n_boot : int, optional
+        Number of bootstrap replicates (default is 10000).
+    block_size : int or None, optional
+        Block length in time steps (None uses the cube root of the longest
+        series, rounded up).
+    seed : int, optional
+        Root seed.
+    n_jobs : int or None, optional
+        Worker processes (None uses all cores, 1 runs in-process).
+    chunk_size : int or None, optional
+        Replicates per task (None derives it from max_memory_mb).
+    max_memory_mb : float, optional
+        Approximate memory budget of the working arrays of all workers
+        together (default is 512).
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        (lower, upper) percentile limits per series; NaN for fewer than
+        two valid values.
+    """
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    slope = pair_terms(X)['slope']
+    Xc, n = compact(X)
+    n_time = X.shape[1]
+    times = compact(np.where(np.isnan(X), np.nan, np.arange(n_time, dtype=float)))[0]
+    residuals = np.nan_to_num(Xc - slope[:, None] * times)
+    if block_size is None:
+        block_size = max(1, int(np.ceil(max(n.max(initial=1), 1) ** (1 / 3))))
+
+    n_workers = 1 if n_jobs == 1 else (n_jobs or os.cpu_count() or 1)
+    # Half of each worker's share for the resampling starts, half for pairwise arrays
+    worker_bytes = max_memory_mb * 2**20 / n_workers
+    n_blocks = -(-n_time // block_size)
+    if chunk_size is None:
+        per_replicate = len(X) * (n_blocks * 4 + 8)
+        chunk_size = int(max(1, worker_bytes / 2 // per_replicate))
+    # r, the pair differences and median's partition copy
+    max_elements = int(max(1, worker_bytes / 2 // (4 * 8)))
+
+    seeds = np.random.SeedSequence(seed).spawn(n_boot)
+    args = [(residuals, times, n, block_size, seeds[start:start + chunk_size], max_elements)
+            for start in range(0, n_boot, chunk_size)]
+    if n_jobs == 1:
+        chunks = [_bootstrap_chunk(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            chunks = list(pool.map(_bootstrap_chunk, *zip(*args)))
+    deviations = np.concatenate(chunks)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        lower, upper = np.nanpercentile(deviations, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    valid = n >= 2
+    return np.where(valid, slope + lower, np.nan), np.where(valid, slope + upper, np.nan)
+
+
+# analyze_trends(method=...) -> batch test
+METHODS = {
+    'original': original_test_batch,
+    'hamed_rao': hamed_rao_test_batch,
+    'yue_wang': yue_wang_test_batch,
+    'pre_whitening': pre_whitening_test_batch,
+    'seasonal': seasonal_test_batch,
+}
+
+
+def trend_test_batch(X, method='original', alpha=0.05, lag=None, period=12, terms=None):
+    """
+    Runs one of the METHODS on all rows of X.
+
+    Parameters
+    ----------
+    X : array-like
+        (series x time) array.
+    method : str, optional
+        'original', 'hamed_rao', 'yue_wang', 'pre_whitening' or 'seasonal'.
+    alpha : float, optional
+        Significance level.
+    lag : int or None, optional
+        Lags of the 'hamed_rao' / 'yue_wang' corrections.
+    period : int, optional
+        Cycle length of the 'seasonal' test.
+    terms : dict, optional
+        Precomputed `pair_terms(X)` reused by the non-seasonal methods.
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        Same keys as `original_test_batch`.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method '{method}'; expected one of {list(METHODS)}")
+    if method == 'seasonal':
+        return seasonal_test_batch(X, period=period, alpha=alpha)
+    if method in ('hamed_rao', 'yue_wang'):
+        return METHODS[method](X, alpha=alpha, lag=lag, terms=terms)
+    return METHODS[method](X, alpha=alpha, terms=terms)
+
+
+def to_matrix(df, group_col, sort_col, value_col):
+    """
+    Reshapes a long table into a (group x time) array, one row per group.
+
+    Rows are ordered like ``df.groupby(group_col)`` and values within a group
+    follow ``sort_col``; shorter groups are NaN-padded at the end.
+
+    Returns
+    -------
+    tuple
+        (groups, X) where groups holds the sorted group keys.
+    """
+    data = df[df[group_col].notna()].sort_values([group_col, sort_col], kind='mergesort')
+    groups, codes = np.unique(data[group_col].to_numpy(), return_inverse=True)
+    pos = data.groupby(group_col, sort=False).cumcount().to_numpy()
+    X = np.full((len(groups), int(pos.max()) + 1 if len(pos) else 0), np.nan)
+    X[codes, pos] = data[value_col].to_numpy(dtype=float)
+    return groups, X
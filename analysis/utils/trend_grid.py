@@ -0,0 +1,135 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+import numpy as np
+import xarray as xr
+import rioxarray
+
+import trend_batch
+from trend_sen import season_year
+
+
+# Codes of the trend-class raster
+TREND_CODES = {'increasing': 1, 'no trend': 0, 'decreasing': -1}
+TREND_NODATA = -128
+
+
+def _open_cube(source):
+    if str(source).endswith('.zarr'):
+        return xr.open_zarr(source)
+    return xr.open_dataset(source)
+
+
+def _tile_trends(source, clim_var, lat_slice, lon_slice, labels, years, agg, alpha):
+    """Aggregates one tile to years and runs the batched Mann-Kendall test."""
+    with _open_cube(source) as ds:
+        block = ds[clim_var].isel(lat=lat_slice, lon=lon_slice).transpose('time', 'lat', 'lon').values
+    ny, nx = block.shape[1:]
+    annual = np.empty((len(years), ny, nx))
+    for k, year in enumerate(years):
+        steps = block[labels == year]
+        annual[k] = steps.sum(axis=0) if agg == 'sum' else steps.mean(axis=0)
+
+    X = annual.reshape(len(years), -1).T
+    has_data = ~np.all(np.isnan(X), axis=1)
+    slope = np.full(X.shape[0], np.nan, dtype='float32')
+    p = np.full(X.shape[0], np.nan, dtype='float32')
+    trend = np.full(X.shape[0], TREND_NODATA, dtype='int8')
+    if has_data.any():
+        result = trend_batch.original_test_batch(X[has_data], alpha=alpha)
+        ok = result['valid']
+        idx = np.flatnonzero(has_data)[ok]
+        slope[idx] = result['slope'][ok]
+        p[idx] = result['p'][ok]
+        trend[idx] = [TREND_CODES[t] for t in result['trend'][ok]]
+    return lat_slice, lon_slice, slope.reshape(ny, nx), p.reshape(ny, nx), trend.reshape(ny, nx)
+
+
+def pixel_trends(source, clim_var, output_dir=None, agg='sum', start_month=11, min_steps=12,
+                 tile_size=256, n_jobs=None, alpha=0.05):
+    """
+    Pixel-wise Mann-Kendall test and Sen's slope over a (time, lat, lon) cube.
+
+    The cube (from `combine_band1_monthly_to_cube` or a Zarr climate store) is
+    aggregated to irrigation/water years per pixel and split into tiles; each
+    tile is tested with the vectorized `trend_batch` engine in a process pool.
+    Pixels that are NaN for the whole record are treated as nodata.
+
+    Parameters
+    ----------
+    source : str
+        Path to the NetCDF cube or Zarr store.
+    clim_var : str
+        Variable in the cube (e.g. 'ppt').
+    output_dir : str or None, optional
+        If given, writes '{clim_var}_slope.tif', '{clim_var}_p.tif' and
+        '{clim_var}_trend.tif' with the source CRS and transform.
+    agg : str, optional
+        'sum' (e.g. precipitation) or 'mean' (e.g. temperature) per year.
+    start_month : int, optional
+        First month of the year (11 irrigation year, 10 water year, 1 calendar).
+    min_steps : int, optional
+        Years with fewer time steps (partial years at the ends) are dropped.
+    tile_size : int, optional
+        Tile edge length in pixels.
+    n_jobs : int or None, optional
+        Worker processes (None uses all cores, 1 runs in-process).
+    alpha : float, optional
+        Significance level.
+
+    Returns
+    -------
+    xarray.Dataset
+        'slope', 'p' and 'trend' (1 increasing, 0 no trend, -1 decreasing,
+        -128 nodata) on the cube grid.
+    """
+    with _open_cube(source) as ds:
+        times = ds['time'].values
+        lat = ds['lat'].values
+        lon = ds['lon'].values
+        crs_wkt = ds['crs'].attrs.get('crs_wkt') if 'crs' in ds else None
+
+    labels = season_year(times, start_month)
+    years, counts = np.unique(labels, return_counts=True)
+    years = years[counts >= min_steps]
+    if len(years) < 2:
+        raise ValueError("At least two complete years are needed for a trend.")
+
+    slope = np.full((len(lat), len(lon)), np.nan, dtype='float32')
+    p = np.full(slope.shape, np.nan, dtype='float32')
+    trend = np.full(slope.shape, TREND_NODATA, dtype='int8')
+
+    tiles = [
+        (slice(i, i + tile_size), slice(j, j + tile_size))
+        for i in range(0, len(lat), tile_size)
+        for j in range(0, len(lon), tile_size)
+    ]
+    args = [(source, clim_var, lat_slice, lon_slice, labels, years, agg, alpha)
+            for lat_slice, lon_slice in tiles]
+    with ProcessPoolExecutor(max_workers=n_jobs) if n_jobs != 1 else nullcontext() as pool:
+        outputs = (_tile_trends(*a) for a in args) if pool is None else pool.map(_tile_trends, *zip(*args))
+        for lat_slice, lon_slice, t_slope, t_p, t_trend in outputs:
+            slope[lat_slice, lon_slice] = t_slope
+            p[lat_slice, lon_slice] = t_p
+            trend[lat_slice, lon_slice] = t_trend
+
+    result = xr.Dataset(
+        {'slope': (('lat', 'lon'), slope), 'p': (('lat', 'lon'), p), 'trend': (('lat', 'lon'), trend)},
+        coords={'lat': lat, 'lon': lon},
+        attrs={'years': f"{years[0]}-{years[-1]}", 'agg': agg, 'start_month': start_month},
+    )
+
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        # North-up rasters regardless of the cube's latitude order
+        north_up = result.sortby('lat', ascending=False).rename({'lon': 'x', 'lat': 'y'})
+        for name, nodata in (('slope', np.nan), ('p', np.nan), ('trend', TREND_NODATA)):
+            raster = north_up[name].rio.write_nodata(nodata)
+            if crs_wkt:
+                raster = raster.rio.write_crs(crs_wkt)
+            path = os.path.join(output_dir, f"{clim_var}_{name}.tif")
+            raster.rio.to_raster(path)
+            print(f"Saved: {path}")
+
+    return result
@@ -1,11 +1,14 @@
+import numpy as np
 import pandas as pd
-import pymannkendall as mk
 import geopandas as gpd
 import matplotlib.pyplot as plt
 from matplotlib.colors import Normalize
 from matplotlib.colors import Normalize, TwoSlopeNorm
 import contextily as ctx
 
+import trend_batch
+import change_point
+
 
 def irr_year(df):
     """
@@ -41,9 +44,103 @@ def irr_year(df):
         return month, df['Date'].year, df['Date'].year
 
 
+def _year_month(dates):
+    dates = pd.to_datetime(dates)
+    if isinstance(dates, pd.Series):
+        return dates.dt.year.astype('int64'), dates.dt.month.astype('int64')
+    return np.asarray(dates.year, dtype='int64'), np.asarray(dates.month, dtype='int64')
+
+
+def season_year(dates, start_month=11):
+    """
+    Assigns each date to a year starting in `start_month`, labelled by the
+    calendar year in which it ends.
+
+    start_month=11 gives the irrigation year of `irr_year`, 10 the water year
+    and 1 the calendar year.
+
+    Parameters
+    ----------
+    dates : pandas.Series or array-like
+        Datetime values.
+    start_month : int, optional
+        First month of the year (default is 11).
+
+    Returns
+    -------
+    pandas.Series or numpy.ndarray
+        Year labels (a Series when `dates` is a Series).
+
+    Example
+    -------
+    >>> season_year(pd.Series(pd.to_datetime(['2022-11-15', '2023-03-10'])))
+    0    2023
+    1    2023
+    """
+    year, month = _year_month(dates)
+    if start_month == 1:
+        return year
+    return year + (month >= start_month)
+
+
+def water_year(dates):
+    """Water year (October to September, labelled by the ending year)."""
+    return season_year(dates, start_month=10)
+
+
+def irrigation_year(dates):
+    """Irrigation year (November to October, labelled by the ending year)."""
+    return season_year(dates, start_month=11)
+
+
+def season_mask(dates, start_month=4, end_month=10):
+    """
+    True for dates whose month lies in the season `start_month`..`end_month`.
+
+    The default is the April-October crop season; seasons may wrap around the
+    year end, e.g. start_month=11, end_month=3 for November to March.
+    """
+    _, month = _year_month(dates)
+    if start_month <= end_month:
+        return (month >= start_month) & (month <= end_month)
+    return (month >= start_month) | (month <= end_month)
+
+
+def add_calendar_columns(df, date_col='Date', seasons=None):
+    """
+    Adds 'month', 'year', 'irr_year' and 'water_year' columns in one pass.
+
+    Vectorized replacement for ``df.apply(irr_year, axis=1, result_type='expand')``
+    with the same values, plus optional boolean season columns.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Table with a datetime (or date string) column.
+    date_col : str, optional
+        Name of the date column (default is 'Date').
+    seasons : dict, optional
+        Column name -> (start_month, end_month), e.g. {'crop_season': (4, 10)}.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The same DataFrame with the calendar columns added.
+    """
+    dates = pd.to_datetime(df[date_col])
+    year, month = _year_month(dates)
+    df['month'], df['year'] = month, year
+    df['irr_year'] = irrigation_year(dates)
+    df['water_year'] = water_year(dates)
+    for name, (start_month, end_month) in (seasons or {}).items():
+        df[name] = season_mask(dates, start_month, end_month)
+    return df
+
+
 
 
-def analyze_trends(df, var_list, sort_yr='irr_year'):
+def analyze_trends(df, var_list, sort_yr='irr_year', method='original', alpha=0.05, lag=None,
+                   period=12, ci=None, **ci_kwargs):
     """
     Computes the Sen's slope, p-value, and trend direction (increasing/decreasing/no trend) 
     for each variable across years grouped by HUC12.
@@ -59,6 +156,28 @@ def analyze_trends(df, var_list, sort_yr='irr_year'):
     sort_yr : str, optional
         Column name to sort the data chronologically (default is 'irr_year').
 
+    method : str, optional
+        Trend test (default is 'original', the plain Mann-Kendall test):
+        - 'hamed_rao' / 'yue_wang': variance corrected for autocorrelation,
+          e.g. for monthly ET and precipitation series.
+        - 'pre_whitening': test on lag-1 pre-whitened series.
+        - 'seasonal': seasonal Kendall test on monthly series (sort_yr is then
+          the monthly date column); the slope is per cycle (per year).
+
+    alpha : float, optional
+        Significance level (default is 0.05).
+
+    lag : int or None, optional
+        Lags used by 'hamed_rao' / 'yue_wang' (None uses all).
+
+    period : int, optional
+        Seasons per cycle for 'seasonal' (default is 12).
+
+    ci : str or None, optional
+        Adds `{variable}_slope_lo` / `{variable}_slope_hi` confidence limits
+        of the Sen's slope: 'gilbert' (analytic) or 'bootstrap' (block
+        bootstrap); see `add_slope_ci` for ci_kwargs such as n_boot and seed.
+
     Returns:
     --------
     pandas.DataFrame
@@ -69,7 +188,9 @@ def analyze_trends(df, var_list, sort_yr='irr_year'):
 
     Notes:
     ------
-    - Uses `pymannkendall.original_test()` for trend detection.
+    - Gives the same values as the matching `pymannkendall` test
+      (`original_test()`, `hamed_rao_modification_test()`, ...) per HUC12, but
+      all HUC12 series of all variables are tested at once with `trend_batch`.
     - Missing or invalid input will result in None values for that HUC12-variable combination.
 
     Example:
@@ -77,29 +198,217 @@ def analyze_trends(df, var_list, sort_yr='irr_year'):
     >>> analyze_trends(df, var_list=['ppt', 'et'], sort_yr='irr_year')
     """
 
-    results = []
+    huc12s = np.unique(df['huc12'].dropna().to_numpy())
+    results = pd.DataFrame({'huc12': huc12s})
+
+    # Stack every variable's HUC12 x time matrix so one batch call (and one
+    # pairwise pass) covers the full HUC x variable x time array
+    matrices = {}
+    for var in var_list:
+        try:
+            groups, X = trend_batch.to_matrix(df, 'huc12', sort_yr, var)
+            if len(groups) == len(huc12s):
+                matrices[var] = X
+        except Exception:
+            pass
+    result = None
+    if matrices:
+        width = max(X.shape[1] for X in matrices.values())
+        stacked = np.vstack([np.pad(X, ((0, 0), (0, width - X.shape[1])), constant_values=np.nan)
+                             for X in matrices.values()])
+        result = trend_batch.trend_test_batch(stacked, method, alpha=alpha, lag=lag, period=period)
+
+    for k, var in enumerate(matrices):
+        rows = slice(k * len(huc12s), (k + 1) * len(huc12s))
+        valid = result['valid'][rows]
+        results[f'{var}_slope'] = np.where(valid, result['slope'][rows], np.nan)
+        results[f'{var}_p'] = np.where(valid, result['p'][rows], np.nan)
+        results[f'{var}_trend'] = np.where(valid, result['trend'][rows], None)
+    for var in var_list:
+        if var not in matrices:
+            results[f'{var}_slope'] = np.nan
+            results[f'{var}_p'] = np.nan
+            results[f'{var}_trend'] = None
+    results = results[['huc12'] + [f'{var}_{col}' for var in var_list for col in ('slope', 'p', 'trend')]]
+
+    if ci is not None:
+        if method == 'seasonal':
+            raise ValueError("Slope confidence intervals are not available for the seasonal test")
+        results = add_slope_ci(results, df, var_list, sort_yr=sort_yr, method=ci, alpha=alpha,
+                               **ci_kwargs)
+    return results
+
+
+def add_slope_ci(trend_df, df, var_list, sort_yr='irr_year', method='bootstrap', alpha=0.05,
+                 n_boot=10000, block_size=None, seed=0, n_jobs=None):
+    """
+    Appends Sen's slope confidence limits to a trend table from `analyze_trends`.
+
+    Parameters
+    ----------
+    trend_df : pandas.DataFrame
+        Output of `analyze_trends` (one row per HUC12).
+
+    df : pandas.DataFrame
+        The data the trends were computed from.
+
+    var_list : list of str
+        Variables to add limits for.
 
-    for huc12, group in df.groupby('huc12'):
-        group_sorted = group.sort_values(sort_yr)
-        trend_data = {'huc12': huc12}
+    sort_yr : str, optional
+        Time column (default is 'irr_year').
 
-        for var in var_list:
-            series = group_sorted[var].values
+    method : str, optional
+        'bootstrap' (circular block bootstrap, robust to autocorrelation) or
+        'gilbert' (analytic, Gilbert 1987).
 
-            try:
-                result = mk.original_test(series)
-                trend_data[f'{var}_slope'] = result.slope
-                trend_data[f'{var}_p'] = result.p
-                trend_data[f'{var}_trend'] = result.trend
-            except Exception:
-                trend_data[f'{var}_slope'] = None
-                trend_data[f'{var}_p'] = None
-                trend_data[f'{var}_trend'] = None
+    alpha : float, optional
+        1 - confidence level (default is 0.05 for 95 % limits).
 
-        results.append(trend_data)
+    n_boot, block_size, seed, n_jobs : optional
+        Bootstrap settings, see `trend_batch.bootstrap_ci`; a fixed seed
+        gives the same limits on every run and any number of workers.
 
-    return pd.DataFrame(results)
+    Returns
+    -------
+    pandas.DataFrame
+        trend_df with `{variable}_slope_lo` and `{variable}_slope_hi` placed
+        after each `{variable}_slope` column.
 
+    Example:
+    --------
+    >>> trend_df = add_slope_ci(trend_df, df_irr_yr, var_cols, sort_yr='irr_year', n_boot=10000)
+    """
+    if method not in ('bootstrap', 'gilbert'):
+        raise ValueError(f"Unknown CI method '{method}'; expected 'bootstrap' or 'gilbert'")
+    out = trend_df.copy()
+    matrices = {var: trend_batch.to_matrix(df, 'huc12', sort_yr, var) for var in var_list}
+    width = max(X.shape[1] for _, X in matrices.values())
+    # All variables in one batch, so the bootstrap pool is started once
+    stacked = np.vstack([np.pad(X, ((0, 0), (0, width - X.shape[1])), constant_values=np.nan)
+                         for _, X in matrices.values()])
+    if method == 'gilbert':
+        lower, upper = trend_batch.gilbert_ci(stacked, alpha=alpha)
+    else:
+        lower, upper = trend_batch.bootstrap_ci(stacked, alpha=alpha, n_boot=n_boot,
+                                                block_size=block_size, seed=seed, n_jobs=n_jobs)
+
+    offset = 0
+    for var, (groups, X) in matrices.items():
+        rows = slice(offset, offset + len(groups))
+        offset += len(groups)
+        limits = pd.DataFrame({'huc12': groups, f'{var}_slope_lo': lower[rows],
+                               f'{var}_slope_hi': upper[rows]})
+        limits = out[['huc12']].merge(limits, on='huc12', how='left')
+        at = out.columns.get_loc(f'{var}_slope') + 1
+        out.insert(at, f'{var}_slope_lo', limits[f'{var}_slope_lo'].to_numpy())
+        out.insert(at + 1, f'{var}_slope_hi', limits[f'{var}_slope_hi'].to_numpy())
+    return out
+
+
+
+def analyze_change_points(df, var_list, sort_yr='irr_year', method='pettitt', alpha=0.05,
+                          max_changes=3, min_size=3, penalty=None):
+    """
+    Detects abrupt shifts in every HUC12 series of every variable at once.
+
+    Complements `analyze_trends` for step-like series (e.g. irrigation
+    conversions in IrrMapper, NLCD or CDL shares), which a monotonic trend
+    test smears out. The table has the same one-row-per-HUC12 layout, so
+    `{variable}_shift` and `{variable}_cp_p` can be passed to
+    `plot_trend_map` as slope_col and pval_col.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Input DataFrame with 'huc12', the time column and the variables.
+    var_list : list of str
+        Columns to test.
+    sort_yr : str, optional
+        Time column (default is 'irr_year').
+    method : str, optional
+        'pettitt' (rank-based single change point, default) or 'binseg'
+        (binary segmentation for up to max_changes shifts in the mean).
+    alpha : float, optional
+        Significance level (default is 0.05).
+    max_changes, min_size, penalty : optional
+        Binary segmentation settings, see
+        `change_point.binary_segmentation_batch` (the default penalty keeps
+        false changes on noise near alpha).
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per HUC12 with, for every variable:
+        - `{variable}_cp_year`: last year before the (main) shift.
+        - `{variable}_cp_p`: p-value of the shift (Pettitt, or for 'binseg'
+          a Monte Carlo p-value of the best split against Gaussian noise).
+        - `{variable}_mean_before` / `{variable}_mean_after` and
+          `{variable}_shift` (after - before).
+        - `{variable}_change`: 'increase', 'decrease' or 'no change'.
+        - 'binseg' only: `{variable}_n_changes` and `{variable}_cp_years`
+          (all change years, ';'-separated).
+
+    Example
+    -------
+    >>> cp_df = analyze_change_points(df, ['Irr_pcent'], sort_yr='Year')
+    >>> plot_trend_map(gdf.merge(cp_df, on='huc12'), slope_col='Irr_pcent_shift',
+    ...                pval_col='Irr_pcent_cp_p', title='Irrigated area shift')
+    """
+    if method not in change_point.METHODS:
+        raise ValueError(f"Unknown method '{method}'; expected one of {list(change_point.METHODS)}")
+    huc12s = np.unique(df['huc12'].dropna().to_numpy())
+    results = pd.DataFrame({'huc12': huc12s})
+
+    # Values and their years, all variables stacked into one batch
+    matrices, years = {}, {}
+    for var in var_list:
+        try:
+            groups, X = trend_batch.to_matrix(df, 'huc12', sort_yr, var)
+            if len(groups) == len(huc12s):
+                _, T = trend_batch.to_matrix(df, 'huc12', sort_yr, sort_yr)
+                matrices[var] = X
+                years[var] = np.where(np.isnan(X), np.nan, T)
+        except Exception:
+            pass
+    if matrices:
+        width = max(X.shape[1] for X in matrices.values())
+        pad = lambda A: np.pad(A, ((0, 0), (0, width - A.shape[1])), constant_values=np.nan)
+        stacked = np.vstack([pad(X) for X in matrices.values()])
+        labels, _ = trend_batch.compact(np.vstack([pad(T) for T in years.values()]))
+        if method == 'binseg':
+            result = change_point.binary_segmentation_batch(stacked, max_changes=max_changes,
+                                                            min_size=min_size, penalty=penalty,
+                                                            alpha=alpha)
+        else:
+            result = change_point.pettitt_test_batch(stacked, alpha=alpha)
+        rows = np.arange(len(stacked))
+        cp_year = np.where(result['cp'] >= 0, labels[rows, np.maximum(result['cp'], 0)], np.nan)
+
+    columns = ['cp_year', 'cp_p', 'mean_before', 'mean_after', 'shift', 'change']
+    if method == 'binseg':
+        columns += ['n_changes', 'cp_years']
+    for k, var in enumerate(matrices):
+        rows = slice(k * len(huc12s), (k + 1) * len(huc12s))
+        valid = result['valid'][rows]
+        results[f'{var}_cp_year'] = np.where(valid, cp_year[rows], np.nan)
+        results[f'{var}_cp_p'] = np.where(valid, result['p'][rows], np.nan)
+        for key in ('mean_before', 'mean_after', 'shift'):
+            results[f'{var}_{key}'] = np.where(valid, result[key][rows], np.nan)
+        results[f'{var}_change'] = np.where(valid, result['change'][rows], None)
+        if method == 'binseg':
+            results[f'{var}_n_changes'] = np.where(valid, result['n_changes'][rows], 0)
+            cps = result['change_points'][rows]
+            label_rows = labels[rows]
+            results[f'{var}_cp_years'] = [
+                ';'.join(str(int(label_rows[i, c])) for c in cps[i] if c >= 0) if valid[i] else None
+                for i in range(len(cps))
+            ]
+    for var in var_list:
+        if var not in matrices:
+            for col in columns:
+                results[f'{var}_{col}'] = None if col in ('change', 'cp_years') else np.nan
+    return results[['huc12'] + [f'{var}_{col}' for var in var_list for col in columns]]
 
 
 def summarize_trends(trend_df, variables):
@@ -0,0 +1,144 @@
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+# NAD83, the CRS of the PRISM NetCDFs
+CRS_WKT = (
+    'GEOGCS["NAD83",DATUM["North_American_Datum_1983",SPHEROID["GRS 1980",6378137,298.257222101]],'
+    'PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433],AUTHORITY["EPSG","4269"]]'
+)
+
+# Grid origin (upper-left corner) and cell size of the PRISM products
+GRIDS = {
+    'aoi_4km': {'west': -113.0, 'north': 43.5, 'cell': 1 / 24, 'shape': (120, 140)},
+    'conus_4km': {'west': -125.0208333, 'north': 49.9375, 'cell': 1 / 24, 'shape': (621, 1405)},
+    'conus_800m': {'west': -125.0208333, 'north': 49.9375, 'cell': 1 / 120, 'shape': (3105, 7025)},
+}
+
+VARIABLES = ['ppt', 'tmean', 'tmin', 'tmax']
+
+
+def grid_coords(grid):
+    """Cell-centre longitudes and ascending latitudes of a GRIDS entry."""
+    ny, nx = grid['shape']
+    cell = grid['cell']
+    lon = grid['west'] + cell / 2 + np.arange(nx) * cell
+    lat = grid['north'] - cell * ny + cell / 2 + np.arange(ny) * cell
+    return lon, lat
+
+
+def prism_archives(folder, grid_name, months=12, clim_var='ppt', start=(2015, 10)):
+    """
+    Writes PRISM-shaped monthly archives prism_{var}_us_25m_YYYYMM.zip.
+
+    Each archive holds one NetCDF with a float32 'Band1' (lat, lon) grid,
+    a NaN mask outside the "land" area and a 'crs' variable carrying
+    crs_wkt and GeoTransform, like the files served by PRISM. Existing
+    archives are reused.
+
+    Args:
+        folder (str): Output folder.
+        grid_name (str): Key of GRIDS.
+        months (int): Number of monthly archives.
+        clim_var (str): Variable name used in the file names.
+        start (tuple): (year, month) of the first archive.
+
+    Returns:
+        List[str]: Archive paths in time order.
+    """
+    grid = GRIDS[grid_name]
+    os.makedirs(folder, exist_ok=True)
+    lon, lat = grid_coords(grid)
+    ny, nx = grid['shape']
+    cell = grid['cell']
+    geotransform = f"{grid['west']} {cell} 0 {grid['north']} 0 {-cell}"
+    rng = np.random.default_rng(0)
+    land = np.hypot(*np.meshgrid(np.linspace(-1, 1, nx), np.linspace(-1, 1, ny))) < 1.2
+
+    year, month = start
+    paths = []
+    for _ in range(months):
+        name = f"prism_{clim_var}_us_25m_{year}{month:02d}"
+        zip_path = os.path.join(folder, name + '.zip')
+        paths.append(zip_path)
+        if not os.path.exists(zip_path):
+            data = rng.gamma(2, 20, (ny, nx)).astype('float32')
+            data[~land] = np.nan
+            ds = xr.Dataset(
+                {
+                    'Band1': (('lat', 'lon'), data, {'grid_mapping': 'crs'}),
+                    'crs': ((), np.int8(0), {'crs_wkt': CRS_WKT, 'spatial_ref': CRS_WKT,
+                                             'GeoTransform': geotransform}),
+                },
+                coords={'lat': lat, 'lon': lon},
+            )
+            nc_path = os.path.join(folder, name + '.nc')
+            ds.to_netcdf(nc_path, encoding={'Band1': {'zlib': True, 'complevel': 1}})
+            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as zf:
+                zf.write(nc_path, name + '.nc')
+            os.remove(nc_path)
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
+    return paths
+
+
+def huc_ids(n_hucs):
+    """HUC12-like integer identifiers."""
+    return 170402080101 + np.arange(n_hucs, dtype='int64')
+
+
+def huc_polygons(n_hucs, grid_name):
+    """
+    Square polygons tiling the grid extent, one per HUC.
+
+    Returns:
+        geopandas.GeoDataFrame: 'huc12' and geometry in EPSG:4269.
+    """
+    import geopandas as gpd
+    import shapely
+
+    grid = GRIDS[grid_name]
+    ny, nx = grid['shape']
+    cell = grid['cell']
+    cols = int(np.ceil(np.sqrt(n_hucs * nx / ny)))
+    rows = int(np.ceil(n_hucs / cols))
+    width, height = nx * cell / cols, ny * cell / rows
+    k = np.arange(n_hucs)
+    x0 = grid['west'] + (k % cols) * width
+    y1 = grid['north'] - (k // cols) * height
+    boxes = shapely.box(x0, y1 - height, x0 + width, y1)
+    return gpd.GeoDataFrame({'huc12': huc_ids(n_hucs)}, geometry=boxes, crs='EPSG:4269')
+
+
+def huc_monthly_table(n_hucs, n_years, variables=VARIABLES, start_year=1985):
+    """
+    Monthly HUC12 stats table in the 'Date,huc12,ppt,...' layout of
+    *_HUC12_monthly_stats.csv, with a seasonal cycle, trend and noise.
+    """
+    rng = np.random.default_rng(1)
+    dates = pd.date_range(f'{start_year}-01-01', periods=n_years * 12, freq='MS')
+    n_rows = n_hucs * len(dates)
+    months = np.tile(dates.month.to_numpy(), n_hucs)
+    step = np.tile(np.arange(len(dates)), n_hucs)
+    table = {'Date': np.tile(dates.strftime('%Y-%m-%d').to_numpy(), n_hucs),
+             'huc12': np.repeat(huc_ids(n_hucs), len(dates))}
+    for var in variables:
+        season = 10 * np.sin(2 * np.pi * (months - 1) / 12)
+        table[var] = 30 + season + 0.01 * step + rng.normal(0, 5, n_rows)
+    return pd.DataFrame(table)
+
+
+def huc_yearly_table(n_hucs, n_years, variables=VARIABLES, start_year=1985):
+    """Yearly HUC12 table ('huc12', 'year', variables) as fed to analyze_trends."""
+    rng = np.random.default_rng(2)
+    years = np.arange(start_year, start_year + n_years)
+    table = {'huc12': np.repeat(huc_ids(n_hucs), n_years), 'year': np.tile(years, n_hucs)}
+    for var in variables:
+        trend = rng.normal(0, 0.5, n_hucs)
+        table[var] = (np.repeat(trend, n_years) * np.tile(np.arange(n_years), n_hucs)
+                      + rng.normal(0, 10, n_hucs * n_years)).round(2)
+    return pd.DataFrame(table)
@@ -0,0 +1,284 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+for path in (BENCH_DIR, os.path.join(REPO_DIR, 'prism_code'), os.path.join(REPO_DIR, 'analysis', 'utils')):
+    if path not in sys.path:
+        sys.path.append(path)
+
+import fixtures
+
+# HUC table sizes and climate grids per scale
+SCALES = {
+    'small': {'hucs': 46, 'years': 25, 'grid': 'aoi_4km', 'months': 12},
+    'medium': {'hucs': 1000, 'years': 30, 'grid': 'conus_4km', 'months': 12},
+    'large': {'hucs': 10000, 'years': 40, 'grid': 'conus_800m', 'months': 12},
+}
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+DEFAULT_OUTPUT = os.path.join(BENCH_DIR, 'results', 'latest.json')
+DEFAULT_FIXTURES = os.path.join(tempfile.gettempdir(), 'prism_benchmark_fixtures')
+
+
+def _peak_rss_mb():
+    # VmHWM is this process's own high-water mark; ru_maxrss survives exec
+    # and would report the parent's peak in a spawned worker
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+# Stages: each returns (work items, unit) and only times the call under test
+
+def stage_cube(setup, scale, timer):
+    from utils import combine_band1_monthly_to_cube
+    with timer:
+        combine_band1_monthly_to_cube(None, os.path.join(setup['tmp'], 'cube.nc'), 'ppt',
+                                      zip_files=setup['archives'])
+    ny, nx = fixtures.GRIDS[scale['grid']]['shape']
+    return scale['months'] * ny * nx, 'cells/s'
+
+
+def stage_cube_chunked(setup, scale, timer):
+    from utils import build_cube_chunked
+    with timer:
+        build_cube_chunked(None, os.path.join(setup['tmp'], 'cube_chunked.nc'), 'ppt',
+                           zip_files=setup['archives'])
+    ny, nx = fixtures.GRIDS[scale['grid']]['shape']
+    return scale['months'] * ny * nx, 'cells/s'
+
+
+def stage_zonal(setup, scale, timer):
+    from zonal import zonal_stats
+    polygons = fixtures.huc_polygons(scale['hucs'], scale['grid'])
+    with timer:
+        zonal_stats({'ppt': setup['cube']}, polygons, id_col='huc12')
+    return scale['months'] * scale['hucs'], 'rows/s'
+
+
+def stage_csv_load(setup, scale, timer):
+    import pandas as pd
+    with timer:
+        df = pd.read_csv(setup['monthly_csv'])
+    return len(df), 'rows/s'
+
+
+def stage_parquet_load(setup, scale, timer):
+    import stats_store
+    with timer:
+        df = stats_store.read_stats(setup['monthly_store'])
+    return len(df), 'rows/s'
+
+
+def stage_calendar(setup, scale, timer):
+    import pandas as pd
+    import trend_sen
+    df = pd.read_csv(setup['monthly_csv'])
+    with timer:
+        trend_sen.add_calendar_columns(df)
+    return len(df), 'rows/s'
+
+
+def _trends(scale, timer, **kwargs):
+    import trend_sen
+    df = fixtures.huc_yearly_table(scale['hucs'], scale['years'])
+    with timer:
+        trend_sen.analyze_trends(df, fixtures.VARIABLES, sort_yr='year', **kwargs)
+    return scale['hucs'] * len(fixtures.VARIABLES), 'series/s'
+
+
+def stage_trends(setup, scale, timer):
+    return _trends(scale, timer)
+
+
+def stage_trends_hamed_rao(setup, scale, timer):
+    return _trends(scale, timer, method='hamed_rao')
+
+
+STAGES = {
+    'cube': stage_cube,
+    'cube_chunked': stage_cube_chunked,
+    'zonal': stage_zonal,
+    'csv_load': stage_csv_load,
+    'parquet_load': stage_parquet_load,
+    'calendar': stage_calendar,
+    'trends': stage_trends,
+    'trends_hamed_rao': stage_trends_hamed_rao,
+}
+
+
+class _Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.start
+
+
+def _run_stage(name, setup, scale):
+    """Runs one stage in a fresh process so peak RSS belongs to that stage."""
+    timer = _Timer()
+    with tempfile.TemporaryDirectory() as tmp:
+        count, unit = STAGES[name](dict(setup, tmp=tmp), scale, timer)
+    return {'wall_s': timer.seconds, 'peak_rss_mb': _peak_rss_mb(), 'items': count, 'unit': unit}
+
+
+def prepare(scale_name, fixture_dir, stages):
+    """
+    Writes (or reuses) the offline fixtures a scale needs.
+
+    Returns:
+        dict: Paths of the archives, cube, CSV and Parquet store.
+    """
+    from utils import combine_band1_monthly_to_cube
+    import stats_store
+
+    scale = SCALES[scale_name]
+    root = os.path.join(fixture_dir, scale_name)
+    os.makedirs(root, exist_ok=True)
+    setup = {}
+    if {'cube', 'cube_chunked', 'zonal'} & set(stages):
+        print(f"Preparing {scale['grid']} archives in {root}")
+        setup['archives'] = fixtures.prism_archives(os.path.join(root, 'archives'), scale['grid'],
+                                                    scale['months'])
+        setup['cube'] = os.path.join(root, 'cube.nc')
+        if 'zonal' in stages and not os.path.exists(setup['cube']):
+            combine_band1_monthly_to_cube(None, setup['cube'], 'ppt', zip_files=setup['archives'])
+    if {'csv_load', 'parquet_load', 'calendar'} & set(stages):
+        setup['monthly_csv'] = os.path.join(root, 'huc12_monthly_stats.csv')
+        if not os.path.exists(setup['monthly_csv']):
+            print(f"Writing {scale['hucs']} HUCs x {scale['years']} years monthly table")
+            fixtures.huc_monthly_table(scale['hucs'], scale['years']).to_csv(setup['monthly_csv'],
+                                                                             index=False)
+        setup['monthly_store'] = stats_store.csv_to_parquet(setup['monthly_csv'])
+    return setup
+
+
+def run(scales, stages, fixture_dir=DEFAULT_FIXTURES, repeat=1):
+    """
+    Runs every stage at every scale, each repetition in its own process.
+
+    Wall time is the fastest repetition; peak RSS the largest.
+
+    Returns:
+        List[dict]: One record per (stage, scale).
+    """
+    results = []
+    ctx = get_context('spawn')
+    for scale_name in scales:
+        setup = prepare(scale_name, fixture_dir, stages)
+        for name in stages:
+            runs = []
+            for _ in range(repeat):
+                with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                    runs.append(pool.submit(_run_stage, name, setup, SCALES[scale_name]).result())
+            wall = min(r['wall_s'] for r in runs)
+            record = {
+                'stage': name, 'scale': scale_name, 'wall_s': round(wall, 4),
+                'peak_rss_mb': round(max(r['peak_rss_mb'] for r in runs), 1),
+                'throughput': round(runs[0]['items'] / wall, 1) if wall > 0 else None,
+                'unit': runs[0]['unit'], 'items': runs[0]['items'], 'repeat': repeat,
+            }
+            results.append(record)
+            print(f"{name:>18} {scale_name:>6}: {record['wall_s']:9.3f} s  "
+                  f"{record['peak_rss_mb']:8.1f} MB  {record['throughput']:.4g} {record['unit']}")
+    return results
+
+
+def metadata():
+    """Machine and revision the results were measured on."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    import numpy
+    import pandas
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit or None,
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'pandas': pandas.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(results, baseline, threshold=0.2):
+    """
+    Flags stages whose wall time or peak RSS grew by more than threshold
+    relative to the baseline run.
+
+    Returns:
+        List[dict]: Regressions with the stage, scale, metric and ratio.
+    """
+    reference = {(r['stage'], r['scale']): r for r in baseline.get('results', [])}
+    regressions = []
+    for r in results:
+        base = reference.get((r['stage'], r['scale']))
+        if base is None:
+            continue
+        for metric in ('wall_s', 'peak_rss_mb'):
+            if base[metric] and r[metric] > base[metric] * (1 + threshold):
+                regressions.append({'stage': r['stage'], 'scale': r['scale'], 'metric': metric,
+                                    'baseline': base[metric], 'current': r[metric],
+                                    'ratio': round(r[metric] / base[metric], 3)})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the cube, zonal, loader and trend paths")
+    parser.add_argument('--scales', nargs='+', choices=SCALES, default=['small'])
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--repeat', type=int, default=3, help="runs per stage (fastest is kept)")
+    parser.add_argument('--fixture-dir', default=DEFAULT_FIXTURES)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="JSON results file")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="JSON results to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="relative slowdown / memory growth flagged as a regression")
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the baseline")
+    args = parser.parse_args(argv)
+
+    results = run(args.scales, args.stages, args.fixture_dir, args.repeat)
+    report = {'meta': metadata(), 'results': results}
+
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report['baseline'] = baseline['meta']
+        report['regressions'] = compare(results, baseline, args.threshold)
+        for reg in report['regressions']:
+            print(f"REGRESSION {reg['stage']} ({reg['scale']}) {reg['metric']}: "
+                  f"{reg['baseline']} -> {reg['current']} (x{reg['ratio']})")
+        if not report['regressions']:
+            print(f"No regressions against {args.baseline}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f"Saved: {args.output}")
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=1)
+        print(f"Saved baseline: {args.baseline}")
+    return 1 if report.get('regressions') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+import os
+import shutil
+
+import numpy as np
+import xarray as xr
+
+
+def store_encoding(ds, clim_var, time_chunk=240, space_chunk=48):
+    """
+    Zarr chunking for a (time, lat, lon) climate variable.
+
+    The default 240 x 48 x 48 float32 chunk is about 2 MB: a pixel's 40-year
+    monthly history is two chunk reads, while a single map touches one chunk
+    per 48 x 48 pixel tile. Raise time_chunk for time-series work, lower it
+    for map work.
+    """
+    ny, nx = ds.sizes['lat'], ds.sizes['lon']
+    return {clim_var: {'chunks': (time_chunk, min(space_chunk, ny), min(space_chunk, nx))}}
+
+
+def _clean_encoding(ds):
+    # Encodings copied from NetCDF (zlib, chunksizes, ...) are invalid for Zarr
+    for var in ds.variables.values():
+        var.encoding = {}
+    return ds
+
+
+def append_to_store(cube, store_path, clim_var='ppt', time_chunk=240, space_chunk=48):
+    """
+    Adds a cube to the per-variable Zarr store, extending its time axis.
+
+    The first call creates the store with the CRS variable and grid-mapping
+    attributes written by combine_band1_monthly_to_cube. Later calls append
+    time steps newer than the store's last one and overwrite time steps the
+    store already has in place, which is how revised provisional months land.
+    Time steps earlier than (or between) the store's ones, e.g. a backfilled
+    water year, cannot be appended in Zarr; the store is then rewritten in
+    time order through a temporary copy.
+
+    Args:
+        cube (str or xr.Dataset): Water-year cube (path or dataset).
+        store_path (str): Zarr store, e.g. 'climate_store/ppt.zarr'.
+        clim_var (str): Variable name in the cube.
+        time_chunk (int): Chunk length along time for a new store.
+        space_chunk (int): Chunk size along lat and lon for a new store.
+
+    Returns:
+        dict: Number of appended and overwritten time steps.
+    """
+    if isinstance(cube, (str, os.PathLike)):
+        with xr.open_dataset(cube) as ds:
+            return append_to_store(ds, store_path, clim_var, time_chunk, space_chunk)
+    ds = _clean_encoding(cube.sortby('time').copy())
+
+    if not os.path.exists(store_path):
+        os.makedirs(os.path.dirname(os.path.abspath(store_path)), exist_ok=True)
+        ds.to_zarr(store_path, mode='w', encoding=store_encoding(ds, clim_var, time_chunk, space_chunk))
+        print(f"Created {store_path} with {ds.sizes['time']} time steps")
+        return {'appended': ds.sizes['time'], 'overwritten': 0}
+
+    with xr.open_zarr(store_path) as existing:
+        store_times = existing['time'].values
+        store_chunks = existing[clim_var].encoding.get('chunks')
+        if (existing.sizes['lat'], existing.sizes['lon']) != (ds.sizes['lat'], ds.sizes['lon']):
+            raise ValueError(f"Grid of cube does not match {store_path}")
+
+    # Only the time-dependent variable is written after the store exists
+    data = ds[[clim_var]].drop_vars(['lat', 'lon', 'crs', 'spatial_ref'], errors='ignore')
+    in_store = np.isin(data['time'].values, store_times)
+
+    overwritten = 0
+    for t in data['time'].values[in_store]:
+        i = int(np.searchsorted(store_times, t))
+        data.sel(time=[t]).drop_vars('time').to_zarr(store_path, region={'time': slice(i, i + 1)})
+        overwritten += 1
+
+    new = data.isel(time=np.flatnonzero(~in_store))
+    if new.sizes['time']:
+        if new['time'].values[0] > store_times[-1]:
+            new.to_zarr(store_path, append_dim='time')
+        else:
+            if store_chunks:
+                time_chunk, space_chunk = store_chunks[0], store_chunks[1]
+            _rewrite_in_order(ds.isel(time=np.flatnonzero(~in_store)), store_path, clim_var,
+                              time_chunk, space_chunk)
+
+    print(f"Updated {store_path}: {new.sizes['time']} appended, {overwritten} overwritten")
+    return {'appended': int(new.sizes['time']), 'overwritten': overwritten}
+
+
+def _rewrite_in_order(new, store_path, clim_var, time_chunk, space_chunk):
+    """
+    Merges earlier time steps into a store by writing store + new, sorted by
+    time, to a temporary store that then replaces the old one.
+    """
+    tmp_path = store_path.rstrip(os.sep) + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    with xr.open_zarr(store_path) as existing:
+        merged = xr.concat([existing, new], dim='time', data_vars='minimal', coords='minimal',
+                           compat='override').sortby('time')
+        encoding = store_encoding(merged, clim_var, time_chunk, space_chunk)
+        merged = _clean_encoding(merged.chunk(dict(zip(('time', 'lat', 'lon'), encoding[clim_var]['chunks']))))
+        merged.to_zarr(tmp_path, mode='w', encoding=encoding)
+    shutil.rmtree(store_path)
+    os.replace(tmp_path, store_path)
+    print(f"Rewrote {store_path} in time order with {new.sizes['time']} earlier time steps")
+
+
+def open_store(store_path):
+    """
+    Opens a per-variable Zarr store lazily, with the CRS from its 'crs' variable.
+    """
+    ds = xr.open_zarr(store_path)
+    crs_wkt = ds['crs'].attrs.get('crs_wkt') if 'crs' in ds else None
+    if crs_wkt:
+        ds = ds.rio.write_crs(crs_wkt)
+    return ds
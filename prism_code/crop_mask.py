@@ -0,0 +1,151 @@
+import hashlib
+import math
+import os
+
+import numpy as np
+import rasterio
+from rasterio import windows
+from rasterio.transform import array_bounds, from_origin
+from rasterio.warp import reproject, transform_bounds, Resampling
+
+from nlcd import CULTIVATED, NODATA_VALUES, tile_windows
+from zonal import zonal_stats
+
+
+def _grid_transform(lon, lat):
+    """North-up transform of a regular grid given its cell-centre coordinates."""
+    dx = abs(lon[1] - lon[0])
+    dy = abs(lat[1] - lat[0])
+    return from_origin(lon.min() - dx / 2, lat.max() + dy / 2, dx, dy)
+
+
+def _mask_key(nlcd_path, lon, lat, crs_wkt, classes):
+    digest = hashlib.sha1()
+    stat = os.stat(nlcd_path)
+    digest.update(f"{os.path.abspath(nlcd_path)}|{stat.st_size}|{stat.st_mtime}".encode())
+    digest.update(np.ascontiguousarray(lon, dtype='float64').tobytes())
+    digest.update(np.ascontiguousarray(lat, dtype='float64').tobytes())
+    digest.update(f"{crs_wkt}|{sorted(classes)}".encode())
+    return digest.hexdigest()
+
+
+def cultivated_fraction(nlcd_path, lon, lat, crs_wkt, classes=CULTIVATED, cache_dir=None):
+    """
+    Fraction of each climate-grid cell covered by cultivated NLCD classes.
+
+    The 30 m NLCD raster is read window by window (the tile-aligned windows
+    of nlcd.tile_windows) and only where it overlaps the climate grid. Cultivated
+    and valid pixels of each window are summed onto the grid cells, so each
+    cell gets the share of its valid NLCD pixels that are cultivated while
+    memory stays at one window. The result is cached as .npy per raster,
+    grid and class set.
+
+    Args:
+        nlcd_path (str): NLCD GeoTIFF, e.g. analysis2/nlcd_raster/NLCD_2005.tif.
+        lon (array): Cell-centre longitudes (x) of the climate cube.
+        lat (array): Cell-centre latitudes (y) of the climate cube.
+        crs_wkt (str): CRS of the climate grid.
+        classes (tuple): NLCD codes counted as cultivated.
+        cache_dir (str): Folder for cached fraction grids.
+
+    Returns:
+        np.ndarray: (lat, lon) fractions in the cube's own order; NaN where
+        the NLCD raster has no valid pixels.
+    """
+    lon = np.asarray(lon, dtype='float64')
+    lat = np.asarray(lat, dtype='float64')
+    cache_path = None
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        key = _mask_key(nlcd_path, lon, lat, crs_wkt, classes)
+        cache_path = os.path.join(cache_dir, f"cultivated_{key}.npy")
+        if os.path.exists(cache_path):
+            return np.load(cache_path)
+
+    shape = (len(lat), len(lon))
+    dst_transform = _grid_transform(lon, lat)
+    cultivated = np.zeros(shape)
+    valid = np.zeros(shape)
+    with rasterio.open(nlcd_path) as src:
+        grid_bounds = transform_bounds(crs_wkt, src.crs, *array_bounds(*shape, dst_transform))
+        for window in tile_windows(src):
+            left, bottom, right, top = src.window_bounds(window)
+            if (left >= grid_bounds[2] or right <= grid_bounds[0]
+                    or bottom >= grid_bounds[3] or top <= grid_bounds[1]):
+                continue
+            land_cover = src.read(1, window=window)
+            ok = ~np.isin(land_cover, NODATA_VALUES)
+            if not ok.any():
+                continue
+            # Grid cells this window can reach, padded by one cell
+            cells = windows.from_bounds(*transform_bounds(src.crs, crs_wkt, left, bottom, right, top),
+                                        transform=dst_transform)
+            row0 = max(math.floor(cells.row_off) - 1, 0)
+            col0 = max(math.floor(cells.col_off) - 1, 0)
+            row1 = min(math.ceil(cells.row_off + cells.height) + 1, shape[0])
+            col1 = min(math.ceil(cells.col_off + cells.width) + 1, shape[1])
+            if row1 <= row0 or col1 <= col0:
+                continue
+            for source, total in ((np.isin(land_cover, classes), cultivated), (ok, valid)):
+                part = np.zeros((row1 - row0, col1 - col0), dtype='float32')
+                reproject(np.where(ok, source, np.nan).astype('float32'), part,
+                          src_transform=src.window_transform(window), src_crs=src.crs,
+                          src_nodata=np.nan, dst_nodata=0,
+                          dst_transform=dst_transform * dst_transform.translation(col0, row0),
+                          dst_crs=crs_wkt, resampling=Resampling.sum)
+                total[row0:row1, col0:col1] += np.nan_to_num(part)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction = np.where(valid > 0, cultivated / valid, np.nan).astype('float32')
+    # Back to the cube's latitude / longitude order
+    if lat[0] < lat[-1]:
+        fraction = fraction[::-1]
+    if lon[0] > lon[-1]:
+        fraction = fraction[:, ::-1]
+
+    if cache_path:
+        np.save(cache_path, fraction)
+    return fraction
+
+
+def crop_zonal_stats(cubes, polygons, nlcd_path, id_col='UID', classes=CULTIVATED,
+                     percentiles=None, cache_dir=None):
+    """
+    Zonal statistics split into cultivated and non-cultivated parts.
+
+    Local replacement for the Earth Engine 3P mask exports
+    (Pneuf_OpenET_3p_mask.ipynb, gridMET_3P_mask): each cube pixel's
+    polygon weight is multiplied by its cultivated fraction for the
+    '{var}_crop_*' columns and by the remaining fraction for
+    '{var}_non_crop_*', named like the analysis2 OpenET 3P tables
+    (et_crop_mean, et_crop_50th, ...). Non-cultivated is the complement of
+    the cultivated classes.
+
+    Args:
+        cubes (dict): Variable name -> cube path(s), as in zonal.zonal_stats.
+        polygons (str or GeoDataFrame): e.g. the three sub-watersheds
+            (analysis2/shp/portneuf3_clean/portneuf3_clean.shp).
+        nlcd_path (str): NLCD raster the mask is built from.
+        id_col (str): Polygon identifier column.
+        classes (tuple): NLCD codes counted as cultivated.
+        percentiles (list): Optional percentiles, e.g. [25, 50, 75].
+        cache_dir (str): Folder for cached polygon weights and fractions.
+
+    Returns:
+        pandas.DataFrame: 'Date', id_col and per variable and part the
+        '{var}_{part}_{q}th' percentile columns followed by '{var}_{part}_mean',
+        the column order of openet_huc12_*.csv in analysis2.
+    """
+    def split(lon, lat, crs_wkt):
+        fraction = cultivated_fraction(nlcd_path, lon, lat, crs_wkt, classes, cache_dir)
+        return {'_crop': fraction, '_non_crop': 1 - fraction}
+
+    percentiles = list(percentiles or [])
+    df = zonal_stats(cubes, polygons, id_col=id_col, percentiles=percentiles,
+                     cache_dir=cache_dir, pixel_weights=split)
+    columns = ['Date', id_col]
+    for clim_var in cubes:
+        for part in ('crop', 'non_crop'):
+            name = f'{clim_var}_{part}'
+            df = df.rename(columns={name: f'{name}_mean'})
+            columns += [f'{name}_{q:g}th' for q in percentiles] + [f'{name}_mean']
+    return df[columns]
@@ -0,0 +1,299 @@
+import hashlib
+import os
+import random
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+from dateutil.relativedelta import relativedelta
+
+from instrument import stage, count
+
+PRISM_URL = 'https://services.nacse.org/prism/data/get'
+
+# Resolution name used by the web service -> resolution code used in PRISM file names
+RES_CODES = {'4km': '25m', '800m': '30s', '400m': '15s'}
+
+# Date step and date string format for each PRISM time step
+FREQS = {
+    'daily': (relativedelta(days=1), '%Y%m%d'),
+    'monthly': (relativedelta(months=1), '%Y%m'),
+    'annual': (relativedelta(years=1), '%Y'),
+}
+
+# NACSE asks for no more than one request every 2 seconds
+NACSE_RATE = 0.5
+
+# HTTP status codes worth retrying
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket used to pace requests to the PRISM web service.
+
+    Args:
+        rate (float): Tokens added per second (requests per second).
+        capacity (int): Maximum burst size.
+    """
+
+    def __init__(self, rate=NACSE_RATE, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available and consumes it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def prism_filename(clim_var, region, res, date_str):
+    """
+    Builds the archive name PRISM uses, e.g. 'prism_ppt_us_25m_202201.zip'.
+    """
+    return f"prism_{clim_var}_{region}_{RES_CODES.get(res, res)}_{date_str}.zip"
+
+
+def prism_dates(start_date, end_date, freq='monthly'):
+    """
+    Lists PRISM date strings between two dates (inclusive) for a time step.
+
+    Args:
+        start_date (datetime): First date.
+        end_date (datetime): Last date.
+        freq (str): 'daily', 'monthly' or 'annual'.
+
+    Returns:
+        List[str]: Date strings such as '202201'.
+    """
+    step, fmt = FREQS[freq]
+    dates = []
+    current_date = start_date
+    while current_date <= end_date:
+        dates.append(current_date.strftime(fmt))
+        current_date += step
+    return dates
+
+
+def open_session(max_workers=4):
+    """
+    Creates one keep-alive session whose connection pool fits all workers.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def fetch_archive(session, bucket, url, filepath, retries=3, backoff=2.0,
+                  chunk_size=1 << 20, timeout=60, headers=None):
+    """
+    Streams one archive to disk with retries and exponential backoff.
+
+    The body is written to a '.part' file in chunks and only renamed into
+    place once complete, so an interrupted run never leaves a truncated zip.
+
+    Args:
+        session (requests.Session): Shared keep-alive session.
+        bucket (TokenBucket): Rate limiter shared by all workers.
+        url (str): Request URL.
+        filepath (str): Destination path.
+        retries (int): Retries after the first attempt.
+        backoff (float): Base backoff in seconds, doubled per attempt.
+        chunk_size (int): Bytes per streamed chunk.
+        timeout (float): Connect/read timeout in seconds.
+        headers (dict): Extra request headers (e.g. conditional GET headers).
+
+    Returns:
+        dict: status ('downloaded', 'not_modified' or 'failed'), bytes,
+        SHA-256 of the body, attempts, HTTP headers of the final response and
+        an error message.
+    """
+    tmp_path = filepath + '.part'
+    error = None
+    for attempt in range(1, retries + 2):
+        bucket.acquire()
+        try:
+            with session.get(url, stream=True, timeout=timeout, headers=headers) as response:
+                if response.status_code == 304:
+                    return {'status': 'not_modified', 'bytes': 0, 'sha256': None,
+                            'attempts': attempt, 'headers': response.headers, 'error': None}
+                if response.status_code == 200:
+                    nbytes = 0
+                    digest = hashlib.sha256()
+                    with open(tmp_path, 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            f.write(chunk)
+                            digest.update(chunk)
+                            nbytes += len(chunk)
+                    # PRISM answers refusals (e.g. repeated downloads) with a 200 text body
+                    if not zipfile.is_zipfile(tmp_path):
+                        os.remove(tmp_path)
+                        return {'status': 'failed', 'bytes': 0, 'sha256': None,
+                                'attempts': attempt, 'headers': response.headers,
+                                'error': 'response is not a zip archive'}
+                    os.replace(tmp_path, filepath)
+                    return {'status': 'downloaded', 'bytes': nbytes, 'sha256': digest.hexdigest(),
+                            'attempts': attempt, 'headers': response.headers, 'error': None}
+                error = f"HTTP {response.status_code}"
+                if response.status_code not in RETRY_STATUS:
+                    break
+        except requests.RequestException as exc:
+            error = str(exc)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        if attempt <= retries:
+            time.sleep(backoff * 2 ** (attempt - 1) * (1 + random.random()))
+    return {'status': 'failed', 'bytes': 0, 'sha256': None, 'attempts': attempt,
+            'headers': {}, 'error': error}
+
+
+def download_prism(clim_vars, region, res, date_ranges, output_dir, freq='monthly',
+                   max_workers=4, rate=NACSE_RATE, retries=3, backoff=2.0,
+                   chunk_size=1 << 20, timeout=60, base_url=PRISM_URL, manifest=None):
+    """
+    Downloads PRISM archives for many variables and date ranges concurrently.
+
+    A small thread pool shares one keep-alive session, requests are paced by a
+    token bucket set to the NACSE rate limit, bodies are streamed to disk and
+    failed requests are retried with backoff. Archives already in output_dir
+    are skipped, so an interrupted run can simply be started again.
+
+    With a manifest, stable archives are skipped without touching the folder
+    and provisional ones are re-requested with conditional GET headers; a
+    revised archive only replaces the old file when its checksum differs.
+
+    Args:
+        clim_vars (str or list): Climate variables (e.g. ['ppt', 'tmean']).
+        region (str): Region, usually 'us'.
+        res (str): Resolution ('4km', '800m', ...).
+        date_ranges (tuple or list): (start_date, end_date) or a list of them.
+        output_dir (str): Folder for the downloaded zip files.
+        freq (str): 'daily', 'monthly' or 'annual'.
+        max_workers (int): Number of concurrent downloads.
+        rate (float): Requests per second allowed by the service.
+        retries (int): Retries per archive.
+        backoff (float): Base backoff in seconds.
+        chunk_size (int): Bytes per streamed chunk.
+        timeout (float): Request timeout in seconds.
+        base_url (str): Web service root.
+        manifest (manifest.Manifest): Optional archive manifest to consult
+            and update.
+
+    Returns:
+        List[dict]: One record per archive with clim_var, date, url, path,
+        status ('downloaded', 'revised', 'unchanged', 'skipped' or 'failed'),
+        bytes and attempts.
+    """
+    if isinstance(clim_vars, str):
+        clim_vars = [clim_vars]
+    if isinstance(date_ranges, tuple):
+        date_ranges = [date_ranges]
+    os.makedirs(output_dir, exist_ok=True)
+
+    jobs = []
+    seen = set()
+    for clim_var in clim_vars:
+        for start_date, end_date in date_ranges:
+            for date_str in prism_dates(start_date, end_date, freq):
+                if (clim_var, date_str) in seen:
+                    continue
+                seen.add((clim_var, date_str))
+                jobs.append({
+                    'clim_var': clim_var,
+                    'date': date_str,
+                    'url': f"{base_url}/{region}/{res}/{clim_var}/{date_str}?format=nc",
+                    'path': os.path.join(output_dir, prism_filename(clim_var, region, res, date_str)),
+                })
+
+    results = []
+    pending = []
+    for job in jobs:
+        entry = None
+        if manifest is not None:
+            entry = manifest.get(job['clim_var'], region, res, job['date'])
+            if entry is None and os.path.exists(job['path']):
+                manifest.record(job['clim_var'], region, res, job['date'], job['path'])
+                entry = manifest.get(job['clim_var'], region, res, job['date'])
+            if manifest.is_current(entry):
+                results.append({**job, 'path': entry['path'], 'status': 'skipped',
+                                'bytes': 0, 'attempts': 0})
+                continue
+            if entry is not None and not os.path.exists(entry['path']):
+                entry = None
+        elif os.path.exists(job['path']):
+            results.append({**job, 'status': 'skipped', 'bytes': 0, 'attempts': 0})
+            continue
+        pending.append((job, entry))
+    print(f"{len(jobs)} archives requested, {len(results)} up to date on disk")
+
+    bucket = TokenBucket(rate=rate)
+    with stage('download', archives=len(jobs), pending=len(pending)), \
+            open_session(max_workers) as session, ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for job, entry in pending:
+            target = job['path']
+            headers = None
+            if entry is not None:
+                # Provisional archive: fetch next to the old one and compare checksums
+                job['path'] = entry['path']
+                target = entry['path'] + '.new'
+                headers = {key: value for key, value in (('If-None-Match', entry['etag']),
+                           ('If-Modified-Since', entry['last_modified'])) if value}
+            future = pool.submit(fetch_archive, session, bucket, job['url'], target,
+                                 retries, backoff, chunk_size, timeout, headers)
+            futures[future] = (job, entry, target)
+
+        for future in as_completed(futures):
+            job, entry, target = futures[future]
+            outcome = future.result()
+            status = outcome['status']
+            sha256 = outcome['sha256']
+            if status == 'downloaded' and entry is not None:
+                if sha256 == entry['sha256']:
+                    os.remove(target)
+                    status = 'unchanged'
+                else:
+                    os.replace(target, job['path'])
+                    status = 'revised'
+            elif status == 'not_modified':
+                sha256 = entry['sha256']
+                status = 'unchanged'
+
+            if status == 'failed':
+                print(f"Failed to download {job['clim_var']} {job['date']}: {outcome['error']}")
+            else:
+                print(f"{status.capitalize()}: {job['path']}")
+                if manifest is not None:
+                    validators = outcome['headers']
+                    manifest.record(
+                        job['clim_var'], region, res, job['date'], job['path'], sha256=sha256,
+                        etag=validators.get('ETag') or (entry or {}).get('etag'),
+                        last_modified=(validators.get('Last-Modified')
+                                       or (entry or {}).get('last_modified')),
+                    )
+            results.append({**job, 'status': status, 'bytes': outcome['bytes'],
+                            'attempts': outcome['attempts']})
+            count('bytes_downloaded', outcome['bytes'])
+            count('retries', max(outcome['attempts'] - 1, 0))
+            if status in ('downloaded', 'revised'):
+                count('bytes_written', outcome['bytes'])
+                count('files')
+
+    order = {(job['clim_var'], job['date']): i for i, job in enumerate(jobs)}
+    return sorted(results, key=lambda r: order[(r['clim_var'], r['date'])])
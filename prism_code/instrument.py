@@ -0,0 +1,276 @@
+import cProfile
+import functools
+import io
+import json
+import os
+import platform
+import pstats
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Counters stages can accumulate (other names are allowed too)
+COUNTERS = ['bytes_downloaded', 'bytes_read', 'bytes_written', 'files', 'retries']
+
+_ACTIVE = None
+_LOCK = threading.Lock()
+
+
+def _read_peak_mb():
+    """High-water RSS of this process in MB."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def _reset_peak():
+    """Resets the RSS high-water mark (Linux only), so stages get their own peak."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def file_size(path):
+    """Size of a file in bytes, 0 when it does not exist."""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class Run:
+    """
+    Collects stage timings, I/O counters and peak memory for one pipeline run.
+
+    Used as a context manager; while it is active, `stage` and `count` calls
+    anywhere in the process are recorded into it. On exit the run is written
+    as a JSON report and, optionally, as a Chrome trace (open it in
+    chrome://tracing or https://ui.perfetto.dev) with one span per stage.
+
+    Args:
+        name (str): Run name, e.g. 'pipeline'.
+        report_path (str): JSON report to write on exit (None keeps it in memory).
+        trace_path (str): Optional Chrome trace-event file.
+        profile (str): None, 'cprofile' or 'line'. Functions decorated with
+            `profiled` are then profiled (line-level needs line_profiler); the
+            stats go to '<report>.prof' / '<report>.lprof.txt' and the top
+            entries into the report.
+        profile_top (int): Number of profile entries kept in the report.
+    """
+
+    def __init__(self, name, report_path=None, trace_path=None, profile=None, profile_top=25):
+        self.name = name
+        self.report_path = report_path
+        self.trace_path = trace_path
+        self.profile = profile
+        self.profile_top = profile_top
+        self.stages = []
+        self.stack = []
+        self.counters = {}
+        self.profiler = None
+        self.line_profiler = None
+        self.profiling = False
+        self.previous = None
+
+    def __enter__(self):
+        global _ACTIVE
+        self.previous = _ACTIVE
+        self.pid = os.getpid()
+        _ACTIVE = self
+        if self.profile == 'cprofile':
+            self.profiler = cProfile.Profile()
+        elif self.profile == 'line':
+            from line_profiler import LineProfiler
+            self.line_profiler = LineProfiler()
+        self.started = datetime.now().isoformat(timespec='seconds')
+        _reset_peak()
+        self.t0 = time.perf_counter()
+        self.cpu0 = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        global _ACTIVE
+        self.wall_s = time.perf_counter() - self.t0
+        self.cpu_s = time.process_time() - self.cpu0
+        self.peak_rss_mb = max([_read_peak_mb()] + [s['peak_rss_mb'] for s in self.stages
+                                                   if s['pid'] == os.getpid()])
+        _ACTIVE = self.previous
+        if self.report_path:
+            self.save(self.report_path)
+        if self.trace_path:
+            self.save_trace(self.trace_path)
+
+    def add(self, stages):
+        """
+        Adds stage records collected elsewhere, e.g. the `stages` of a Run
+        executed in a worker process.
+        """
+        with _LOCK:
+            self.stages.extend(stages)
+
+    def totals(self):
+        """Counters summed over all stages (each count is held by one stage)."""
+        totals = dict(self.counters)
+        for record in self.stages:
+            for key, value in record['counters'].items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def _profile_summary(self, path):
+        if self.profiler is not None:
+            if path:
+                self.profiler.dump_stats(os.path.splitext(path)[0] + '.prof')
+            stream = io.StringIO()
+            stats = pstats.Stats(self.profiler, stream=stream).sort_stats('cumulative')
+            rows = []
+            for (filename, line, func), (cc, nc, tt, ct, _) in sorted(
+                    stats.stats.items(), key=lambda item: -item[1][3])[:self.profile_top]:
+                rows.append({'function': f"{os.path.basename(filename)}:{line}({func})",
+                             'calls': nc, 'tottime_s': round(tt, 6), 'cumtime_s': round(ct, 6)})
+            return rows
+        if self.line_profiler is not None:
+            stream = io.StringIO()
+            self.line_profiler.print_stats(stream=stream)
+            if path:
+                with open(os.path.splitext(path)[0] + '.lprof.txt', 'w') as f:
+                    f.write(stream.getvalue())
+            return stream.getvalue().splitlines()
+        return None
+
+    def report(self, path=None):
+        """The run as a JSON-serializable dict."""
+        report = {
+            'run': self.name,
+            'started': self.started,
+            'wall_s': round(getattr(self, 'wall_s', time.perf_counter() - self.t0), 4),
+            'cpu_s': round(getattr(self, 'cpu_s', time.process_time() - self.cpu0), 4),
+            'peak_rss_mb': round(getattr(self, 'peak_rss_mb', _read_peak_mb()), 1),
+            'host': {'python': platform.python_version(), 'platform': platform.platform(),
+                     'cpu_count': os.cpu_count(), 'pid': os.getpid()},
+            'totals': self.totals(),
+            'stages': self.stages,
+        }
+        profile = self._profile_summary(path)
+        if profile is not None:
+            report['profile'] = profile
+        return report
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.report(path), f, indent=1)
+        print(f"Saved run report: {path}")
+
+    def save_trace(self, path):
+        events = [{
+            'name': s['name'], 'cat': 'stage', 'ph': 'X', 'pid': s['pid'], 'tid': s['tid'],
+            'ts': round(s['start_unix'] * 1e6), 'dur': round(s['wall_s'] * 1e6),
+            'args': {**s['labels'], **s['counters'], 'cpu_s': s['cpu_s'],
+                     'peak_rss_mb': s['peak_rss_mb']},
+        } for s in self.stages]
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        print(f"Saved trace: {path}")
+
+
+def active_run():
+    """The Run recording in this process, or None."""
+    # A forked worker inherits the parent's run; it must not record into it
+    run = _ACTIVE
+    return run if run is not None and run.pid == os.getpid() else None
+
+
+@contextmanager
+def stage(name, **labels):
+    """
+    Times a block as a named stage of the active run.
+
+    Records wall and CPU time, the peak RSS reached inside the block and the
+    counters added with `count` while it is the innermost stage. Without an
+    active Run this does nothing, so library code can always use it.
+
+    Args:
+        name (str): Stage name, e.g. 'download' or 'cube.decode'.
+        **labels: Extra fields stored with the record (variable, year, ...).
+
+    Yields:
+        dict: The stage record (its 'counters' may also be updated directly).
+    """
+    run = active_run()
+    if run is None:
+        yield {'counters': {}}
+        return
+    parent = run.stack[-1] if run.stack else None
+    record = {'name': name, 'labels': labels, 'parent': parent['name'] if parent else None,
+              'depth': len(run.stack), 'pid': os.getpid(), 'tid': threading.get_ident(),
+              'start_unix': time.time(), 'start_s': round(time.perf_counter() - run.t0, 4),
+              'counters': {}}
+    if parent is not None:
+        # The reset below hides the parent's peak so far; keep it
+        parent['_peak'] = max(parent.get('_peak', 0), _read_peak_mb())
+    _reset_peak()
+    run.stack.append(record)
+    t0, cpu0 = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall_s'] = round(time.perf_counter() - t0, 4)
+        record['cpu_s'] = round(time.process_time() - cpu0, 4)
+        # Nested stages reset the high-water mark and report theirs in '_peak'
+        record['peak_rss_mb'] = round(max(_read_peak_mb(), record.pop('_peak', 0)), 1)
+        run.stack.pop()
+        if parent is not None:
+            parent['_peak'] = max(parent.get('_peak', 0), record['peak_rss_mb'])
+        with _LOCK:
+            run.stages.append(record)
+
+
+def count(key, value=1):
+    """
+    Adds to a counter of the innermost stage (e.g. 'bytes_read', 'retries').
+    """
+    run = active_run()
+    if run is None:
+        return
+    with _LOCK:
+        target = run.stack[-1]['counters'] if run.stack else run.counters
+        target[key] = target.get(key, 0) + value
+
+
+def profiled(func):
+    """
+    Decorator marking a hot function for the opt-in profilers of Run.
+
+    Costs a global lookup per call when profiling is off.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        run = active_run()
+        if (run is None or (run.profiler is None and run.line_profiler is None)
+                or run.profiling or threading.current_thread() is not threading.main_thread()):
+            # Off, nested inside a profiled call, or on a pool thread the
+            # profilers do not follow
+            return func(*args, **kwargs)
+        run.profiling = True
+        try:
+            if run.line_profiler is not None:
+                run.line_profiler.add_function(func)
+                return run.line_profiler.runcall(func, *args, **kwargs)
+            return run.profiler.runcall(func, *args, **kwargs)
+        finally:
+            run.profiling = False
+    return wrapper
@@ -0,0 +1,201 @@
+import hashlib
+import os
+import re
+import sqlite3
+from datetime import datetime
+
+from dateutil.relativedelta import relativedelta
+
+from download import RES_CODES
+
+# PRISM keeps recent grids provisional and revises them for six months
+PROVISIONAL_MONTHS = 6
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS archives (
+    variable TEXT NOT NULL,
+    region TEXT NOT NULL,
+    resolution TEXT NOT NULL,
+    period TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER,
+    sha256 TEXT,
+    stability TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at TEXT,
+    PRIMARY KEY (variable, region, resolution, period)
+)
+"""
+
+COLUMNS = ['variable', 'region', 'resolution', 'period', 'path', 'size', 'sha256',
+           'stability', 'etag', 'last_modified', 'fetched_at']
+
+ARCHIVE_PATTERN = re.compile(r"prism_([^_]+)_([^_]+)_([^_]+)_(\d{4,8})\.zip$")
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """
+    Computes the SHA-256 checksum of a file without loading it into memory.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def prism_stability(period, today=None):
+    """
+    Classifies a PRISM period as 'early', 'provisional' or 'stable'.
+
+    Periods that have not ended yet are 'early', periods that ended within the
+    last six months are 'provisional' and everything older is 'stable'.
+
+    Args:
+        period (str): 'YYYY', 'YYYYMM' or 'YYYYMMDD'.
+        today (datetime): Reference date (defaults to now).
+
+    Returns:
+        str: Stability tag.
+    """
+    today = today or datetime.now()
+    if len(period) == 8:
+        end = datetime.strptime(period, '%Y%m%d') + relativedelta(days=1)
+    elif len(period) == 6:
+        end = datetime.strptime(period, '%Y%m') + relativedelta(months=1)
+    else:
+        end = datetime.strptime(period, '%Y') + relativedelta(years=1)
+    if today < end:
+        return 'early'
+    if today < end + relativedelta(months=PROVISIONAL_MONTHS):
+        return 'provisional'
+    return 'stable'
+
+
+class Manifest:
+    """
+    Persistent SQLite index of downloaded PRISM archives.
+
+    Each (variable, region, resolution, period) maps to the archive path, its
+    size and SHA-256 checksum, the PRISM stability tag, the HTTP validators
+    (ETag / Last-Modified) and the fetch time. Resolutions are stored as the
+    file-name code, so '4km' and '25m' refer to the same entries.
+
+    Args:
+        path (str): SQLite database path.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute(SCHEMA)
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS archives_lookup ON archives (variable, resolution, period)"
+        )
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    @staticmethod
+    def _res(res):
+        return RES_CODES.get(res, res)
+
+    def get(self, variable, region, res, period):
+        """
+        Returns the manifest entry for one archive as a dict, or None.
+        """
+        row = self.conn.execute(
+            "SELECT * FROM archives WHERE variable=? AND region=? AND resolution=? AND period=?",
+            (variable, region, self._res(res), period),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def record(self, variable, region, res, period, path, sha256=None, stability=None,
+               etag=None, last_modified=None, fetched_at=None):
+        """
+        Inserts or replaces the entry for one archive.
+        """
+        self.conn.execute(
+            f"INSERT OR REPLACE INTO archives ({', '.join(COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(COLUMNS))})",
+            (variable, region, self._res(res), period, os.path.abspath(path),
+             os.path.getsize(path), sha256 or file_sha256(path),
+             stability or prism_stability(period), etag, last_modified,
+             fetched_at or datetime.now().isoformat(timespec='seconds')),
+        )
+        self.conn.commit()
+
+    def is_current(self, entry, today=None):
+        """
+        True when an entry is stable and its archive is still on disk, i.e.
+        PRISM will not revise it and it never needs to be fetched again.
+        """
+        return (entry is not None and os.path.exists(entry['path'])
+                and entry['stability'] == 'stable'
+                and prism_stability(entry['period'], today) == 'stable')
+
+    def entries(self, variable, res, start, end, region=None):
+        """
+        Lists manifest entries (dicts) for a variable with start <= period <= end.
+
+        Args:
+            variable (str): Climate variable (e.g., 'ppt').
+            res (str): Resolution ('4km' or its file code '25m').
+            start (str): First period, e.g. '201510'.
+            end (str): Last period, e.g. '201609'.
+            region (str): Optional region filter.
+
+        Returns:
+            List[dict]: Entries sorted by period.
+        """
+        query = ("SELECT * FROM archives WHERE variable=? AND resolution=? "
+                 "AND period>=? AND period<=? AND length(period)=?")
+        params = [variable, self._res(res), start, end, len(start)]
+        if region:
+            query += " AND region=?"
+            params.append(region)
+        query += " ORDER BY period"
+        return [dict(row) for row in self.conn.execute(query, params)]
+
+    def lookup(self, variable, res, start, end, region=None):
+        """
+        Lists archive paths for a variable with start <= period <= end.
+
+        Returns:
+            List[str]: Paths sorted by period (see entries for the arguments).
+        """
+        return [entry['path'] for entry in self.entries(variable, res, start, end, region)]
+
+    def register_folder(self, folder):
+        """
+        Adds archives already on disk that the manifest does not know yet.
+
+        This is a one-off migration step for folders filled before the
+        manifest existed; later runs never need to scan the folder again.
+
+        Returns:
+            int: Number of archives added.
+        """
+        added = 0
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                match = ARCHIVE_PATTERN.match(entry.name)
+                if not match:
+                    continue
+                variable, region, res, period = match.groups()
+                if self.get(variable, region, res, period) is None:
+                    self.record(variable, region, res, period, entry.path)
+                    added += 1
+        print(f"Registered {added} archives from {folder}")
+        return added
@@ -0,0 +1,31 @@
+from rasterio import windows
+
+# Kept in step with analysis/utils/nlcd_raster.py, so the pipeline does not
+# depend on the notebook utilities
+
+# NLCD values that are not land cover (unclassified / fill)
+NODATA_VALUES = (0, 255)
+# Pasture/Hay and Cultivated Crops, the mask of the GEE 3P scripts
+CULTIVATED = (81, 82)
+
+
+def tile_windows(src, tiles_per_side=4):
+    """
+    Groups the raster's native blocks into square windows of
+    tiles_per_side x tiles_per_side blocks (1024 x 1024 pixels for 256-pixel
+    NLCD tiles), so each read is aligned with the GeoTIFF's own tiling.
+
+    Args:
+        src (rasterio.DatasetReader): Open NLCD raster.
+        tiles_per_side (int): Native blocks per window side.
+
+    Returns:
+        List[rasterio.windows.Window]: Windows covering the raster.
+    """
+    block_h, block_w = src.block_shapes[0]
+    step_h, step_w = block_h * tiles_per_side, block_w * tiles_per_side
+    return [
+        windows.Window(col, row, min(step_w, src.width - col), min(step_h, src.height - row))
+        for row in range(0, src.height, step_h)
+        for col in range(0, src.width, step_w)
+    ]
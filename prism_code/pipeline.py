@@ -0,0 +1,393 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from download import download_prism
+from utils import unzip_nc_files, combine_band1_monthly_to_cube
+from manifest import Manifest, prism_stability
+from climate_store import append_to_store
+from zonal import zonal_stats
+from instrument import Run, active_run, stage, count, file_size, profiled
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+HUC12_SHP = os.path.join(BASE_DIR, '..', 'analysis', 'portneuf_huc12', 'portneuf_huc12.shp')
+TREND_UTILS = os.path.join(BASE_DIR, '..', 'analysis', 'utils')
+AOI_SHP = os.path.join(BASE_DIR, '..', 'analysis', 'portneuf_aoi', 'portneuf_aoi.shp')
+
+STAGES = ['download', 'select', 'extract', 'cube', 'store', 'zonal', 'trends']
+# Water-year aggregation of the monthly zonal means for the trend stage
+ANNUAL_AGG = {'ppt': 'sum'}
+
+
+def fingerprint(*parts):
+    """Stable SHA-1 of JSON-serializable stage inputs."""
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def file_fingerprint(path):
+    """(path, size, mtime) of a file, or None when it does not exist."""
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+class PipelineState:
+    """
+    JSON record of the input fingerprint and outputs of every stage run.
+
+    A stage is fresh when its current input fingerprint equals the recorded
+    one and all recorded outputs still exist.
+
+    Args:
+        path (str): State file, e.g. 'pipeline_state.json'.
+        stages (dict): Stage entries to start from instead of reading path.
+    """
+
+    def __init__(self, path=None, stages=None):
+        self.path = path
+        self.stages = dict(stages or {})
+        if stages is None and path and os.path.exists(path):
+            with open(path) as f:
+                self.stages = json.load(f)
+
+    def is_fresh(self, key, inputs):
+        entry = self.stages.get(key)
+        return (entry is not None and entry['inputs'] == inputs
+                and all(os.path.exists(p) for p in entry['outputs']))
+
+    def update(self, key, inputs, outputs):
+        self.stages[key] = {'inputs': inputs, 'outputs': list(outputs),
+                            'updated': datetime.now().isoformat(timespec='seconds')}
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.stages, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+def water_year_periods(year):
+    """'YYYYMM' periods of a water year (Oct of year-1 to Sep of year)."""
+    return [f"{year - 1}{m:02d}" for m in (10, 11, 12)] + [f"{year}{m:02d}" for m in range(1, 10)]
+
+
+def _paths(work_dir, clim_var, year):
+    return {
+        'unzipped': os.path.join(work_dir, 'unzipped', f'{clim_var}_wy{year}'),
+        'cube': os.path.join(work_dir, 'raw_water_years', f'{clim_var}_wy{year}.nc'),
+        'zonal': os.path.join(work_dir, 'zonal_stats', f'{clim_var}_HUC12_monthly_stats_wy{year}.csv'),
+    }
+
+
+def _run_job(job, previous):
+    """
+    Runs the extract, cube and zonal stages of one (variable, water year).
+
+    Executed in a worker process; returns the state entries it produced so
+    the parent process is the only writer of the state file, and the stage
+    records of the job for the parent's run report.
+    """
+    if active_run() is not None:
+        # In-process (max_workers=1): stages go straight to the parent's run
+        return _job_stages(job, previous), []
+    with Run(f"{job['clim_var']}/wy{job['year']}") as run:
+        updates = _job_stages(job, previous)
+    return updates, run.stages
+
+
+def _job_stages(job, previous):
+    state = PipelineState(stages=previous)
+    clim_var, year, paths = job['clim_var'], job['year'], job['paths']
+    archives = job['archives']
+    updates = {}
+
+    key = f"extract/{clim_var}/wy{year}"
+    if job['extract'] and 'extract' in job['stages']:
+        if job['force'] or not state.is_fresh(key, archives['fp']):
+            unzip_nc_files(archives['paths'], paths['unzipped'])
+            updates[key] = (archives['fp'], [paths['unzipped']])
+
+    key = f"cube/{clim_var}/wy{year}"
+    inputs = archives['fp']
+    if job['aoi'] is not None:
+        inputs = fingerprint(archives['fp'], job['aoi_inputs'])
+    if 'cube' in job['stages']:
+        if job['force'] or not state.is_fresh(key, inputs):
+            with stage('cube', clim_var=clim_var, water_year=year):
+                combine_band1_monthly_to_cube(
+                    folder=paths['unzipped'],
+                    output_path=paths['cube'],
+                    clim_var=clim_var,
+                    zip_files=None if job['extract'] else archives['paths'],
+                    aoi=job['aoi'],
+                    aoi_buffer=job['aoi_buffer'],
+                )
+            updates[key] = (inputs, [paths['cube']])
+        else:
+            print(f"Skipping cube {clim_var} wy{year}: up to date")
+
+    key = f"zonal/{clim_var}/wy{year}"
+    if 'zonal' in job['stages']:
+        inputs = fingerprint(file_fingerprint(paths['cube']), job['zonal_inputs'])
+        if job['force'] or not state.is_fresh(key, inputs):
+            with stage('zonal', clim_var=clim_var, water_year=year):
+                stats = zonal_stats({clim_var: paths['cube']}, job['polygons'], id_col=job['id_col'],
+                                    percentiles=job['percentiles'], cache_dir=job['weights_dir'])
+                os.makedirs(os.path.dirname(paths['zonal']), exist_ok=True)
+                stats.to_csv(paths['zonal'], index=False)
+                count('bytes_read', file_size(paths['cube']))
+                count('bytes_written', file_size(paths['zonal']))
+                count('files')
+            updates[key] = (inputs, [paths['zonal']])
+        else:
+            print(f"Skipping zonal {clim_var} wy{year}: up to date")
+    return updates
+
+
+@profiled
+def _trends(zonal_csvs, clim_var, id_col, output_path):
+    """Water-year Mann-Kendall / Sen's slope per polygon from the zonal CSVs."""
+    if TREND_UTILS not in sys.path:
+        sys.path.append(os.path.abspath(TREND_UTILS))
+    import trend_batch
+
+    df = pd.concat([pd.read_csv(p, usecols=['Date', id_col, clim_var]) for p in zonal_csvs],
+                   ignore_index=True)
+    count('bytes_read', sum(file_size(p) for p in zonal_csvs))
+    dates = pd.to_datetime(df['Date'])
+    df['water_year'] = dates.dt.year + (dates.dt.month >= 10)
+    annual = df.groupby([id_col, 'water_year'])[clim_var].agg(ANNUAL_AGG.get(clim_var, 'mean'))
+    annual = annual.reset_index()
+    ids, X = trend_batch.to_matrix(annual, id_col, 'water_year', clim_var)
+    result = trend_batch.original_test_batch(X)
+    valid = result['valid']
+    trends = pd.DataFrame({
+        id_col: ids,
+        f'{clim_var}_slope': np.where(valid, result['slope'], np.nan),
+        f'{clim_var}_p': np.where(valid, result['p'], np.nan),
+        f'{clim_var}_trend': np.where(valid, result['trend'], None),
+    })
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    trends.to_csv(output_path, index=False)
+    count('bytes_written', file_size(output_path))
+    count('files')
+    print(f"Saved: {output_path}")
+
+
+def run_pipeline(variables, water_years, region='us', res='4km', work_dir=BASE_DIR,
+                 polygons=HUC12_SHP, id_col='huc12', percentiles=None, extract=False,
+                 stages=None, max_workers=None, download_workers=4, force=False,
+                 report_path=None, trace_path=None, profile=None, aoi=None, aoi_buffer=2):
+    """
+    Runs download -> select -> extract -> cube -> store -> zonal -> trends.
+
+    Every stage records a fingerprint of its inputs in pipeline_state.json
+    and is skipped when the fingerprint is unchanged and its outputs exist.
+    Archive fingerprints are the manifest checksums, so a nightly refresh
+    that revises or adds a month only rebuilds that water year's cube and
+    zonal table and the trend tables. Downloads run in the parent process
+    (one rate-limited session); the (variable, water year) extract/cube/
+    zonal jobs run in a process pool; store appends are written in water
+    year order by the parent.
+
+    Each run also writes a JSON report with wall/CPU time, bytes
+    downloaded/read/written, file counts, retries and peak memory per stage
+    (see instrument.py), by default to reports/pipeline_<timestamp>.json.
+
+    Args:
+        variables (list): Climate variables, e.g. ['ppt', 'tmean'].
+        water_years (list): Water years, e.g. range(2000, 2025).
+        region (str): PRISM region, usually 'us'.
+        res (str): Resolution ('4km', '800m').
+        work_dir (str): Root folder for all stage outputs.
+        polygons (str): Polygon layer for the zonal stage.
+        id_col (str): Polygon identifier column.
+        percentiles (list): Optional zonal percentiles.
+        extract (bool): Unzip archives instead of reading them in memory.
+        stages (list): Subset of STAGES to run (default all).
+        max_workers (int): Worker processes for the per-year jobs.
+        download_workers (int): Concurrent downloads.
+        force (bool): Re-run stages even when fresh.
+        report_path (str): JSON run report (default under work_dir/reports).
+        trace_path (str): Optional Chrome trace of the stage spans.
+        profile (str): 'cprofile' or 'line' to profile the cube, zonal and
+            trend functions of the main process (use max_workers=1 to
+            include the per-year jobs).
+        aoi (str): Optional AOI polygon file (e.g. AOI_SHP); cubes then only
+            hold its pixel window plus aoi_buffer cells. Use a separate
+            work_dir, as the store keeps one grid per variable.
+        aoi_buffer (int): Cells kept around the AOI bounds.
+
+    Returns:
+        dict: Stage key -> 'ran' or 'skipped'.
+    """
+    if report_path is None:
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        report_path = os.path.join(work_dir, 'reports', f'pipeline_{stamp}.json')
+
+    with Run('pipeline', report_path=report_path, trace_path=trace_path, profile=profile) as run:
+        stages = list(stages or STAGES)
+        water_years = sorted(int(y) for y in water_years)
+        archive_dir = os.path.join(work_dir, 'prism_data_monthly')
+        os.makedirs(archive_dir, exist_ok=True)
+        state = PipelineState(os.path.join(work_dir, 'pipeline_state.json'))
+        report = {}
+
+        with Manifest(os.path.join(archive_dir, 'manifest.sqlite')) as manifest:
+            # Download: months that are stable and on disk are never requested
+            if 'download' in stages:
+                # One date range per water year, so non-contiguous years do not
+                # pull in the years between them
+                year_periods = [[p for p in water_year_periods(y) if prism_stability(p) != 'early']
+                                for y in water_years]
+                periods = [p for months in year_periods for p in months]
+                date_ranges = [(datetime.strptime(months[0], '%Y%m'), datetime.strptime(months[-1], '%Y%m'))
+                               for months in year_periods if months]
+                for clim_var in variables:
+                    key = f"download/{clim_var}"
+                    if not periods:
+                        # Every month is still 'early', e.g. the current water year in October
+                        report[key] = 'skipped'
+                        continue
+                    current = [manifest.is_current(manifest.get(clim_var, region, res, p)) for p in periods]
+                    if not force and all(current):
+                        report[key] = 'skipped'
+                        continue
+                    download_prism(clim_var, region, res, date_ranges, archive_dir,
+                                   max_workers=download_workers, manifest=manifest)
+                    report[key] = 'ran'
+
+            # Select: archives of each water year and their checksums
+            archives = {}
+            with stage('select'):
+                for clim_var in variables:
+                    for year in water_years:
+                        entries = manifest.entries(clim_var, res, f"{year - 1}10", f"{year}09", region)
+                        archives[clim_var, year] = {
+                            'paths': [e['path'] for e in entries],
+                            'fp': fingerprint([(e['period'], e['sha256']) for e in entries]),
+                        }
+                        count('files', len(entries))
+
+        # Extract / cube / zonal per (variable, water year) in a process pool
+        # 25 and 25.0 give the same 'ppt_25th' columns, so they share a fingerprint
+        zonal_inputs = fingerprint(file_fingerprint(polygons), id_col,
+                                   [f'{q:g}' for q in percentiles] if percentiles else None)
+        aoi_inputs = fingerprint(file_fingerprint(aoi), aoi_buffer) if aoi else None
+        jobs = []
+        for (clim_var, year), arch in archives.items():
+            if not arch['paths']:
+                print(f"No archives for {clim_var} wy{year}; skipping")
+                continue
+            jobs.append({
+                'clim_var': clim_var, 'year': year, 'paths': _paths(work_dir, clim_var, year),
+                'archives': arch, 'extract': extract, 'stages': stages, 'force': force,
+                'polygons': polygons, 'id_col': id_col, 'percentiles': percentiles,
+                'weights_dir': os.path.join(work_dir, 'zonal_weights'), 'zonal_inputs': zonal_inputs,
+                'aoi': aoi, 'aoi_buffer': aoi_buffer, 'aoi_inputs': aoi_inputs,
+            })
+        if max_workers == 1:
+            results = [_run_job(job, state.stages) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                results = list(pool.map(_run_job, jobs, [state.stages] * len(jobs)))
+        for updates, records in results:
+            run.add(records)
+            for key, (inputs, outputs) in updates.items():
+                state.update(key, inputs, outputs)
+                report[key] = 'ran'
+        state.save()
+
+        # Store: append rebuilt cubes to the per-variable Zarr store in time order
+        if 'store' in stages:
+            for job in sorted(jobs, key=lambda j: (j['clim_var'], j['year'])):
+                clim_var, year, cube = job['clim_var'], job['year'], job['paths']['cube']
+                store = os.path.join(work_dir, 'climate_store', f'{clim_var}.zarr')
+                key = f"store/{clim_var}/wy{year}"
+                inputs = fingerprint(file_fingerprint(cube))
+                if os.path.exists(cube) and (force or not state.is_fresh(key, inputs)):
+                    with stage('store', clim_var=clim_var, water_year=year):
+                        append_to_store(cube, store, clim_var)
+                        count('bytes_read', file_size(cube))
+                    state.update(key, inputs, [store])
+                    report[key] = 'ran'
+            state.save()
+
+        # Trends: one table per variable over all selected water years
+        if 'trends' in stages:
+            for clim_var in variables:
+                csvs = [job['paths']['zonal'] for job in jobs
+                        if job['clim_var'] == clim_var and os.path.exists(job['paths']['zonal'])]
+                if len(csvs) < 2:
+                    continue
+                output = os.path.join(work_dir, 'trends', f'{clim_var}_HUC12_wy_trends.csv')
+                key = f"trends/{clim_var}"
+                inputs = fingerprint([file_fingerprint(p) for p in csvs])
+                if force or not state.is_fresh(key, inputs):
+                    with stage('trends', clim_var=clim_var, water_years=len(csvs)):
+                        _trends(csvs, clim_var, id_col, output)
+                    state.update(key, inputs, [output])
+                    report[key] = 'ran'
+            state.save()
+
+        for key in state.stages:
+            report.setdefault(key, 'skipped')
+        ran = sum(v == 'ran' for v in report.values())
+        print(f"Pipeline finished: {ran} stages ran, {len(report) - ran} up to date")
+        return report
+
+
+def _years(tokens):
+    years = []
+    for token in tokens:
+        if '-' in token:
+            first, last = map(int, token.split('-'))
+            years.extend(range(first, last + 1))
+        else:
+            years.append(int(token))
+    return years
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Incremental PRISM processing pipeline")
+    parser.add_argument('--vars', nargs='+', default=['ppt'], help="climate variables, e.g. ppt tmean")
+    parser.add_argument('--water-years', nargs='+', required=True,
+                        help="water years, e.g. 2016 or 2000-2024")
+    parser.add_argument('--region', default='us')
+    parser.add_argument('--res', default='4km')
+    parser.add_argument('--work-dir', default=BASE_DIR)
+    parser.add_argument('--polygons', default=HUC12_SHP)
+    parser.add_argument('--id-col', default='huc12')
+    parser.add_argument('--percentiles', nargs='*', type=float, default=None)
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=None)
+    parser.add_argument('--extract', action='store_true', help="unzip archives before building cubes")
+    parser.add_argument('--aoi', nargs='?', const=AOI_SHP, default=None,
+                        help="clip cubes to an AOI polygon file (default: the Portneuf AOI)")
+    parser.add_argument('--aoi-buffer', type=int, default=2, help="cells kept around the AOI")
+    parser.add_argument('--workers', type=int, default=None, help="processes for per-year jobs")
+    parser.add_argument('--download-workers', type=int, default=4)
+    parser.add_argument('--force', action='store_true', help="re-run stages even when up to date")
+    parser.add_argument('--report', default=None, help="JSON run report (default reports/pipeline_<time>.json)")
+    parser.add_argument('--trace', default=None, help="Chrome trace file of the stage spans")
+    parser.add_argument('--profile', choices=['cprofile', 'line'], default=None,
+                        help="profile the hot functions (with --workers 1 to include per-year jobs)")
+    args = parser.parse_args(argv)
+
+    run_pipeline(args.vars, _years(args.water_years), region=args.region, res=args.res,
+                 work_dir=args.work_dir, polygons=args.polygons, id_col=args.id_col,
+                 percentiles=args.percentiles, extract=args.extract, stages=args.stages,
+                 max_workers=args.workers, download_workers=args.download_workers,
+                 force=args.force, report_path=args.report, trace_path=args.trace,
+                 profile=args.profile, aoi=args.aoi, aoi_buffer=args.aoi_buffer)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,33 +1,22 @@
-from datetime import datetime
 import os
-from utils import *
+from pipeline import run_pipeline
 
-clim_var = 'ppt'  # climate variable: ppt, tmin, tmax, etc.
-region = 'us'     # region: usually 'us'
-res = '4km'       # resolution: 4km, 800m, etc.
+clim_vars = ['ppt']  # climate variables: ppt, tmin, tmax, etc.
+region = 'us'        # region: usually 'us'
+res = '4km'          # resolution: 4km, 800m, etc.
 
-year = 2016  # target year for the data
-start_date = datetime(year-1, 10, 1) #YYMMDD for daily, YYYYMM for monthly, YYYY for annual
-end_date = datetime(year, 9, 30)
+water_years = [2016]  # target water years (Oct of year-1 to Sep of year)
 
-# Example usage:
 base_dir = os.path.dirname(os.path.abspath(__file__))
-output_dir = os.path.join(base_dir, 'prism_data_monthly')
-os.makedirs(output_dir, exist_ok=True)
+huc12_shp = os.path.join(base_dir, '..', 'analysis', 'portneuf_huc12', 'portneuf_huc12.shp')
 
-prism_data(clim_var, region, res, start_date, end_date, output_dir)
+# NetCDFs are read straight from the zip archives; set extract = True to
+# unzip them to unzipped/{var}_wy{year} first
+extract = False
 
-files = filter_monthly_files_for_water_year(
-    folder=output_dir,
-    year=year,
-    variable=clim_var,
-    res='25m'  # Adjust resolution as needed
-)
-
-unzip_nc_files(files, f"unzipped/wateryear_{year}")
-
-combine_band1_monthly_to_cube(
-    folder="unzipped/wateryear_2016",
-    output_path=f"raw_water_years/{clim_var}_wy{year}.nc",
-    clim_var=clim_var
-)
+# Downloads, water-year cubes, the Zarr store, HUC12 monthly stats
+# (zonal_stats/{var}_HUC12_monthly_stats_wy{year}.csv) and trends; stages
+# whose inputs are unchanged since the last run are skipped
+if __name__ == '__main__':
+    run_pipeline(clim_vars, water_years, region=region, res=res, work_dir=base_dir,
+                 polygons=huc12_shp, id_col='huc12', extract=extract)
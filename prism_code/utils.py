@@ -1,44 +1,45 @@
-import requests
-from datetime import datetime, timedelta
-from dateutil.relativedelta import relativedelta
-import time
+from datetime import datetime
+import io
 import os
 import re
+import shutil
+import tempfile
+import threading
 import zipfile
 import xarray as xr
 import rioxarray
 from affine import Affine
 import glob
+import math
+from download import download_prism
+from instrument import stage, count, file_size, profiled
 
-def prism_data(clim_var, region, res, start_date=None, end_date=None, output_dir=None):
-    base_url = f'https://services.nacse.org/prism/data/get/{region}/{res}'
-
-    # Download loop
-    current_date = start_date
-    while current_date <= end_date:
-        date_str = current_date.strftime('%Y%m')
-        url = f"{base_url}/{clim_var}/{date_str}?format=nc"
-
-        print(f"Downloading: {url}")
-        response = requests.get(url, allow_redirects=True)
+def prism_data(clim_var, region, res, start_date=None, end_date=None, output_dir=None, max_workers=4,
+               manifest=None):
+    """
+    Downloads monthly PRISM archives for one variable between two dates.
 
-        if response.status_code == 200:
-            if 'content-disposition' in response.headers:
-                filename = response.headers['content-disposition'].split('filename=')[1].strip('"')
-            else:
-                filename = f"{clim_var}_{date_str}.{format}"  # fallback filename
+    Thin wrapper around download.download_prism; archives already in
+    output_dir are skipped and requests are paced to the NACSE rate limit.
 
-            filepath = os.path.join(output_dir, filename)
-            with open(filepath, 'wb') as f:
-                f.write(response.content)
-            print(f"Saved: {filepath}")
-        else:
-            print(f"Failed to download for {date_str}: HTTP {response.status_code}")
+    Args:
+        clim_var (str): Climate variable (e.g., 'ppt').
+        region (str): Region, usually 'us'.
+        res (str): Resolution (e.g., '4km').
+        start_date (datetime): First month to download.
+        end_date (datetime): Last month to download.
+        output_dir (str): Folder for the downloaded zip files.
+        max_workers (int): Number of concurrent downloads.
+        manifest (manifest.Manifest): Optional archive manifest; only
+            provisional months are re-requested.
 
-        time.sleep(2)
-        current_date += relativedelta(months=1)
+    Returns:
+        List[dict]: Per-archive download records.
+    """
+    return download_prism(clim_var, region, res, (start_date, end_date), output_dir,
+                          max_workers=max_workers, manifest=manifest)
 
-def filter_monthly_files_for_water_year(year, variable='ppt', res='4km',folder='prism_data_monthly'):
+def filter_monthly_files_for_water_year(year, variable='ppt', res='4km',folder='prism_data_monthly', manifest=None):
     """
     Filters zipped monthly PRISM NetCDF files for a given water year (Oct–Sep).
 
@@ -49,10 +50,15 @@ def filter_monthly_files_for_water_year(year, variable='ppt', res='4km',folder='
         year (int): Water year to target.
         variable (str): Climate variable (e.g., 'ppt').
         res (str): Resolution (e.g., '4km').
+        manifest (manifest.Manifest): If given, files are looked up in the
+            archive manifest instead of scanning the folder.
 
     Returns:
         List[str]: Sorted list of matching file paths.
     """
+    if manifest is not None:
+        return manifest.lookup(variable, res, f"{year - 1}10", f"{year}09")
+
     pattern = re.compile(
          rf"prism_{variable}_us_{res}_(\d{{6}})\.zip"
     )
@@ -80,72 +86,193 @@ def unzip_nc_files(file_list, dest_folder):
     """
     os.makedirs(dest_folder, exist_ok=True)
 
-    for zip_path in file_list:
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            # Find the .nc file
-            nc_files = [f for f in zip_ref.namelist() if f.endswith('.nc')]
-            for nc_file in nc_files:
-                target_path = os.path.join(dest_folder, os.path.basename(nc_file))
-                if not os.path.exists(target_path):
-                    print(f"Extracting: {nc_file}")
-                    zip_ref.extract(nc_file, dest_folder)
-                else:
-                    print(f"Already extracted: {nc_file}")
+    with stage('extract', archives=len(file_list)):
+        for zip_path in file_list:
+            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+                # Find the .nc file
+                nc_files = [f for f in zip_ref.namelist() if f.endswith('.nc')]
+                for nc_file in nc_files:
+                    target_path = os.path.join(dest_folder, os.path.basename(nc_file))
+                    if not os.path.exists(target_path):
+                        print(f"Extracting: {nc_file}")
+                        zip_ref.extract(nc_file, dest_folder)
+                        count('bytes_read', zip_ref.getinfo(nc_file).compress_size)
+                        count('bytes_written', file_size(target_path))
+                        count('files')
+                    else:
+                        print(f"Already extracted: {nc_file}")
 
 def extract_date_from_filename(filename):
     """
-    Extracts datetime object from filename like 'prism_ppt_us_25m_202201.nc'
+    Extracts datetime object from filename like 'prism_ppt_us_25m_202201.nc' (or .zip)
     """
     base = os.path.basename(filename)
     parts = base.split('_')
-    date_str = parts[-1].replace('.nc', '')
+    date_str = os.path.splitext(parts[-1])[0]
     return datetime.strptime(date_str, "%Y%m")
 
-def combine_band1_monthly_to_cube(folder, output_path, clim_var='ppt'):
+def open_nc_from_zip(zip_path):
     """
-    Combines PRISM monthly NetCDFs into a time-stacked cube with proper CRS and transform.
+    Opens the NetCDF member of a PRISM zip archive in memory, without
+    extracting it to disk.
 
     Args:
-        folder (str): Path to folder with monthly .nc files.
-        output_path (str): Output path for combined NetCDF.
+        zip_path (str): Path to a PRISM .zip archive.
+
+    Returns:
+        Tuple[xr.Dataset, str]: Dataset and the name of the .nc member.
     """
-    # Step 1: Find all NetCDF files
-    nc_files = sorted(glob.glob(os.path.join(folder, "*.nc")))
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        nc_file = next(f for f in zip_ref.namelist() if f.endswith('.nc'))
+        buffer = io.BytesIO(zip_ref.read(nc_file))
+    return xr.open_dataset(buffer), nc_file
+
+def extract_nc_member(zip_path, dest_folder):
+    """
+    Streams the NetCDF member of a PRISM zip archive to a file in dest_folder,
+    so it is decompressed once and can be read lazily from disk.
+
+    Returns:
+        str: Path of the extracted .nc file.
+    """
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        nc_file = next(f for f in zip_ref.namelist() if f.endswith('.nc'))
+        target_path = os.path.join(dest_folder, os.path.basename(nc_file))
+        with zip_ref.open(nc_file) as src, open(target_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 2**20)
+    return target_path
+
+def open_prism_nc(path):
+    """
+    Opens a PRISM NetCDF from either a .nc file or a .zip archive.
+
+    Returns:
+        Tuple[xr.Dataset, str]: Dataset and the NetCDF file name (used for dating).
+    """
+    if path.endswith('.zip'):
+        return open_nc_from_zip(path)
+    return xr.open_dataset(path), path
+
+def list_nc_sources(folder, zip_files=None):
+    """
+    Lists the monthly sources for a cube: the given zip archives, or the .nc
+    files in folder.
+    """
+    if zip_files is not None:
+        nc_files = sorted(zip_files)
+    else:
+        nc_files = sorted(glob.glob(os.path.join(folder, "*.nc")))
     if not nc_files:
         raise FileNotFoundError("No .nc files found in folder.")
+    return nc_files
 
-    data_arrays = []
+def read_reference_grid(path):
+    """
+    Reads the CRS variable, CRS WKT and affine transform of a PRISM NetCDF.
 
-    # Step 2: Use first file for reference CRS and transform
-    ref_ds = xr.open_dataset(nc_files[0])
-    crs_wkt = ref_ds['crs'].attrs.get('crs_wkt')
-    geotransform_str = ref_ds['crs'].attrs.get('GeoTransform')
+    Returns:
+        Tuple[xr.DataArray, str, Affine]: CRS variable, WKT and transform.
+    """
+    ref_ds, _ = open_prism_nc(path)
+    with ref_ds:
+        ref_crs = ref_ds['crs'].load()
+    crs_wkt = ref_crs.attrs.get('crs_wkt')
+    geotransform_str = ref_crs.attrs.get('GeoTransform')
     if not crs_wkt or not geotransform_str:
         raise ValueError("Missing CRS or GeoTransform in reference file.")
-    
+
     geotransform = tuple(map(float, geotransform_str.split()))
-    affine_transform = Affine.from_gdal(*geotransform)
+    return ref_crs, crs_wkt, Affine.from_gdal(*geotransform)
 
-    # Step 3: Load and expand each Band1 into time dimension
-    for f in nc_files:
-        ds = xr.open_dataset(f)
-        band = ds['Band1'].expand_dims(dim='time')
-        band = band.assign_coords(time=[extract_date_from_filename(f)])
-        data_arrays.append(band)
+def aoi_bounds(aoi, crs_wkt=None):
+    """
+    (minx, miny, maxx, maxy) of an AOI in the grid CRS.
 
-    # Step 4: Concatenate into time-series cube
-    combined = xr.concat(data_arrays, dim='time')
+    Args:
+        aoi: Polygon file path, GeoDataFrame / GeoSeries, or bounds already
+            in the grid CRS.
+        crs_wkt (str): Grid CRS the polygons are reprojected to.
+    """
+    if isinstance(aoi, (tuple, list)):
+        return tuple(map(float, aoi))
+    if isinstance(aoi, str):
+        import geopandas as gpd
+        aoi = gpd.read_file(aoi)
+    if crs_wkt and aoi.crs is not None:
+        aoi = aoi.to_crs(crs_wkt)
+    return tuple(map(float, aoi.total_bounds))
+
+def aoi_window(bounds, lat, affine_transform, shape, buffer_cells=2):
+    """
+    Pixel window of AOI bounds on a PRISM grid.
+
+    The window is computed from the GeoTransform (rows counted from the
+    north edge) and grown by buffer_cells on every side, so polygons near
+    the AOI edge keep all the cells they touch.
+
+    Args:
+        bounds (tuple): (minx, miny, maxx, maxy) in the grid CRS.
+        lat (np.ndarray): Latitudes of Band1, ascending or descending.
+        affine_transform (Affine): Transform of the full grid.
+        shape (tuple): (ny, nx) of the full grid.
+        buffer_cells (int): Cells added around the bounds.
+
+    Returns:
+        Tuple[slice, slice, Affine]: lat and lon index slices into Band1 and
+        the transform of the window.
+    """
+    minx, miny, maxx, maxy = bounds
+    t = affine_transform
+    ny, nx = shape
+    col0 = max(math.floor((minx - t.c) / t.a) - buffer_cells, 0)
+    col1 = min(math.ceil((maxx - t.c) / t.a) + buffer_cells, nx)
+    row0 = max(math.floor((maxy - t.f) / t.e) - buffer_cells, 0)
+    row1 = min(math.ceil((miny - t.f) / t.e) + buffer_cells, ny)
+    if col0 >= col1 or row0 >= row1:
+        raise ValueError(f"AOI bounds {bounds} do not overlap the grid.")
+    window_transform = t * Affine.translation(col0, row0)
+    if len(lat) > 1 and lat[0] < lat[-1]:
+        # South-up arrays: GeoTransform row r is array row ny - 1 - r
+        return slice(ny - row1, ny - row0), slice(col0, col1), window_transform
+    return slice(row0, row1), slice(col0, col1), window_transform
+
+def clip_reference_grid(path, aoi, ref_crs, crs_wkt, affine_transform, buffer_cells=2):
+    """
+    Window of an AOI on the grid of a PRISM NetCDF and the CRS variable and
+    transform of the cropped grid.
+
+    Returns:
+        Tuple[tuple, xr.DataArray, Affine]: (lat slice, lon slice), CRS
+        variable with the shifted GeoTransform, and the shifted transform.
+    """
+    ds, _ = open_prism_nc(path)
+    with ds:
+        lat = ds['lat'].values
+        shape = (ds.sizes['lat'], ds.sizes['lon'])
+    lat_slice, lon_slice, transform = aoi_window(aoi_bounds(aoi, crs_wkt), lat, affine_transform,
+                                                 shape, buffer_cells)
+    ref_crs = ref_crs.copy()
+    ref_crs.attrs['GeoTransform'] = ' '.join(map(str, transform.to_gdal()))
+    print(f"Clipping to AOI window {lat_slice.stop - lat_slice.start}x{lon_slice.stop - lon_slice.start} "
+          f"of {shape[0]}x{shape[1]} cells")
+    return (lat_slice, lon_slice), ref_crs, transform
+
+def cube_to_dataset(combined, clim_var, ref_crs, crs_wkt, affine_transform):
+    """
+    Names a (time, lat, lon) cube, attaches CRS and transform and wraps it in
+    a dataset whose grid mapping points at the copied 'crs' variable.
+    """
     combined.name = clim_var
     combined.attrs['units'] = 'mm'
 
-    # Step 5: Apply CRS and transform
+    # Apply CRS and transform
     combined = combined.rio.write_crs(crs_wkt)
     combined.rio.set_spatial_dims(x_dim="lon", y_dim="lat", inplace=True)
     combined.rio.write_transform(affine_transform, inplace=True)
 
-    # Step 6: Build dataset and set grid mapping
+    # Build dataset and set grid mapping
     final_ds = combined.to_dataset(name=clim_var)
-    final_ds['crs'] = ref_ds['crs']  # Copy full CRS metadata
+    final_ds['crs'] = ref_crs  # Copy full CRS metadata
 
     # Safely remove 'grid_mapping' from both attributes and encoding
     if 'grid_mapping' in final_ds[clim_var].attrs:
@@ -155,9 +282,236 @@ def combine_band1_monthly_to_cube(folder, output_path, clim_var='ppt'):
 
     # Now set it
     final_ds[clim_var].attrs['grid_mapping'] = 'crs'
+    return final_ds
+
+@profiled
+def combine_band1_monthly_to_cube(folder, output_path, clim_var='ppt', zip_files=None, aoi=None,
+                                  aoi_buffer=2):
+    """
+    Combines PRISM monthly NetCDFs into a time-stacked cube with proper CRS and transform.
+
+    Args:
+        folder (str): Path to folder with monthly .nc files.
+        output_path (str): Output path for combined NetCDF.
+        zip_files (list): Optional list of PRISM .zip archives. The NetCDF
+            members are read in memory and folder is ignored, so no
+            unzipped/ copy is needed.
+        aoi: Optional AOI (polygon file, GeoDataFrame or grid-CRS bounds).
+            Only its pixel window, grown by aoi_buffer cells, is read from
+            each month and the cube gets the shifted transform.
+        aoi_buffer (int): Cells kept around the AOI bounds.
+    """
+    # Step 1: Find all NetCDF files
+    nc_files = list_nc_sources(folder, zip_files)
+
+    data_arrays = []
+
+    # Step 2: Use first file for reference CRS and transform
+    ref_crs, crs_wkt, affine_transform = read_reference_grid(nc_files[0])
+    window = (slice(None), slice(None))
+    if aoi is not None:
+        window, ref_crs, affine_transform = clip_reference_grid(
+            nc_files[0], aoi, ref_crs, crs_wkt, affine_transform, aoi_buffer)
+
+    # Step 3: Load and expand each Band1 into time dimension
+    with stage('cube.read', files=len(nc_files)):
+        for f in nc_files:
+            ds, nc_name = open_prism_nc(f)
+            with ds:
+                band = ds['Band1'][window].load().expand_dims(dim='time')
+            band = band.assign_coords(time=[extract_date_from_filename(nc_name)])
+            data_arrays.append(band)
+            count('bytes_read', file_size(f))
+            count('files')
+
+    # Step 4: Concatenate into time-series cube
+    with stage('cube.concat'):
+        combined = xr.concat(data_arrays, dim='time')
+
+    # Steps 5-6: Apply CRS and transform, build dataset and set grid mapping
+    final_ds = cube_to_dataset(combined, clim_var, ref_crs, crs_wkt, affine_transform)
 
     # Step 7: Save output NetCDF
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    final_ds.to_netcdf(output_path)
+    with stage('cube.write'):
+        final_ds.to_netcdf(output_path)
+        count('bytes_written', file_size(output_path))
+
+    print(f"✅ Final NetCDF saved to: {output_path}")
+
+class BlockSources:
+    """
+    Hands out readable .nc paths for the blocks of build_cube_chunked.
+
+    A .zip source is extracted to tmp_dir when its first block is read and
+    the file is deleted after its last block, so each time step is
+    decompressed once and blocks are read lazily from disk instead of from
+    an in-memory copy of the whole member. Dask may start the first block of
+    every time step before finishing any of them, so up to all members of
+    the cube can be extracted at once: disk use is bounded by one cube's
+    uncompressed members, not by the blocks in flight.
+
+    Args:
+        blocks_per_source (dict): Source path -> number of blocks read from it.
+        tmp_dir (str): Folder for the extracted members.
+    """
+
+    def __init__(self, blocks_per_source, tmp_dir):
+        self.remaining = dict(blocks_per_source)
+        self.tmp_dir = tmp_dir
+        self.paths = {}
+        self.lock = threading.Lock()
+        self.source_locks = {path: threading.Lock() for path in blocks_per_source}
+
+    def acquire(self, path):
+        if not path.endswith('.zip'):
+            return path
+        with self.source_locks[path]:
+            if path not in self.paths:
+                self.paths[path] = extract_nc_member(path, self.tmp_dir)
+            return self.paths[path]
+
+    def release(self, path):
+        if not path.endswith('.zip'):
+            return
+        with self.lock:
+            self.remaining[path] -= 1
+            done = self.remaining[path] == 0
+        if done:
+            with self.source_locks[path]:
+                os.remove(self.paths.pop(path))
+
+def read_band1_block(path, lat_slice, lon_slice, sources=None):
+    """
+    Reads one (lat, lon) block of Band1 from a PRISM .nc or .zip and closes it.
+
+    With sources (a BlockSources), zip members are read from their extracted
+    file rather than decompressed again for every block.
+    """
+    local_path = sources.acquire(path) if sources is not None else path
+    try:
+        ds, _ = open_prism_nc(local_path)
+        with ds:
+            return ds['Band1'][lat_slice, lon_slice].values
+    finally:
+        if sources is not None:
+            sources.release(path)
+
+def cube_chunks(shape, itemsize, max_memory_mb=256, num_workers=2):
+    """
+    Picks (lat, lon) block sizes so that num_workers blocks in flight stay
+    within max_memory_mb. Whole rows are kept together where possible.
+
+    Returns:
+        dict: Chunk sizes for 'time', 'lat' and 'lon'.
+    """
+    ny, nx = shape
+    budget = max_memory_mb * 2**20 // max(num_workers, 1)
+    row_bytes = nx * itemsize
+    if row_bytes <= budget:
+        return {'time': 1, 'lat': int(min(ny, budget // row_bytes)), 'lon': nx}
+    return {'time': 1, 'lat': 1, 'lon': int(max(1, budget // itemsize))}
+
+@profiled
+def build_cube_chunked(folder, output_path, clim_var='ppt', zip_files=None, chunks=None,
+                       max_memory_mb=256, num_workers=2, complevel=4, aoi=None, aoi_buffer=2):
+    """
+    Out-of-core version of combine_band1_monthly_to_cube.
+
+    Every (time, lat, lon) block is a lazy dask task that opens its source,
+    reads only that block and closes the file again; the cube is written to
+    a chunked, compressed NetCDF block by block. Zip members are extracted
+    once per time step to a temporary folder next to the output and read
+    from there (see BlockSources), which can need up to one cube of
+    uncompressed members in free disk space. Peak memory is about
+    num_workers blocks and does not grow with the number of time steps or
+    the file size.
+
+    Args:
+        folder (str): Path to folder with .nc files.
+        output_path (str): Output path for combined NetCDF.
+        clim_var (str): Name of the output variable.
+        zip_files (list): Optional list of PRISM .zip archives to read in place.
+        chunks (dict): Block sizes for 'lat' and 'lon' (time is always 1).
+            Derived from max_memory_mb when None.
+        max_memory_mb (float): Memory budget for blocks in flight.
+        num_workers (int): Threads reading and writing blocks.
+        complevel (int): zlib compression level of the output.
+        aoi: Optional AOI to clip to, as in combine_band1_monthly_to_cube.
+        aoi_buffer (int): Cells kept around the AOI bounds.
+    """
+    import dask
+    import dask.array as da
+
+    nc_files = list_nc_sources(folder, zip_files)
+    ref_crs, crs_wkt, affine_transform = read_reference_grid(nc_files[0])
+    window = (slice(None), slice(None))
+    if aoi is not None:
+        window, ref_crs, affine_transform = clip_reference_grid(
+            nc_files[0], aoi, ref_crs, crs_wkt, affine_transform, aoi_buffer)
+    lat0 = window[0].start or 0
+    lon0 = window[1].start or 0
+
+    # Grid, attributes and fill value from the first file
+    ref_ds, _ = open_prism_nc(nc_files[0])
+    with ref_ds:
+        band = ref_ds['Band1'][window]
+        lat = band['lat'].values
+        lon = band['lon'].values
+        dtype = band.dtype
+        attrs = dict(band.attrs)
+        fill_value = band.encoding.get('_FillValue')
+    ny, nx = len(lat), len(lon)
+
+    if chunks is None:
+        chunks = cube_chunks((ny, nx), dtype.itemsize, max_memory_mb, num_workers)
+    cy = min(chunks.get('lat', ny), ny)
+    cx = min(chunks.get('lon', nx), nx)
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix='cube_', dir=os.path.dirname(output_path))
+    n_blocks = math.ceil(ny / cy) * math.ceil(nx / cx)
+    sources = BlockSources({f: n_blocks for f in nc_files}, tmp_dir)
+
+    planes = []
+    dates = []
+    for f in nc_files:
+        blocks = [
+            [
+                da.from_delayed(
+                    dask.delayed(read_band1_block)(f, slice(lat0 + i, lat0 + min(i + cy, ny)),
+                                                   slice(lon0 + j, lon0 + min(j + cx, nx)),
+                                                   sources),
+                    shape=(min(cy, ny - i), min(cx, nx - j)),
+                    dtype=dtype,
+                )
+                for j in range(0, nx, cx)
+            ]
+            for i in range(0, ny, cy)
+        ]
+        planes.append(da.block(blocks))
+        dates.append(extract_date_from_filename(f))
+
+    combined = xr.DataArray(
+        da.stack(planes),
+        dims=('time', 'lat', 'lon'),
+        coords={'time': dates, 'lat': lat, 'lon': lon},
+        attrs=attrs,
+    )
+    final_ds = cube_to_dataset(combined, clim_var, ref_crs, crs_wkt, affine_transform)
+
+    encoding = {clim_var: {'chunksizes': (1, cy, cx), 'zlib': True, 'complevel': complevel}}
+    if fill_value is not None:
+        encoding[clim_var]['_FillValue'] = fill_value
+
+    try:
+        with stage('cube.write', chunked=True), \
+                dask.config.set(scheduler='threads', num_workers=num_workers):
+            final_ds.to_netcdf(output_path, encoding=encoding)
+            count('bytes_read', sum(file_size(f) for f in nc_files))
+            count('files', len(nc_files))
+            count('bytes_written', file_size(output_path))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
 
-    print(f"✅ Final NetCDF saved to: {output_path}")
\ No newline at end of file
+    print(f"✅ Final NetCDF saved to: {output_path} ({len(nc_files)} steps, blocks of {cy}x{cx})")
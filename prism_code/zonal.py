@@ -0,0 +1,257 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import xarray as xr
+from scipy import sparse
+
+from instrument import profiled
+
+
+def _cell_edges(centers):
+    """Cell edges for a regular 1-D coordinate (ascending or descending)."""
+    step = centers[1] - centers[0] if len(centers) > 1 else 1.0
+    return np.concatenate([centers - step / 2, [centers[-1] + step / 2]])
+
+
+def _weights_key(polygons, ids, lon, lat, crs_wkt):
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(lon, dtype='float64').tobytes())
+    digest.update(np.ascontiguousarray(lat, dtype='float64').tobytes())
+    digest.update(str(crs_wkt).encode())
+    digest.update('|'.join(map(str, ids)).encode())
+    for geom in polygons.geometry:
+        digest.update(shapely.to_wkb(geom))
+    return digest.hexdigest()
+
+
+def polygon_weights(polygons, lon, lat, crs_wkt=None, id_col='huc12', cache_dir=None):
+    """
+    Builds the sparse polygon x pixel weight matrix for a grid.
+
+    Each weight is the fraction of a grid cell covered by the polygon, found
+    by intersecting the polygon with the cell boxes inside its bounds. Pixels
+    are numbered row-major in the cube's own (lat, lon) order. The matrix is
+    cached as an .npz keyed by a hash of the grid and geometries.
+
+    Args:
+        polygons (str or GeoDataFrame): Polygon layer (e.g. portneuf_huc12.shp).
+        lon (array): Cell-centre longitudes (x) of the cube.
+        lat (array): Cell-centre latitudes (y) of the cube.
+        crs_wkt (str): Grid CRS; polygons are reprojected to it when given.
+        id_col (str): Polygon identifier column ('huc12', 'UID', ...).
+        cache_dir (str): Folder for cached weight matrices.
+
+    Returns:
+        Tuple[scipy.sparse.csr_matrix, np.ndarray]: Weights (n_polygons x
+        n_pixels) and polygon ids in row order.
+    """
+    gdf = gpd.read_file(polygons) if isinstance(polygons, (str, os.PathLike)) else polygons
+    if crs_wkt and gdf.crs is not None:
+        gdf = gdf.to_crs(crs_wkt)
+    ids = gdf[id_col].values
+    lon = np.asarray(lon)
+    lat = np.asarray(lat)
+
+    cache_path = None
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        key = _weights_key(gdf, ids, lon, lat, crs_wkt)
+        cache_path = os.path.join(cache_dir, f"weights_{key}.npz")
+        if os.path.exists(cache_path):
+            cached = np.load(cache_path, allow_pickle=True)
+            weights = sparse.csr_matrix(
+                (cached['data'], cached['indices'], cached['indptr']), shape=tuple(cached['shape'])
+            )
+            return weights, cached['ids']
+
+    x_edges = _cell_edges(lon)
+    y_edges = _cell_edges(lat)
+    x_lo, x_hi = np.minimum(x_edges[:-1], x_edges[1:]), np.maximum(x_edges[:-1], x_edges[1:])
+    y_lo, y_hi = np.minimum(y_edges[:-1], y_edges[1:]), np.maximum(y_edges[:-1], y_edges[1:])
+    nx = len(lon)
+
+    rows, cols, vals = [], [], []
+    for i, geom in enumerate(gdf.geometry):
+        minx, miny, maxx, maxy = geom.bounds
+        col_idx = np.flatnonzero((x_hi > minx) & (x_lo < maxx))
+        row_idx = np.flatnonzero((y_hi > miny) & (y_lo < maxy))
+        if len(col_idx) == 0 or len(row_idx) == 0:
+            continue
+        rr, cc = np.meshgrid(row_idx, col_idx, indexing='ij')
+        rr, cc = rr.ravel(), cc.ravel()
+        boxes = shapely.box(x_lo[cc], y_lo[rr], x_hi[cc], y_hi[rr])
+        shapely.prepare(geom)
+        cover = shapely.area(shapely.intersection(boxes, geom)) / shapely.area(boxes)
+        keep = cover > 0
+        rows.append(np.full(keep.sum(), i))
+        cols.append(rr[keep] * nx + cc[keep])
+        vals.append(cover[keep])
+
+    weights = sparse.csr_matrix(
+        (np.concatenate(vals) if vals else [], (np.concatenate(rows) if rows else [],
+                                               np.concatenate(cols) if cols else [])),
+        shape=(len(gdf), len(lat) * nx),
+    )
+    if cache_path:
+        np.savez_compressed(cache_path, data=weights.data, indices=weights.indices,
+                            indptr=weights.indptr, shape=weights.shape, ids=ids)
+    return weights, ids
+
+
+def weighted_percentiles(values, weights, percentiles):
+    """
+    Weighted percentiles along the last axis, ignoring NaN values.
+
+    Args:
+        values (array): (..., m) values; NaN marks missing pixels.
+        weights (array): (..., m) non-negative weights (broadcastable).
+        percentiles (list): Percentiles in [0, 100].
+
+    Returns:
+        np.ndarray: (len(percentiles), ...) array; NaN where no valid pixel.
+    """
+    weights = np.where(np.isnan(values), 0.0, np.broadcast_to(weights, values.shape))
+    order = np.argsort(values, axis=-1)
+    v = np.take_along_axis(values, order, axis=-1)
+    w = np.take_along_axis(weights, order, axis=-1)
+    cum = np.cumsum(w, axis=-1)
+    total = cum[..., -1:]
+    out = []
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cdf = cum / total
+        for q in percentiles:
+            idx = np.argmax(cdf >= q / 100 - 1e-12, axis=-1)
+            res = np.take_along_axis(v, idx[..., None], axis=-1)[..., 0]
+            out.append(np.where(total[..., 0] > 0, res, np.nan))
+    return np.stack(out)
+
+
+def _zonal_block(block, weights, pad_idx, pad_w, percentiles):
+    """Means (and percentiles) of one (time, pixel) block for all polygons."""
+    valid = ~np.isnan(block)
+    filled = np.where(valid, block, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = (weights @ filled.T) / (weights @ valid.T.astype(float))
+    stats = {'mean': means}
+    if percentiles:
+        vals = block[:, pad_idx]                     # (time, polygon, max_pixels)
+        vals = np.where(pad_w > 0, vals, np.nan)
+        pct = weighted_percentiles(vals, pad_w, percentiles)
+        for q, arr in zip(percentiles, pct):
+            stats[q] = arr.T                         # (polygon, time)
+    return stats
+
+
+def _open_cube(source):
+    if isinstance(source, xr.Dataset):
+        return source
+    if str(source).endswith('.zarr'):
+        return xr.open_zarr(source)
+    return xr.open_dataset(source)
+
+
+def _zonal_frames(data, weights, ids, times, id_col, name, percentiles, time_block):
+    """Zonal tables of one (time, lat, lon) variable for one weight matrix."""
+    # Restrict to the pixels any polygon touches
+    weights.eliminate_zeros()
+    used = np.unique(weights.indices)
+    sub = weights[:, used].tocsr()
+    counts = np.diff(sub.indptr)
+    pad_idx = np.zeros((len(ids), max(counts.max(initial=0), 1)), dtype=int)
+    pad_w = np.zeros(pad_idx.shape)
+    for p in range(len(ids)):
+        start, end = sub.indptr[p], sub.indptr[p + 1]
+        pad_idx[p, :end - start] = sub.indices[start:end]
+        pad_w[p, :end - start] = sub.data[start:end]
+
+    # Read only the lat/lon window around those pixels, not the whole grid
+    nx = data.sizes['lon']
+    rows, cols = np.divmod(used, nx)
+    r0, c0 = rows.min(initial=0), cols.min(initial=0)
+    window = {'lat': slice(r0, rows.max(initial=0) + 1), 'lon': slice(c0, cols.max(initial=0) + 1)}
+    wx = window['lon'].stop - c0
+    local = (rows - r0) * wx + (cols - c0)
+
+    frames = []
+    for t0 in range(0, len(times), time_block):
+        t1 = min(t0 + time_block, len(times))
+        block = data.isel(time=slice(t0, t1), **window).transpose('time', 'lat', 'lon').values
+        block = block.reshape(t1 - t0, -1)[:, local].astype('float64')
+        stats = _zonal_block(block, sub, pad_idx, pad_w, percentiles)
+        frame = pd.DataFrame({
+            'Date': np.repeat(times[t0:t1].strftime('%Y-%m-%d'), len(ids)),
+            id_col: np.tile(ids, t1 - t0),
+            name: stats['mean'].T.ravel(),
+        })
+        for q in percentiles:
+            frame[f'{name}_{q:g}th'] = stats[q].T.ravel()
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+
+@profiled
+def zonal_stats(cubes, polygons, id_col='huc12', percentiles=None, cache_dir=None,
+                time_block=120, pixel_weights=None):
+    """
+    Zonal means (and optional percentiles) of PRISM cubes for every polygon
+    and time step, computed locally from precomputed sparse weights.
+
+    Args:
+        cubes (dict): Variable name -> cube path, Zarr store, dataset or a
+            list of those (e.g. one cube per water year).
+        polygons (str or GeoDataFrame): Polygons such as
+            analysis/portneuf_huc12/portneuf_huc12.shp.
+        id_col (str): Polygon identifier column ('huc12' or 'UID').
+        percentiles (list): Optional percentiles, written as '{var}_{q}th'
+            ('ppt_25th' for 25 or 25.0, 'ppt_97.5th' for 97.5).
+        cache_dir (str): Folder for cached weight matrices.
+        time_block (int): Time steps processed per block.
+        pixel_weights (callable): Optional f(lon, lat, crs_wkt) returning
+            {suffix: (lat, lon) array} of per-pixel weights in [0, 1], e.g. a
+            cultivated fraction; each entry gives '{var}{suffix}' columns
+            aggregated over the weighted pixels only.
+
+    Returns:
+        pandas.DataFrame: Long table 'Date', id_col, one column per variable
+        (polygon mean) plus percentile columns, like the
+        *_HUC12_monthly_stats.csv tables.
+    """
+    gdf = gpd.read_file(polygons) if isinstance(polygons, (str, os.PathLike)) else polygons
+    percentiles = list(percentiles or [])
+    tables = []
+    for clim_var, sources in cubes.items():
+        if not isinstance(sources, (list, tuple)):
+            sources = [sources]
+        frames = []
+        for source in sources:
+            ds = _open_cube(source)
+            data = ds[clim_var]
+            crs_wkt = ds['crs'].attrs.get('crs_wkt') if 'crs' in ds else None
+            weights, ids = polygon_weights(gdf, ds['lon'].values, ds['lat'].values, crs_wkt,
+                                           id_col=id_col, cache_dir=cache_dir)
+            variants = {'': None}
+            if pixel_weights is not None:
+                variants = pixel_weights(ds['lon'].values, ds['lat'].values, crs_wkt)
+
+            times = pd.to_datetime(data['time'].values)
+            parts = []
+            for suffix, pixel_w in variants.items():
+                scaled = weights if pixel_w is None else weights.multiply(
+                    np.nan_to_num(np.asarray(pixel_w, dtype='float64')).ravel()[None, :]).tocsr()
+                part = _zonal_frames(data, scaled, ids, times, id_col, f'{clim_var}{suffix}',
+                                     percentiles, time_block)
+                # Variants share the (Date, id) rows, so only their values are added
+                parts.append(part if not parts else part.drop(columns=['Date', id_col]))
+            frames.append(pd.concat(parts, axis=1))
+            if not isinstance(source, xr.Dataset):
+                ds.close()
+        tables.append(pd.concat(frames, ignore_index=True))
+
+    result = tables[0]
+    for table in tables[1:]:
+        result = result.merge(table, on=['Date', id_col], how='outer', sort=False)
+    return result
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The pipeline and the notebook utilities are flat module folders, imported
+# the same way the notebooks and prism_main.py do
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (os.path.join(REPO_DIR, 'prism_code'), os.path.join(REPO_DIR, 'analysis', 'utils')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+import change_point
+
+
+def pettitt_reference(x):
+    """
+    Pettitt (1979) test from its definition, as in pyhomogeneity.pettitt_test
+    with sim=None: U_t = sum_{i<=t} sum_{j>t} sign(x_j - x_i), cp counted from 1.
+    """
+    x = x[~np.isnan(x)]
+    n = len(x)
+    U = np.array([np.sign(x[t:][None, :] - x[:t][:, None]).sum() for t in range(1, n + 1)])
+    loc = np.argmax(np.abs(U)) + 1
+    K = np.max(np.abs(U))
+    p = 2 * np.exp(-6 * K ** 2 / (n ** 3 + n ** 2))
+    return loc, K, p, x[:loc].mean(), x[loc:].mean() if loc < n else np.nan
+
+
+def shifted_series(n_series=80, n_time=30, seed=0):
+    """Rows with and without a mean shift, ties, NaN gaps and unequal lengths."""
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n_series, n_time))
+    cp = rng.integers(5, n_time - 5, size=n_series)
+    X += np.where(np.arange(n_time) > cp[:, None], rng.normal(0, 2, size=(n_series, 1)), 0)
+    X[::4] = np.round(X[::4])
+    X[rng.random(X.shape) < 0.1] = np.nan
+    lengths = rng.integers(10, n_time + 1, size=n_series)
+    X[np.arange(n_time) >= lengths[:, None]] = np.nan
+    return X
+
+
+def test_pettitt_matches_reference():
+    X = shifted_series()
+    result = change_point.pettitt_test_batch(X)
+    for i, row in enumerate(X):
+        loc, K, p, mean_before, mean_after = pettitt_reference(row)
+        assert result['cp'][i] + 1 == loc, i
+        assert result['K'][i] == pytest.approx(K)
+        assert result['p'][i] == pytest.approx(min(p, 1.0), rel=1e-9)
+        assert result['h'][i] == (p < 0.05)
+        assert result['mean_before'][i] == pytest.approx(mean_before, rel=1e-9)
+        np.testing.assert_allclose(result['mean_after'][i], mean_after, rtol=1e-9)
+
+
+def test_pettitt_short_rows_are_invalid():
+    X = np.array([[1.0, 2.0, np.nan, np.nan], [1.0, 2.0, 3.0, np.nan]])
+    result = change_point.pettitt_test_batch(X)
+    assert result['valid'].tolist() == [False, True]
+    assert np.isnan(result['p'][0])
+    assert not result['h'][0]
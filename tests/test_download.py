@@ -0,0 +1,157 @@
+import io
+import os
+import threading
+import zipfile
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from download import TokenBucket, download_prism, fetch_archive, open_session, prism_filename
+
+
+def archive_bytes(name='data.nc', payload=b'\x00' * 4096):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        zf.writestr(name, payload)
+    return buffer.getvalue()
+
+
+class StubPrism:
+    """
+    Local stand-in for the PRISM web service on 127.0.0.1.
+
+    Every path gets a small zip archive; `plan` holds scripted responses per
+    path ('503', 'truncated' or 'text'), consumed one per request.
+    """
+
+    def __init__(self):
+        self.plan = {}
+        self.hits = []
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                with stub.lock:
+                    stub.hits.append(path)
+                    queue = stub.plan.get(path, [])
+                    action = queue.pop(0) if queue else 'ok'
+                body = archive_bytes(path.strip('/').replace('/', '_') + '.nc')
+                if action == '503':
+                    self.send_response(503)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if action == 'text':
+                    body = b'You have exceeded the allowed number of downloads'
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/zip')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                # A truncated body announces the full length but stops halfway
+                self.wfile.write(body[:len(body) // 2] if action == 'truncated' else body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    with StubPrism() as server:
+        yield server
+
+
+def fetch(stub, path, filepath, retries=3):
+    with open_session(1) as session:
+        return fetch_archive(session, TokenBucket(rate=1000), stub.url + path, str(filepath),
+                             retries=retries, backoff=0.01)
+
+
+def test_fetch_streams_to_part_file_then_renames(stub, tmp_path, monkeypatch):
+    target = tmp_path / 'a.zip'
+    renames = []
+    real_replace = os.replace
+    monkeypatch.setattr(os, 'replace', lambda src, dst: (renames.append((src, dst)), real_replace(src, dst)))
+    result = fetch(stub, '/us/4km/ppt/202201', target)
+    assert result['status'] == 'downloaded'
+    assert renames == [(str(target) + '.part', str(target))]
+    assert zipfile.is_zipfile(target)
+    assert not os.path.exists(str(target) + '.part')
+    assert result['bytes'] == target.stat().st_size
+
+
+@pytest.mark.parametrize('failures', [['503'], ['503', '503'], ['truncated'], ['503', 'truncated']])
+def test_fetch_retries_transient_failures(stub, tmp_path, failures):
+    stub.plan['/us/4km/ppt/202201'] = list(failures)
+    target = tmp_path / 'a.zip'
+    result = fetch(stub, '/us/4km/ppt/202201', target)
+    assert result['status'] == 'downloaded'
+    assert result['attempts'] == len(failures) + 1
+    assert zipfile.is_zipfile(target)
+    assert os.listdir(tmp_path) == ['a.zip']
+
+
+def test_fetch_gives_up_after_retries(stub, tmp_path):
+    stub.plan['/us/4km/ppt/202201'] = ['503'] * 3
+    result = fetch(stub, '/us/4km/ppt/202201', tmp_path / 'a.zip', retries=2)
+    assert result['status'] == 'failed'
+    assert result['attempts'] == 3
+    assert result['error'] == 'HTTP 503'
+    assert os.listdir(tmp_path) == []
+
+
+def test_fetch_rejects_non_zip_body(stub, tmp_path):
+    stub.plan['/us/4km/ppt/202201'] = ['text']
+    result = fetch(stub, '/us/4km/ppt/202201', tmp_path / 'a.zip')
+    assert result['status'] == 'failed'
+    assert result['error'] == 'response is not a zip archive'
+    assert os.listdir(tmp_path) == []
+
+
+def download(stub, clim_vars, date_ranges, output_dir):
+    return download_prism(clim_vars, 'us', '4km', date_ranges, str(output_dir), max_workers=3,
+                          rate=1000, backoff=0.01, base_url=stub.url)
+
+
+def test_download_many_variables_and_ranges(stub, tmp_path):
+    ranges = [(datetime(2021, 11, 1), datetime(2022, 1, 1)), (datetime(2021, 12, 1), datetime(2022, 2, 1))]
+    results = download(stub, ['ppt', 'tmean'], ranges, tmp_path)
+    expected = [(var, date) for var in ('ppt', 'tmean') for date in ('202111', '202112', '202201', '202202')]
+    # Overlapping ranges are fetched once and results keep the request order
+    assert [(r['clim_var'], r['date']) for r in results] == expected
+    assert all(r['status'] == 'downloaded' for r in results)
+    assert sorted(stub.hits) == sorted(f"/us/4km/{var}/{date}" for var, date in expected)
+    for var, date in expected:
+        path = tmp_path / prism_filename(var, 'us', '4km', date)
+        with zipfile.ZipFile(path) as zf:
+            assert zf.namelist() == [f"us_4km_{var}_{date}.nc"]
+
+
+def test_download_resumes_without_refetching(stub, tmp_path):
+    ranges = (datetime(2022, 1, 1), datetime(2022, 4, 1))
+    stub.plan['/us/4km/ppt/202203'] = ['503'] * 4
+    first = download(stub, 'ppt', ranges, tmp_path)
+    assert [r['status'] for r in first] == ['downloaded', 'downloaded', 'failed', 'downloaded']
+    on_disk = {p: os.path.getmtime(tmp_path / p) for p in os.listdir(tmp_path)}
+    assert not any(p.endswith('.part') for p in on_disk)
+
+    stub.hits.clear()
+    second = download(stub, 'ppt', ranges, tmp_path)
+    assert [r['status'] for r in second] == ['skipped', 'skipped', 'downloaded', 'skipped']
+    assert stub.hits == ['/us/4km/ppt/202203']
+    for name, mtime in on_disk.items():
+        assert os.path.getmtime(tmp_path / name) == mtime
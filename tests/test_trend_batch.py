@@ -0,0 +1,61 @@
+import numpy as np
+import pymannkendall as mk
+import pytest
+
+import trend_batch
+
+REFERENCE = {
+    'original': mk.original_test,
+    'hamed_rao': mk.hamed_rao_modification_test,
+    'yue_wang': mk.yue_wang_modification_test,
+    'pre_whitening': mk.pre_whitening_modification_test,
+}
+
+
+def ragged_series(n_series=60, n_time=30, seed=0):
+    """
+    Trending, autocorrelated and tied rows with NaN gaps and unequal lengths.
+
+    pymannkendall skips NaN values for S but keeps their time positions in
+    Sen's slope, so rows are compared with their gaps in place.
+    """
+    rng = np.random.default_rng(seed)
+    X = np.cumsum(rng.normal(size=(n_series, n_time)), axis=1) * 0.3
+    X += rng.normal(0, 0.5, size=(n_series, 1)) * np.arange(n_time)
+    X[::5] = np.round(X[::5])
+    X[rng.random(X.shape) < 0.1] = np.nan
+    lengths = rng.integers(12, n_time + 1, size=n_series)
+    X[np.arange(n_time) >= lengths[:, None]] = np.nan
+    return X
+
+
+@pytest.mark.parametrize('method', list(REFERENCE))
+def test_batch_matches_pymannkendall(method):
+    X = ragged_series()
+    result = trend_batch.trend_test_batch(X, method)
+    for i, row in enumerate(X):
+        expected = REFERENCE[method](row)
+        assert result['trend'][i] == expected.trend, i
+        assert result['h'][i] == expected.h, i
+        np.testing.assert_allclose(result['p'][i], expected.p, rtol=1e-9, atol=1e-12)
+        np.testing.assert_allclose(result['z'][i], expected.z, rtol=1e-9, atol=1e-12)
+        np.testing.assert_allclose(result['Tau'][i], expected.Tau, rtol=1e-9)
+        np.testing.assert_allclose(result['s'][i], expected.s)
+        np.testing.assert_allclose(result['var_s'][i], expected.var_s, rtol=1e-9)
+        np.testing.assert_allclose(result['slope'][i], expected.slope, rtol=1e-9, atol=1e-12)
+        np.testing.assert_allclose(result['intercept'][i], expected.intercept, rtol=1e-9, atol=1e-12)
+
+
+def test_seasonal_matches_pymannkendall():
+    rng = np.random.default_rng(1)
+    years, period = 8, 12
+    X = rng.normal(size=(20, years * period)) + np.sin(np.arange(years * period) / period * 2 * np.pi)
+    X += rng.normal(0, 0.02, size=(20, 1)) * np.arange(years * period)
+    result = trend_batch.seasonal_test_batch(X, period=period)
+    for i, row in enumerate(X):
+        expected = mk.seasonal_test(row, period=period)
+        assert result['trend'][i] == expected.trend, i
+        np.testing.assert_allclose(result['p'][i], expected.p, rtol=1e-9, atol=1e-12)
+        np.testing.assert_allclose(result['s'][i], expected.s)
+        np.testing.assert_allclose(result['var_s'][i], expected.var_s, rtol=1e-9)
+        np.testing.assert_allclose(result['slope'][i], expected.slope, rtol=1e-9, atol=1e-12)